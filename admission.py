@@ -0,0 +1,195 @@
+import math
+import os
+import threading
+import time
+
+
+ADMISSION_MAX_RUNNING = int(os.environ.get('OBJVIZ_MAX_TRAVERSALS', 4)) # searches run at once against each database
+ADMISSION_MAX_QUEUED = int(os.environ.get('OBJVIZ_MAX_QUEUED', 16)) # searches that may wait for one of those slots before more are turned away
+ADMISSION_QUEUE_TIMEOUT = 10 # seconds a search waits for a slot before it is turned away
+RETRY_AFTER_MAX = 60 # the longest Retry-After sent, in seconds
+
+
+class Overloaded(Exception):
+	"""
+	Raised when a search is turned away because its database already has as many searches running and waiting as it
+	is allowed
+	"""
+	def __init__(self, message, cost, retry_after):
+		"""
+		Initializes an Overloaded exception
+		:param message: what happened
+		:type message: str
+		:param cost: the estimated cost of the search that was turned away
+		:type cost: int
+		:param retry_after: how many seconds the client should wait before trying again
+		:type retry_after: int
+		"""
+		super().__init__(message)
+		self.cost = cost
+		self.retry_after = retry_after
+
+
+class SingleFlight:
+	"""
+	Runs at most one call at a time per key: callers that arrive while a call with the same key is running wait for it
+	and share its result (or its exception) instead of making their own
+	"""
+	def __init__(self):
+		"""
+		Initializes a SingleFlight object
+		"""
+		self.calls = {} # key -> [event set when the call finishes, its result, the exception it raised]
+		self.lock = threading.Lock()
+
+	def do(self, key, fn, *args, **kwargs):
+		"""
+		Calls a function, or waits for the call already running with the same key
+		:param key: what identifies calls that give the same result
+		:type key: tuple
+		:param fn: the function
+		:type fn: callable
+		:returns: the function's result, and whether it came from another caller's call
+		:rtype: tuple (any, bool)
+		"""
+		with self.lock:
+			call = self.calls.get(key)
+			leader = call is None
+			if leader:
+				call = [threading.Event(), None, None]
+				self.calls[key] = call
+		if not leader:
+			call[0].wait()
+			if call[2] is not None:
+				raise call[2]
+			return (call[1], True)
+		try:
+			call[1] = fn(*args, **kwargs)
+		except Exception as e:
+			call[2] = e
+			raise
+		finally:
+			with self.lock:
+				del self.calls[key]
+			call[0].set()
+		return (call[1], False)
+
+
+class AdmissionLimiter:
+	"""
+	Bounds the searches run at once against one database: up to max_running run, up to max_queued more wait in arrival
+	order for a slot, and the rest are turned away with an Overloaded exception saying when to try again. The wait is
+	estimated from each search's cost, its depth limit times its object limit, and the time searches have taken per
+	unit of cost so far
+	"""
+	def __init__(self, max_running = ADMISSION_MAX_RUNNING, max_queued = ADMISSION_MAX_QUEUED):
+		"""
+		Initializes an AdmissionLimiter object
+		:param max_running: the maximum number of searches running at once
+		:type max_running: int
+		:param max_queued: the maximum number of searches waiting for a slot
+		:type max_queued: int
+		"""
+		self.max_running = max_running
+		self.max_queued = max_queued
+		self.running = 0
+		self.queue = [] # a ticket per search waiting for a slot, in arrival order; tickets are told apart by identity, not value
+		self.costs = 0 # total cost of the searches running and waiting
+		self.seconds_per_cost = None # moving average of how long searches take per unit of cost
+		self.cond = threading.Condition()
+
+	def retry_after(self, cost):
+		"""
+		Estimates how long a search would wait for a slot (the limiter's lock must be held)
+		:param cost: the search's cost
+		:type cost: int
+		:returns: the number of seconds, at least 1
+		:rtype: int
+		"""
+		if self.seconds_per_cost is None:
+			return 1
+		return max(1, min(RETRY_AFTER_MAX, int(math.ceil((self.costs + cost) * self.seconds_per_cost / self.max_running))))
+
+	def acquire(self, cost, timeout = ADMISSION_QUEUE_TIMEOUT):
+		"""
+		Takes a slot for a search, waiting in line for one if they are all taken
+		:param cost: the search's cost, its depth limit times its object limit
+		:type cost: int
+		:param timeout: the number of seconds to wait for a slot
+		:type timeout: int or float
+		:returns: a token to pass to release
+		:rtype: tuple
+		"""
+		deadline = time.monotonic() + timeout
+		with self.cond:
+			if self.running >= self.max_running or len(self.queue) > 0: # a freed slot goes to the first search waiting for one, not to whoever takes the lock first
+				if len(self.queue) >= self.max_queued:
+					raise Overloaded(str(self.running) + " searches are running and " + str(len(self.queue)) + " are waiting on this database", cost, self.retry_after(cost))
+				ticket = object()
+				self.queue.append(ticket)
+				self.costs += cost
+				try:
+					while self.running >= self.max_running or self.queue[0] is not ticket:
+						remaining = deadline - time.monotonic()
+						if remaining <= 0:
+							raise Overloaded("No search slot on this database became free within " + str(timeout) + " seconds", cost, self.retry_after(cost))
+						self.cond.wait(remaining)
+				except:
+					self.queue.remove(ticket)
+					self.costs -= cost
+					self.cond.notify_all()
+					raise
+				self.queue.pop(0)
+				self.costs -= cost
+				self.cond.notify_all()
+			self.running += 1
+			self.costs += cost
+		return (cost, time.monotonic())
+
+	def release(self, token):
+		"""
+		Frees the slot of a search that has finished, and learns from how long it took
+		:param token: what acquire returned
+		:type token: tuple
+		"""
+		(cost, started) = token
+		seconds = time.monotonic() - started
+		with self.cond:
+			self.running -= 1
+			self.costs -= cost
+			if cost > 0:
+				rate = seconds / cost
+				self.seconds_per_cost = rate if self.seconds_per_cost is None else 0.8 * self.seconds_per_cost + 0.2 * rate
+			self.cond.notify_all()
+
+
+def search_cost(depth_limit, obj_limit):
+	"""
+	Estimates how expensive a network search is before it runs
+	:param depth_limit: the search's depth limit
+	:type depth_limit: int
+	:param obj_limit: the search's object limit
+	:type obj_limit: int
+	:returns: the depth limit times the object limit, at least 1
+	:rtype: int
+	"""
+	return max(1, depth_limit * obj_limit)
+
+
+network_flights = SingleFlight() # getNetwork searches in progress, which identical requests wait on instead of searching again
+
+limiters = {} # one limiter per DSN, since each database has its own capacity
+limiters_lock = threading.Lock()
+
+def get_limiter(dsn):
+	"""
+	Gets the process-wide admission limiter for a database, creating it on first use
+	:param dsn: the url of the database
+	:type dsn: str
+	:returns: the database's limiter
+	:rtype: AdmissionLimiter
+	"""
+	with limiters_lock:
+		if dsn not in limiters:
+			limiters[dsn] = AdmissionLimiter()
+		return limiters[dsn]
@@ -7,54 +7,162 @@ import json
 import traceback
 import logging
 import sys
-import bisect
+import os
+import threading
+import concurrent.futures
+import argparse
+import itertools
+import time
+import hashlib
+import gzip
+import base64
+from pool import get_pool
+from schema import load_schema, key_obj_type, SCHEMA_PATH
+from discovery import discover_catalog, write_catalog
+from queries import get_query_builder, UnknownTable, ObjectNotFound, EDGE_TABLE
+from edgetable import install_edge_table, drop_edge_table, edge_table_installed, edge_table_ready
+from cache import get_node_cache, flush_node_caches, response_cache, dsn_fingerprint
+from graphstore import GraphStore
+from snapshot import build_snapshot, load_snapshot, snapshot_path, SnapshotSource
+from metrics import metrics
+from admission import network_flights, get_limiter, search_cost, Overloaded, ADMISSION_QUEUE_TIMEOUT
+from wire import available_formats, available_encodings, negotiate_format, encode_body, compress, MEDIA_TYPES
 
 
 class ObjectTree:
 	"""
 	A class that generates a network of connected objects
 	"""
-	def __init__(self, database_url, file_path):
+	def __init__(self, database_url, file_path, snapshot = None):
 		"""
-		Initializes an ObjectTree object
+		Initializes an ObjectTree object. Construction is cheap: the connection is checked out of the
+		process-wide pool for the database and the object type graph is parsed once per process
 		:param database_url: The url of the database that's being connected to
 		:type database_url: str
 		:param file_path: The path to the file that contains the object type graph
 		:type file_path: str
+		:param snapshot: a snapshot of the database to traverse instead of the database itself, in which case no connection is made
+		:type snapshot: snapshot.SnapshotSource
 		"""
 		self.url = database_url
-		self.con = pcg2.connect(self.url)
-		self.con.autocommit = True
-		self.cur = self.con.cursor()
-		self.existing_nodes = {} # stores objects that have already been found
+		self.schema = load_schema(file_path)
+		self.pointers_to = self.schema.pointers_to
+		self.pointed_to_by = self.schema.pointed_to_by
+		self.snapshot = snapshot
+		if snapshot is None:
+			self.pool = get_pool(self.url)
+			self.con = self.pool.getconn()
+			try:
+				self.cur = self.con.cursor()
+				self.builder = get_query_builder(self.url, self.schema, self.get_tables)
+				self.cache = get_node_cache(self.url)
+			except:
+				self.pool.putconn(self.con) # the constructor did not finish, so close will never give it back
+				raise
+		else:
+			self.pool = None
+			self.con = None
+			self.cur = None
+			self.builder = snapshot
+		self.root_logger = logging.getLogger()
+		self.concurrency = 1 # how many connections a layer's lookups may be spread over
+		self.sample = False # whether the breadth-first search samples children to fit the object limit (see schedule_children)
+		self.edge_table = False # whether edges are looked up in the edge table instead of the objects' pointer fields (see edgetable.py)
+		self.weights = {} # child type -> weight of its share of a sampled layer's object budget (1 if not given)
+		self.lock = threading.Lock()
+		self.deadline = None # the time (as from time.time()) by which searches must stop, if any (see set_deadline)
+		self.watchdog = None
+		self.cancelled = False
+		self.extra = [] # connections run_jobs has checked out, which the watchdog also cancels
+		self.reset()
+
+	def reset(self):
+		"""
+		Clears the per-request traversal state so the tree can be used for another search
+		"""
+		self.graph = GraphStore() # the network built by the search
 		self.layers = 0 # used to return max_depth at the end of both algorithms
-		self.pointers_to = {}
-		self.pointed_to_by = {}
-		with open(file_path) as file:
-			for line in file:
-				(key, value) = line.split(" -> ")
-				if value.endswith("\n"):
-					value = value[:-1]
-				try:
-					bisect.insort(self.pointers_to[key], value) # alphabetizing generates more connections with "relevant" object types (accounts, adunits, etc.) that happen to come first alphabetically
-					#self.pointers_to[key].append(value) # to add types in "natural" order
-				except:
-					self.pointers_to[key] = [value]
+		self.truncated = None # the limit or budget that cut the search short (depth, objects, deadline or queries), if any
+		self.queries = {} # query template -> its kind, edge, calls, rows, and total and slowest time in ms
+		self.cache_hits = 0 # node cache lookups answered without a query
+		self.cache_misses = 0
+		self.query_count = 0 # statements executed, and rows they returned
+		self.rows_fetched = 0
+		self.db_seconds = 0 # time spent executing statements, summed over connections
+		self.slowest = {} # query template -> (statement, params) of its slowest call, for explain_slowest
+		self.layer_timings = [] # one entry per layer searched (see start_layer and end_layer)
+		self.edge_counts = {} # "child -> parent" -> children counted and fetched by a sampled search
+		self.sampled = {} # node index -> child type -> how many children of that type the node has, for nodes whose children were sampled
+		self.path_visited = 0 # objects a path search visited (see find_paths)
+
+	def close(self):
+		"""
+		Closes the tree's cursor and returns its connection to the pool. The connection is let go under self.lock, so a
+		deadline timer that is already running cannot cancel it once another request has checked it out
+		"""
+		if self.watchdog is not None:
+			self.watchdog.cancel()
+			self.watchdog = None
+		with self.lock:
+			con = self.con
+			if con is None:
+				return
+			self.cancelled = True
+			self.con = None
+			self.extra = []
+		try:
+			self.cur.close()
+		except Exception as e:
+			pass
+		self.pool.putconn(con)
+
+	def set_deadline(self, deadline):
+		"""
+		Bounds the searches this tree runs until it is closed. Statements get a statement_timeout of the time left, the
+		searches stop between layers once it has passed, and a timer cancels whatever is still running on the tree's
+		connections at the deadline, so a search that is cut short returns what it found so far instead of holding
+		the worker
+		:param deadline: the time (as from time.time()) by which searches must stop, or None for no deadline
+		:type deadline: float
+		"""
+		self.deadline = deadline
+		if deadline is None or self.con is None:
+			return
+		self.apply_statement_timeout(self.con)
+		self.watchdog = threading.Timer(max(deadline - time.time(), 0), self.cancel)
+		self.watchdog.daemon = True
+		self.watchdog.start()
+
+	def apply_statement_timeout(self, con):
+		"""
+		Sets a connection's statement_timeout to the time left before self.deadline (the pool resets it when the connection is returned)
+		:param con: the connection
+		:type con: pool.PooledConnection
+		"""
+		if self.deadline is not None and hasattr(con, 'set_statement_timeout'):
+			con.set_statement_timeout(max(int((self.deadline - time.time()) * 1000), 1))
+
+	def cancel(self):
+		"""
+		Cancels the statements running on the tree's connections, and any the search would run after them. Does nothing
+		once the tree is closed. The connections are cancelled under self.lock, which close and run_jobs also hold to give
+		them back to the pool, so only connections the tree still holds are cancelled
+		"""
+		with self.lock:
+			if self.con is None:
+				return
+			self.cancelled = True
+			for con in [self.con] + self.extra:
 				try:
-					bisect.insort(self.pointed_to_by[value], key)
-					#self.pointed_to_by[value].append(key)
-				except:
-					self.pointed_to_by[value] = [key]
-		self.queries = {} # holds SQL queries
-		self.root_logger= logging.getLogger()
-		self.root_logger.setLevel(logging.DEBUG)
-		handler = logging.FileHandler('runtime.log', 'w', 'utf-8')
-		handler.setFormatter(logging.Formatter('%(name)s %(message)s'))
-		second_handler = logging.StreamHandler(sys.stdout)
-		second_handler.setLevel(logging.DEBUG)
-		second_handler.setFormatter(logging.Formatter('%(name)s %(message)s'))
-		self.root_logger.addHandler(handler)
-		self.root_logger.addHandler(second_handler)
+					con.cancel()
+				except Exception as e:
+					pass
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, tb):
+		self.close()
 
 	def query_current_node_info(self, obj_id, obj_type):
 		"""
@@ -66,11 +174,34 @@ class ObjectTree:
 		:returns: all of the information about the object
 		:rtype: dict
 		"""
-		query_str = "SELECT obj FROM " + str(obj_type) + " WHERE obj->>'id'='" + str(obj_id) + "'"
-		self.cur.execute(query_str)
-		result = self.cur.fetchall()
+		result = self.run_query(self.builder.get('object', obj_type), (str(obj_id),))
 		return result[0][0]
 
+	def query_objects_info(self, objs, fields = None):
+		"""
+		Queries the information about many objects at once, with one query per object type
+		:param objs: the objects, as (type, id) pairs
+		:type objs: list
+		:param fields: the top-level fields to return, if not all of them
+		:type fields: list
+		:returns: each object's information keyed by "objecttype objectid" (None for objects that do not exist), and an md5 of each stored object, keyed the same way
+		:rtype: tuple
+		"""
+		ids = {}
+		for (obj_type, obj_id) in objs:
+			ids.setdefault(obj_type, []).append(str(obj_id))
+		infos = {}
+		hashes = {}
+		for obj_type in ids:
+			if fields is None:
+				rows = self.run_query(self.builder.get('objects', obj_type), (ids[obj_type],))
+			else:
+				rows = self.run_query(self.builder.get('object_fields', obj_type), (ids[obj_type], fields))
+			found = dict((r[0], r[1:]) for r in rows)
+			for obj_id in ids[obj_type]:
+				(hashes[obj_type + " " + obj_id], infos[obj_type + " " + obj_id]) = found.get(obj_id, (None, None))
+		return (infos, hashes)
+
 	#Not in use right now, but these are some of the exceptions to the objecttype_id format
 	def key_to_obj_type(self, key):
 		"""
@@ -80,20 +211,13 @@ class ObjectTree:
 		:returns: the object type that the field name points to
 		:rtype: str
 		"""
-		if key.endswith('ids'):
-			key = key[0:-1]
-		if key == 'order_id' or key == 'user_id':
-			return key[0:-2]
-		elif key == 'partner_id' or key == 'demand_partner_id':
-			return 'account'
-		elif key == 'openx_buyer_id':
-			return 'buyer'
-		else:
-			return key[0:-3]
+		if key in self.schema.key_types:
+			return self.schema.key_types[key]
+		return key_obj_type(key)
 
 	def get_tables(self):
 		"""
-		Gets all table names from the database
+		Gets all table names from the database, leaving out the edge table (see edgetable.py), which holds no objects
 		:returns: All table names from the database
 		:rtype: list
 		"""
@@ -102,11 +226,123 @@ class ObjectTree:
 		total = self.cur.fetchall()
 		table_list = []
 		for a in total:
-			table_list.append(a[1])
+			if a[1] != EDGE_TABLE:
+				table_list.append(a[1])
 		return table_list
 	
 
 
+	def index_targets(self):
+		"""
+		Lists the jsonb expressions that traversal queries filter on, from the edges in the object type graph
+		:returns: (table, field name, index kind) for every object id, every pointer field, and every map of pointer ids
+		:rtype: list
+		"""
+		targets = []
+		for obj_type in sorted(set(self.pointers_to) | set(self.pointed_to_by)):
+			targets.append((obj_type, 'id', 'btree'))
+			for parent_type in self.pointers_to.get(obj_type, []):
+				targets.append((obj_type, self.schema.id_key(parent_type, child_type=obj_type), 'btree'))
+				targets.append((obj_type, self.schema.id_key(parent_type, plural=True, child_type=obj_type), 'gin'))
+		return targets
+
+	def estimate_cost(self, table, key, kind):
+		"""
+		Gets the planner's estimated cost of looking up objects by one field
+		:param table: the table being searched
+		:type table: str
+		:param key: the field being filtered on
+		:type key: str
+		:param kind: btree for a field holding one id, gin for a jsonb map of ids
+		:type kind: str
+		:returns: the estimated total cost of the lookup
+		:rtype: float
+		"""
+		if kind == 'gin':
+			sql_query = "EXPLAIN (FORMAT JSON) SELECT obj->>'id' FROM " + table + " WHERE obj->'" + key + "' ? %s"
+			self.cur.execute(sql_query, ('0',))
+		else:
+			sql_query = "EXPLAIN (FORMAT JSON) SELECT obj->>'id' FROM " + table + " WHERE obj->>'" + key + "' = ANY(%s)"
+			self.cur.execute(sql_query, (['0'],))
+		plan = self.cur.fetchall()[0][0]
+		if isinstance(plan, str):
+			plan = json.loads(plan)
+		return plan[0]['Plan']['Total Cost']
+
+	def ensure_indexes(self, create = True):
+		"""
+		Creates (concurrently) the expression indexes that traversal queries need on every table in the object type graph:
+		a btree on obj->>'id' and on every pointer field, and a GIN index on every jsonb map of pointer ids that is in use.
+		An index left invalid by a failed concurrent build is never used by the planner, so it is dropped and built again
+		:param create: whether to create missing indexes, or only report on them
+		:type create: bool
+		:returns: one entry per index with its table, field, kind, name, status (exists, created, missing, invalid, rebuilt, or skipped), and the planner's cost estimate for a lookup before and after
+		:rtype: list
+		"""
+		tables = set(self.get_tables())
+		existing = {}
+		self.cur.execute("SELECT p.tablename, p.indexname, p.indexdef, x.indisvalid FROM pg_catalog.pg_indexes p JOIN pg_catalog.pg_index x ON x.indexrelid = (quote_ident(p.schemaname) || '.' || quote_ident(p.indexname))::regclass"
+			+ " WHERE p.schemaname != 'pg_catalog' AND p.schemaname != 'information_schema'")
+		for (table, index_name, index_def, valid) in self.cur.fetchall():
+			existing.setdefault(table, []).append((index_name, index_def, valid))
+
+		report = []
+		analyze = set()
+		for (table, key, kind) in self.index_targets():
+			index_name = ("objviz_" + table + "_" + key)[:63]
+			entry = {'table': table, 'key': key, 'kind': kind, 'index': index_name}
+			report.append(entry)
+			if table not in tables:
+				entry['status'] = 'skipped'
+				continue
+			if kind == 'gin':
+				expression = "(obj -> '" + key + "'::text)"
+			else:
+				expression = "(obj ->> '" + key + "'::text)"
+			for (name, index_def, valid) in existing.get(table, []):
+				if expression in index_def and (kind == 'gin') == (' USING gin ' in index_def):
+					if valid:
+						entry['index'] = name
+						entry['status'] = 'exists'
+					elif entry.get('status') != 'exists':
+						entry['invalid'] = name
+						entry['status'] = 'invalid'
+			if entry.get('status') == 'exists':
+				continue
+			if entry.get('status') == 'invalid':
+				entry['cost_before'] = self.estimate_cost(table, key, kind)
+				continue
+			if kind == 'gin':
+				self.cur.execute("SELECT 1 FROM " + table + " WHERE obj ? %s LIMIT 1", (key,))
+				if len(self.cur.fetchall()) == 0: # the map of ids is never used, so there is nothing to index
+					entry['status'] = 'skipped'
+					continue
+			entry['status'] = 'missing'
+			entry['cost_before'] = self.estimate_cost(table, key, kind)
+
+		if not create:
+			return report
+		for entry in report: # estimates are all taken first, since building an index also refreshes its table's row count
+			if entry['status'] not in ['missing', 'invalid']:
+				continue
+			if entry['status'] == 'invalid':
+				self.root_logger.info("DROPPING INVALID INDEX " + entry['invalid'])
+				self.cur.execute("DROP INDEX CONCURRENTLY IF EXISTS " + entry['invalid'])
+			self.root_logger.info("CREATING INDEX " + entry['index'])
+			if entry['kind'] == 'gin':
+				self.cur.execute("CREATE INDEX CONCURRENTLY IF NOT EXISTS " + entry['index'] + " ON " + entry['table'] + " USING gin ((obj->'" + entry['key'] + "'))")
+			else:
+				self.cur.execute("CREATE INDEX CONCURRENTLY IF NOT EXISTS " + entry['index'] + " ON " + entry['table'] + " ((obj->>'" + entry['key'] + "'))")
+			entry['status'] = 'rebuilt' if entry['status'] == 'invalid' else 'created'
+			analyze.add(entry['table'])
+
+		for table in analyze: # expression indexes only get statistics once their table is analyzed
+			self.cur.execute("ANALYZE " + table)
+		for entry in report:
+			if entry['status'] in ['created', 'rebuilt']:
+				entry['cost_after'] = self.estimate_cost(entry['table'], entry['key'], entry['kind'])
+		return report
+
 	def get_node_info(self, obj_id, obj_type, pointer = None):
 		"""
 		Gets only crucial information from a given object (to be displayed in object preview in visualizer)
@@ -116,291 +352,1058 @@ class ObjectTree:
 		:type obj_type: str
 		:param pointer: the object that points to the target object (in case the target object does not exist in database)
 		:type pointer: str
-		:returns: the name, status, deleted, and type_full fields of the object if possible. Else, raises error
+		:returns: the name, status, deleted, and type_full fields of the object if possible. Else, raises ObjectNotFound
 		:rtype: list (tuple)
 		"""
-		try:
-			query_str = "SELECT obj->>'name', obj->>'status', obj->>'deleted', obj->>'type_full' FROM " + obj_type + " WHERE obj->>'id'='" + str(obj_id) + "'"
-			self.cur.execute(query_str)
-			result = self.cur.fetchall()[0]
-			self.queries[query_str] = True
-			return result
-		except Exception as e:
-			self.root_logger.info(obj_type + " " + str(obj_id) + " (POINTED TO BY " + pointer + ") DID NOT PARSE, POSSIBLY DOES NOT EXIST IN DATABASE")
-			raise
+		infos = self.fetch_node_infos(obj_type, [str(obj_id)])
+		if str(obj_id) not in infos:
+			self.root_logger.info(obj_type + " " + str(obj_id) + " (POINTED TO BY " + str(pointer) + ") DID NOT PARSE, POSSIBLY DOES NOT EXIST IN DATABASE")
+			raise ObjectNotFound(obj_type + " " + str(obj_id) + " does not exist")
+		return infos[str(obj_id)]
 
 
-	def find_nearby_nodes_df_graph(self, obj_limit, obj, output = {}, current_depth=0):
+	def find_nearby_nodes_df_graph(self, objs, dep_limit = 2, obj_limit = 100, query_limit = None):
 		"""
-		Recursively generates a network of objects connected to one object, searching through database connections depth-first
-		:param obj_limit: the maximum number of objects to be added to the network
+		Generates a network of objects connected to one object, searching through database connections depth-first: each
+		newly found object is searched before the objects found beside it, parents before children, so a chain such as
+		ad -> lineitem -> order_ -> account is followed to its end without searching everything around it first. The
+		search keeps an explicit stack rather than recursing, and when a budget runs out it stops and returns what it has
+		found so far, with self.truncated set to the budget's name (its time budget is self.deadline; see set_deadline)
+		:param objs: the starting object, as a one-item list of "objecttype objectid"
+		:type objs: list
+		:param dep_limit: the maximum depth that the search is allowed to reach
+		:type dep_limit: int
+		:param obj_limit: the maximum number of objects that can be in the generated network
 		:type obj_limit: int
-		:param obj: the origninal object; the starting point of the network
-		:type obj: str
-		:param output: the running dictionary of objects as they are added to the network
-		:type output: dict
-		:param current_depth: the number of layers away from the starting object that the current iteration is; used for measuring greatest tree depth
-		:type current_depth: int
+		:param query_limit: the maximum number of statements the search may execute, if any
+		:type query_limit: int
 		:returns: an indexed network of objects and their id, type, name, status, deleted, type_full, and the objects that point to them
 		:rtype: dict
 		"""
-		if current_depth >= self.layers:
-			self.layers = current_depth
-		if len(self.existing_nodes) >= obj_limit:
-			return output
-		if len(self.existing_nodes) == 0:
-			output = {}
-			i = self.get_node_info(obj.split()[1], obj.split()[0])
-			output[0] = {'pointers_from': [], 'type': obj.split()[0], 'id': obj.split()[1], 'name': i[0], 'status': i[1], 'deleted': i[2], 'type_full': i[3]}
-			self.existing_nodes[obj] = 0
-
-		current = self.existing_nodes[obj]
-		if len(self.existing_nodes) % 25 == 0:
-			self.root_logger.info(str(len(self.existing_nodes)) + " OBJECTS FOUND...")
-		parts = obj.split()
-
-		for obj_type in self.pointers_to[parts[0]]: # finding parent nodes that the current object points to
-			if len(self.existing_nodes) >= obj_limit:
-				return output
-			if obj_type == 'user_' or obj_type == 'order_':
-				sql_query = "SELECT obj->>'" + obj_type + "id' FROM " + parts[0] + " WHERE obj->>'id'='" + parts[1] + "'"
+		graph = self.graph
+		if obj_limit < 1:
+			return graph.to_network()[0]
+		start = self.start_layer()
+		(obj_type, obj_id) = objs[0].split()
+		root = graph.add_node(obj_type, obj_id, self.get_node_info(obj_id, obj_type))
+		stack = [(root, 0, self.iter_df_neighbors(root, query_limit))] # (node, depth, its remaining neighbors)
+		depth_cut = False # whether the depth limit kept any object from being searched
+		while len(stack) > 0 and self.truncated is None:
+			(current, depth, neighbors) = stack[-1]
+			try:
+				step = next(neighbors, None)
+			except pcg2.extensions.QueryCanceledError:
+				self.root_logger.info("DEADLINE REACHED")
+				self.truncated = 'deadline'
+				break
+			if step is None:
+				stack.pop()
+				continue
+			(kind, neighbor_type, neighbor_id, info) = step
+			neighbor = graph.find(neighbor_type, neighbor_id)
+			found = neighbor is None
+			if found:
+				if info is None:
+					self.root_logger.info(neighbor_type + " " + neighbor_id + " (POINTED TO BY " + graph.type_of(current) + " " + graph.node_id[current] + ") DID NOT PARSE, POSSIBLY DOES NOT EXIST IN DATABASE")
+					continue
+				neighbor = graph.add_node(neighbor_type, neighbor_id, info)
+			if kind == 'parent':
+				graph.add_edge(neighbor, current)
 			else:
-				sql_query = "SELECT obj->>'" + obj_type + "_id' FROM " + parts[0] + " WHERE obj->>'id'='" + parts[1] + "'"
-			self.queries[sql_query] = True
-			self.cur.execute(sql_query)
-			result = self.cur.fetchall()
-			
-			if len(result) != 0 and result[0][0] != None and (obj_type + " " + result[0][0]) in self.existing_nodes:
-				if current not in output[self.existing_nodes[obj_type + " " + result[0][0]]]['pointers_from']:
-					output[self.existing_nodes[obj_type + " " + result[0][0]]]['pointers_from'].append(current)
-			elif len(result) != 0 and result[0][0] != None:
-				try:
-					info = self.get_node_info(result[0][0], obj_type, pointer=obj)
-					this_index = len(self.existing_nodes)
-					
-					self.existing_nodes[obj_type + " " + str(result[0][0])] = this_index
-					
-					output[this_index] = {'pointers_from': [current], 'type': obj_type, 'id': result[0][0], 'name': info[0], 'status': info[1], 'deleted': info[2], 'type_full': info[3]}
-					self.find_nearby_nodes_df_graph(obj_limit, (obj_type + " " + str(result[0][0])), output, current_depth=current_depth + 1)
-				except:
-					pass
+				graph.add_edge(current, neighbor)
+			if not found:
+				continue
+			self.layers = max(self.layers, depth + 1)
+			if len(graph) >= obj_limit:
+				self.root_logger.info("OBJECT LIMIT REACHED")
+				self.truncated = 'objects'
+			elif depth + 1 < dep_limit:
+				stack.append((neighbor, depth + 1, self.iter_df_neighbors(neighbor, query_limit)))
 			else:
-				try:
-					if obj_type == 'user_' or obj_type == 'order_':
-						sql_query = "SELECT obj->>'" + obj_type + "ids' FROM " + parts[0] + " WHERE obj->>'id'='" + parts[1] + "'"
-					else:
-						sql_query = "SELECT obj->>'" + obj_type + "_ids' FROM " + parts[0] + " WHERE obj->>'id'='" + parts[1] + "'"
-					
-					self.cur.execute(sql_query)
-					results = json.loads(str(self.cur.fetchall()[0][0])).keys()
-					self.queries[sql_query] = True
-					for r in results:
-						if (obj_type + " " + r) in self.existing_nodes:
-							if self.existing_nodes[obj] not in output[self.existing_nodes[obj_type + " " + r]]['pointers_from']:
-								output[self.existing_nodes[obj_type + " " + r]]['pointers_from'].append(current)
-
-						else:
-							information = self.get_node_info(r, obj_type, pointer = obj)
-							current_index = len(self.existing_nodes)
-							if current_index >= obj_limit:
-								return output
-							self.existing_nodes[obj_type + " " + r] = current_index
-							
-							output[current_index] = {'pointers_from': [current], 'type': obj_type, 'id': r, 'name': information[0], 'status': information[1], 'deleted': information[2], 'type_full': information[3]}
-							self.find_nearby_nodes_df_graph(obj_limit, (obj_type + " " + str(r)), output, current_depth = current_depth + 1)
+				depth_cut = True
+		if self.truncated is None and depth_cut:
+			self.truncated = 'depth'
+		self.end_layer(None, start)
+		return graph.to_network()[0]
 
-				except Exception as e:
-					pass
+	def iter_df_neighbors(self, node, query_limit = None):
+		"""
+		Looks up the objects one node points to and the objects that point to it, one edge type at a time and only as
+		the depth-first search asks for them. Stops early, setting self.truncated, once the search's time or query
+		budget runs out
+		:param node: the node's index in self.graph
+		:type node: int
+		:param query_limit: the maximum number of statements the search may execute, if any
+		:type query_limit: int
+		:returns: ('parent' or 'child', object type, object id, its name, status, deleted and type_full, or None if it does not exist) for each neighbor
+		:rtype: generator of tuple
+		"""
+		graph = self.graph
+		(node_type, node_id) = (graph.type_of(node), graph.node_id[node])
+		parents = None # every parent type's ids, fetched in one query when the first parent type is asked for
+		for parent_type in self.pointers_to.get(node_type, []):
+			if not self.builder.has_table(parent_type):
+				continue
+			if self.out_of_budget(query_limit):
+				return
+			if parents is None:
+				parents = self.fetch_parent_ids(node_type, [node_id])
+			parent_ids = parents[parent_type].get(node_id, [])
+			new_ids = [r for r in parent_ids if graph.find(parent_type, r) is None]
+			infos = self.fetch_node_infos(parent_type, new_ids) if len(new_ids) > 0 else {}
+			for r in parent_ids:
+				yield ('parent', parent_type, r, infos.get(r))
+		for child_type in self.pointed_to_by.get(node_type, []):
+			if not self.builder.has_table(child_type):
+				continue
+			if self.out_of_budget(query_limit):
+				return
+			for r in self.fetch_children(node_type, [node_id], child_type).get(node_id, []):
+				yield ('child', child_type, r[0], r[1:])
+
+	def out_of_budget(self, query_limit = None):
+		"""
+		Checks a search's time budget (self.deadline) and query budget, setting self.truncated to the one that has run out
+		:param query_limit: the maximum number of statements the search may execute, if any
+		:type query_limit: int
+		:returns: whether a budget has run out
+		:rtype: bool
+		"""
+		if self.cancelled or (self.deadline is not None and time.time() >= self.deadline):
+			self.truncated = 'deadline'
+		elif query_limit is not None and self.query_count >= query_limit:
+			self.truncated = 'queries'
+		return self.truncated is not None
+
+	def run_query(self, statement, params, cur = None):
+		"""
+		Executes one of the query builder's prepared statements, and records its time and row count against its template in self.queries
+		:param statement: the statement to execute
+		:type statement: queries.Statement
+		:param params: the values bound to the statement's parameters
+		:type params: tuple
+		:param cur: the cursor to execute on, if not the tree's own (see run_jobs)
+		:type cur: psycopg2.extensions.cursor
+		:returns: all rows returned by the query
+		:rtype: list
+		"""
+		if cur is None:
+			cur = self.cur
+		if self.cancelled:
+			raise pcg2.extensions.QueryCanceledError("the request's deadline has passed")
+		started = time.time()
+		statement.execute(cur, params)
+		rows = cur.fetchall()
+		elapsed = time.time() - started
+		with self.lock:
+			self.query_count += 1
+			self.rows_fetched += len(rows)
+			self.db_seconds += elapsed
+			trace = self.queries.get(statement.sql)
+			if trace is None:
+				trace = self.queries[statement.sql] = {'kind': statement.kind, 'edge': statement.edge, 'calls': 0, 'rows': 0, 'ms': 0, 'max_ms': 0}
+			trace['calls'] += 1
+			trace['rows'] += len(rows)
+			trace['ms'] = round(trace['ms'] + elapsed * 1000, 3)
+			if elapsed * 1000 >= trace['max_ms']:
+				trace['max_ms'] = round(elapsed * 1000, 3)
+				self.slowest[statement.sql] = (statement, params)
+		edge = statement.edge or ""
+		metrics.inc('objviz_queries_total', kind=statement.kind, edge=edge)
+		metrics.inc('objviz_query_seconds_total', elapsed, kind=statement.kind, edge=edge)
+		metrics.inc('objviz_query_rows_total', len(rows), kind=statement.kind, edge=edge)
+		return rows
 
+	def explain_slowest(self, n):
+		"""
+		Runs the slowest call of each of the n query templates that took the most total time again under
+		EXPLAIN (ANALYZE, BUFFERS), and adds the plans to their entries in self.queries. Each explained call is
+		executed a second time, so this is only done when a request asks for it
+		:param n: how many query templates to explain
+		:type n: int
+		"""
+		if self.cur is None: # searched a snapshot
+			return
+		for sql in sorted(self.queries, key=lambda sql: -self.queries[sql]['ms'])[:n]:
+			(statement, params) = self.slowest[sql]
+			try:
+				self.queries[sql]['explain'] = statement.explain(self.cur, params)
+			except Exception as e:
+				self.queries[sql]['explain'] = [type(e).__name__ + ": " + str(e)]
+
+	def start_layer(self):
+		"""
+		Notes the running totals at the start of a layer of a search, for end_layer
+		:returns: the time, query time, query count, number of objects and non-deleted objects of each type so far
+		:rtype: tuple
+		"""
+		return (time.time(), self.db_seconds, self.query_count, len(self.graph), dict(self.graph.live_counts))
+
+	def end_layer(self, layer, start):
+		"""
+		Records how long a layer of a search took in self.layer_timings
+		:param layer: the depth of the objects the layer added (0 for the starting object, None for a whole sql search)
+		:type layer: int
+		:param start: what start_layer returned at the start of the layer
+		:type start: tuple
+		"""
+		self.layer_timings.append({'layer': layer, 'ms': round((time.time() - start[0]) * 1000, 3), 'db_ms': round((self.db_seconds - start[1]) * 1000, 3), 'queries': self.query_count - start[2], 'objects': len(self.graph) - start[3],
+			'types': dict((self.graph.types[code], n - start[4].get(code, 0)) for (code, n) in self.graph.live_counts.items() if n > start[4].get(code, 0))})
+
+	def run_jobs(self, jobs, costs = None):
+		"""
+		Runs independent lookups, spread over up to self.concurrency connections at once. Extra connections are only
+		taken from the pool if they are free right away, so a busy pool just means fewer lookups run at once
+		:param jobs: the lookups, as (function, args) pairs; each function must accept a cur keyword argument
+		:type jobs: list
+		:param costs: the estimated cost of each lookup, if known, so the costliest are started first and do not hold up the end of the batch
+		:type costs: list
+		:returns: the result of each lookup, in the same order as jobs
+		:rtype: list
+		"""
+		extra = []
+		while self.pool is not None and len(extra) < min(self.concurrency, len(jobs)) - 1:
+			try:
+				extra.append(self.pool.getconn(timeout=0))
+			except Exception as e:
+				break
 		try:
-			for obj_type in self.pointed_to_by[parts[0]]: # finding child nodes that point to current object
-				if parts[0] == 'user_' or parts[0] == 'order_':
-					sql_query = "SELECT obj->>'id', obj->>'name', obj->>'status', obj->>'deleted', obj->>'type_full' FROM " + obj_type + " WHERE obj->>'" + parts[0] + "id'='" + parts[1] + "'"
-				else:
-					sql_query = "SELECT obj->>'id', obj->>'name', obj->>'status', obj->>'deleted', obj->>'type_full' FROM " + obj_type + " WHERE obj->>'" + parts[0] + "_id'='" + parts[1] + "'"
-				
-				self.cur.execute(sql_query)
-				results = self.cur.fetchall()
-				self.queries[sql_query] = True
-
-				for r in results:
-					if r[0] != None:
-						if (obj_type + " " + r[0]) in self.existing_nodes:
-							if self.existing_nodes[obj_type + " " + r[0]] not in output[current]['pointers_from']:
-								output[current]['pointers_from'].append(self.existing_nodes[obj_type + " " + r[0]])
-						else:
-							this_obj_index = len(self.existing_nodes)
-							if this_obj_index >= obj_limit:
-								return output
-							self.existing_nodes[obj_type + " " + r[0]] = this_obj_index
-							output[current]['pointers_from'].append(this_obj_index)
-							if this_obj_index not in output:
-								output[this_obj_index] = {'pointers_from': [], 'type': obj_type, 'id': r[0], 'name': r[1], 'status': r[2], 'deleted': r[3], 'type_full': r[4]}
-							self.find_nearby_nodes_df_graph(obj_limit, (obj_type + " " + str(r[0])), output, current_depth = current_depth + 1)
+			for con in extra:
+				self.apply_statement_timeout(con)
 		except Exception as e:
-			pass
+			for con in extra:
+				self.pool.putconn(con)
+			raise
+		with self.lock:
+			self.extra = list(extra)
+		if len(extra) == 0:
+			return [function(*args, cur=self.cur) for (function, args) in jobs]
+
+		results = [None] * len(jobs)
+		if costs is None:
+			remaining = iter(range(len(jobs)))
+		else:
+			remaining = iter(sorted(range(len(jobs)), key=lambda i: -costs[i]))
+		lock = threading.Lock()
+		def work(cur):
+			while True:
+				with lock:
+					i = next(remaining, None)
+				if i is None:
+					return
+				results[i] = jobs[i][0](*jobs[i][1], cur=cur)
+
+		cursors = [con.cursor() for con in extra]
+		try:
+			with concurrent.futures.ThreadPoolExecutor(max_workers=len(cursors)) as executor:
+				futures = [executor.submit(work, cur) for cur in cursors]
+				work(self.cur)
+				for future in futures:
+					future.result()
+		finally:
+			with self.lock:
+				self.extra = []
+			for (con, cur) in zip(extra, cursors):
+				cur.close()
+				self.pool.putconn(con)
+		return results
+
+	def cache_lookup(self, prefix, obj_ids):
+		"""
+		Looks up one kind of cached value (see cache.NodeCache) for a set of objects
+		:param prefix: the start of the cache key shared by all of the objects, e.g. ('info', 'adunit')
+		:type prefix: tuple
+		:param obj_ids: the ids of the objects
+		:type obj_ids: list
+		:returns: the cached values keyed by object id, and the ids of the objects that still need to be queried
+		:rtype: tuple (dict, list)
+		"""
+		obj_ids = list(obj_ids)
+		found = self.cache.get_many([prefix + (obj_id,) for obj_id in obj_ids])
+		with self.lock:
+			self.cache_hits += len(found)
+			self.cache_misses += len(obj_ids) - len(found)
+		cached = {}
+		for (key, value) in found.items():
+			cached[key[-1]] = value
+		return (cached, [obj_id for obj_id in obj_ids if obj_id not in cached])
+
+	def fetch_parent_ids(self, obj_type, obj_ids, cur = None):
+		"""
+		Finds the parents of every type for a whole set of objects of the same type in one query, which reads every
+		pointer field of each object from one read of its jsonb document
+		:param obj_type: the type of the objects in obj_ids
+		:type obj_type: str
+		:param obj_ids: the ids of the objects whose parents are being found
+		:type obj_ids: list
+		:param cur: the cursor to query on, if not the tree's own
+		:type cur: psycopg2.extensions.cursor
+		:returns: for each parent type with a table, the parent ids pointed to by each object, keyed by object id (the single id field if set, else the keys of the ids map)
+		:rtype: dict
+		"""
+		parent_types = [parent_type for parent_type in self.pointers_to.get(obj_type, []) if self.builder.has_table(parent_type)]
+		if self.snapshot is not None:
+			return dict((parent_type, self.snapshot.fetch_parent_ids(obj_type, obj_ids, parent_type)) for parent_type in parent_types)
+		parents = {}
+		missing = set()
+		for parent_type in parent_types:
+			(parents[parent_type], missing_ids) = self.cache_lookup(('parents', obj_type, parent_type), obj_ids)
+			missing.update(missing_ids)
+		if len(missing) == 0:
+			return parents
+		missing = [obj_id for obj_id in obj_ids if obj_id in missing]
+		found = dict((parent_type, {}) for parent_type in parent_types)
+		if self.edge_table:
+			for r in self.run_query(self.builder.get('edge_parents', obj_type), (missing,), cur):
+				if r[1] in found:
+					found[r[1]].setdefault(r[0], []).append(r[2])
+			rows = []
+		else:
+			rows = self.run_query(self.builder.get('parent_ids', obj_type), (missing,), cur)
+		for r in rows:
+			for (i, parent_type) in enumerate(parent_types):
+				(parent_id, parent_ids) = (r[1 + 2 * i], r[2 + 2 * i])
+				if parent_id != None:
+					found[parent_type][r[0]] = [parent_id]
+				elif parent_ids != None:
+					try:
+						found[parent_type][r[0]] = [str(pid) for pid in json.loads(parent_ids)]
+					except Exception as e:
+						pass
+		self.cache.put_many({('parents', obj_type, parent_type, obj_id): found[parent_type].get(obj_id, []) for parent_type in parent_types for obj_id in missing})
+		for parent_type in parent_types:
+			parents[parent_type].update(found[parent_type])
+		return parents
 
-		return output
+	def fetch_node_infos(self, obj_type, obj_ids, cur = None):
+		"""
+		Gets the crucial information (see get_node_info) for a whole set of objects of the same type in one query
+		:param obj_type: the type of the objects
+		:type obj_type: str
+		:param obj_ids: the ids of the objects
+		:type obj_ids: list
+		:param cur: the cursor to query on, if not the tree's own
+		:type cur: psycopg2.extensions.cursor
+		:returns: the name, status, deleted, and type_full fields of every object found, keyed by object id
+		:rtype: dict
+		"""
+		if self.snapshot is not None:
+			return self.snapshot.fetch_node_infos(obj_type, obj_ids)
+		(infos, missing) = self.cache_lookup(('info', obj_type), obj_ids)
+		if len(missing) > 0:
+			found = {}
+			for r in self.run_query(self.builder.get('node_infos', obj_type), (missing,), cur):
+				found[r[0]] = r[1:]
+			self.cache.put_many({('info', obj_type, obj_id): found.get(obj_id) for obj_id in missing}) # objects that do not exist are cached as None
+			infos.update(found)
+		return {obj_id: info for (obj_id, info) in infos.items() if info is not None}
 
-	def find_nearby_nodes_bf_graph(self, objs, dep_limit = 2, output = {}, obj_limit = 100):
+	def fetch_children(self, obj_type, obj_ids, child_type, cur = None):
 		"""
-		Recursively generates a network of objects connected to one object, searching through database connections breadth-first
-		:param objs: the objects that a given iteration is looking through
+		Finds the children of a given type that point to any of a set of objects of the same type in one query
+		:param obj_type: the type of the objects in obj_ids
+		:type obj_type: str
+		:param obj_ids: the ids of the objects whose children are being found
+		:type obj_ids: list
+		:param child_type: the type of the child objects
+		:type child_type: str
+		:param cur: the cursor to query on, if not the tree's own
+		:type cur: psycopg2.extensions.cursor
+		:returns: the id, name, status, deleted, and type_full fields of each child, grouped by the id of the object it points to
+		:rtype: dict
+		"""
+		if self.snapshot is not None:
+			return self.snapshot.fetch_children(obj_type, obj_ids, child_type)
+		(children, missing) = self.cache_lookup(('children', obj_type, child_type), obj_ids)
+		if len(missing) == 0:
+			return children
+		found = {}
+		if self.edge_table:
+			found = self.fetch_edge_children(self.run_query(self.builder.get('edge_children', obj_type, child_type), (missing,), cur), child_type, cur)
+		else:
+			for r in self.run_query(self.builder.get('children', obj_type, child_type), (missing,), cur):
+				if r[1] != None:
+					found.setdefault(r[0], []).append(r[1:])
+		self.cache.put_many({('children', obj_type, child_type, obj_id): found.get(obj_id, []) for obj_id in missing})
+		self.cache.put_many({('info', child_type, r[0]): r[1:] for rows in found.values() for r in rows})
+		children.update(found)
+		return children
+
+	def fetch_edge_children(self, pairs, child_type, cur = None):
+		"""
+		Completes the children found in the edge table, which only holds their ids, with their crucial information
+		(see fetch_node_infos)
+		:param pairs: (parent id, child id) rows from the edge table
+		:type pairs: list
+		:param child_type: the type of the child objects
+		:type child_type: str
+		:param cur: the cursor to query on, if not the tree's own
+		:type cur: psycopg2.extensions.cursor
+		:returns: the id, name, status, deleted, and type_full fields of each child, grouped by the id of the object it points to
+		:rtype: dict
+		"""
+		infos = self.fetch_node_infos(child_type, list(dict.fromkeys(r[1] for r in pairs)), cur) if len(pairs) > 0 else {}
+		found = {}
+		for r in pairs:
+			if r[1] in infos:
+				found.setdefault(r[0], []).append((r[1],) + tuple(infos[r[1]]))
+		return found
+
+	def fetch_plural_children(self, obj_type, obj_ids, child_type, cur = None):
+		"""
+		Finds the children of a given type that list any of a set of objects of the same type in their map of ids (e.g.
+		adunit_ids) rather than their single id field. Searches that walk the graph from parents to children never follow
+		these edges, so only a search that needs every edge from both ends (see find_paths) asks for them
+		:param obj_type: the type of the objects in obj_ids
+		:type obj_type: str
+		:param obj_ids: the ids of the objects whose children are being found
+		:type obj_ids: list
+		:param child_type: the type of the child objects
+		:type child_type: str
+		:param cur: the cursor to query on, if not the tree's own
+		:type cur: psycopg2.extensions.cursor
+		:returns: the id, name, status, deleted, and type_full fields of each child, grouped by the id of the object it points to
+		:rtype: dict
+		"""
+		if self.snapshot is not None: # snapshots only store the children found by the single id field
+			return {}
+		(children, missing) = self.cache_lookup(('plural_children', obj_type, child_type), obj_ids)
+		if len(missing) == 0:
+			return children
+		found = {}
+		for r in self.run_query(self.builder.get('plural_children', obj_type, child_type), (missing,), cur):
+			if r[1] != None:
+				found.setdefault(r[0], []).append(r[1:])
+		self.cache.put_many({('plural_children', obj_type, child_type, obj_id): found.get(obj_id, []) for obj_id in missing})
+		self.cache.put_many({('info', child_type, r[0]): r[1:] for rows in found.values() for r in rows})
+		children.update(found)
+		return children
+
+	def fetch_child_counts(self, obj_type, obj_ids, child_type, cur = None):
+		"""
+		Counts the children of a given type that point to each of a set of objects of the same type, without fetching them
+		:param obj_type: the type of the objects in obj_ids
+		:type obj_type: str
+		:param obj_ids: the ids of the objects whose children are being counted
+		:type obj_ids: list
+		:param child_type: the type of the child objects
+		:type child_type: str
+		:param cur: the cursor to query on, if not the tree's own
+		:type cur: psycopg2.extensions.cursor
+		:returns: the number of children of each object that has any, keyed by object id
+		:rtype: dict
+		"""
+		if self.snapshot is not None:
+			return {obj_id: len(rows) for (obj_id, rows) in self.snapshot.fetch_children(obj_type, obj_ids, child_type).items()}
+		(counts, missing) = self.cache_lookup(('child_count', obj_type, child_type), obj_ids)
+		if len(missing) > 0:
+			found = dict(self.run_query(self.builder.get('edge_child_counts' if self.edge_table else 'child_counts', obj_type, child_type), (missing,), cur))
+			self.cache.put_many({('child_count', obj_type, child_type, obj_id): found.get(obj_id, 0) for obj_id in missing})
+			counts.update(found)
+		return {obj_id: count for (obj_id, count) in counts.items() if count > 0}
+
+	def fetch_children_sample(self, obj_type, limits, child_type, cur = None):
+		"""
+		Finds up to a given number of the children of a given type that point to each of a set of objects of the same
+		type in one query, using each object's full list of children instead if it is already cached
+		:param obj_type: the type of the objects
+		:type obj_type: str
+		:param limits: how many children to fetch, keyed by the id of the object they point to
+		:type limits: dict
+		:param child_type: the type of the child objects
+		:type child_type: str
+		:param cur: the cursor to query on, if not the tree's own
+		:type cur: psycopg2.extensions.cursor
+		:returns: the id, name, status, deleted, and type_full fields of each child fetched, grouped by the id of the object it points to
+		:rtype: dict
+		"""
+		if self.snapshot is not None:
+			children = self.snapshot.fetch_children(obj_type, list(limits), child_type)
+			return {obj_id: rows[:limits[obj_id]] for (obj_id, rows) in children.items()}
+		(children, missing) = self.cache_lookup(('children', obj_type, child_type), limits)
+		children = {obj_id: rows[:limits[obj_id]] for (obj_id, rows) in children.items()}
+		if len(missing) == 0:
+			return children
+		found = {}
+		if self.edge_table:
+			found = self.fetch_edge_children(self.run_query(self.builder.get('edge_children_sample', obj_type, child_type), (missing, [limits[obj_id] for obj_id in missing]), cur), child_type, cur)
+		else:
+			for r in self.run_query(self.builder.get('children_sample', obj_type, child_type), (missing, [limits[obj_id] for obj_id in missing]), cur):
+				found.setdefault(r[0], []).append(r[1:])
+		self.cache.put_many({('info', child_type, r[0]): r[1:] for rows in found.values() for r in rows})
+		children.update(found)
+		return children
+
+	def schedule_children(self, counts, budget):
+		"""
+		Decides how many children of each frontier object to fetch in a sampled layer. If every child fits in the
+		object budget left, all are fetched; otherwise the budget is split across (object, child type) groups in
+		proportion to each group's size times its type's weight (see allocate_budget), so a hub's children are
+		sampled across all of its child types instead of the budget going to whichever types come first
+		:param counts: the children each frontier object has, as {(object type, child type): {object id: count}}
+		:type counts: dict
+		:param budget: how many more objects the network can take
+		:type budget: int
+		:returns: how many children to fetch, as {(object type, child type): {object id: number}}, and the groups that are fetched whole
+		:rtype: tuple (dict, set)
+		"""
+		demands = {}
+		for ((obj_type, child_type), per_object) in counts.items():
+			for (obj_id, count) in per_object.items():
+				demands[(obj_type, child_type, obj_id)] = (count, self.weights.get(child_type, 1))
+		if sum(count for (count, weight) in demands.values() if weight > 0) <= budget:
+			allocation = dict((key, count if weight > 0 else 0) for (key, (count, weight)) in demands.items())
+		else:
+			allocation = allocate_budget(demands, budget)
+
+		limits = {}
+		whole = set(counts) # groups where every object's children are all fetched, which can use the cacheable full lookup
+		for ((obj_type, child_type, obj_id), n) in allocation.items():
+			count = demands[(obj_type, child_type, obj_id)][0]
+			edge = self.edge_counts.setdefault(child_type + " -> " + obj_type, {'children': 0, 'fetched': 0})
+			edge['children'] += count
+			edge['fetched'] += n
+			if n < count:
+				whole.discard((obj_type, child_type))
+				node = self.graph.find(obj_type, obj_id)
+				self.sampled.setdefault(node, {})[child_type] = count
+			if n > 0:
+				limits.setdefault((obj_type, child_type), {})[obj_id] = n
+		return (limits, whole)
+
+	def find_nearby_nodes_bf_graph(self, objs, dep_limit = 2, obj_limit = 100):
+		"""
+		Generates a network of objects connected to one object, searching through database connections breadth-first
+		:param objs: the starting object, as a one-item list of "objecttype objectid"
 		:type objs: list
 		:param dep_limit: the maximum depth that the search is allowed to reach
 		:type dep_limit: int
-		:param output: the running dictionary of objects as they are added to the network
-		:type output: dict
 		:param obj_limit: the maximum number of objects that can be in the generated network
 		:type obj_limit: int
 		:returns: an indexed network of objects and their id, type, name, status, deleted, type_full, and the objects that point to them
 		:rtype: dict
 		"""
-		self.layers+=1
-		if self.layers > dep_limit or len(objs) == 0:
-			self.root_logger.info('LAYER ' + str(self.layers - 1) + ' DONE\n')
-			if len(objs) == 0:
-				self.root_logger.info('ALL CONNECTED OBJECTS FOUND')
-			else:
-				self.layers -= 1
-			return output
-		
-		if (self.layers == 1):
-			output = {}
-			i = self.get_node_info(objs[0].split()[1], objs[0].split()[0])
-			output[0] = {'pointers_from': [], 'type': objs[0].split()[0], 'id': objs[0].split()[1], 'name': i[0], 'status': i[1], 'deleted': i[2], 'type_full': i[3]}
-			self.existing_nodes[objs[0]] = 0
+		for graph in self.iter_bf_graph(objs, dep_limit, obj_limit):
+			pass
+		return self.graph.to_network()[0]
+
+	def find_nearby_nodes_sql_graph(self, objs, dep_limit = 2, obj_limit = 100):
+		"""
+		Generates a network of objects connected to one object with a single recursive query (see
+		queries.compile_traversal), so the whole search runs inside the database in one round trip. It finds the same
+		objects as find_nearby_nodes_bf_graph for the same limits, except which objects of the last layer are kept when
+		the object limit cuts a layer short
+		:param objs: the starting object, as a one-item list of "objecttype objectid"
+		:type objs: list
+		:param dep_limit: the maximum depth that the search is allowed to reach
+		:type dep_limit: int
+		:param obj_limit: the maximum number of objects that can be in the generated network
+		:type obj_limit: int
+		:returns: an indexed network of objects and their id, type, name, status, deleted, type_full, and the objects that point to them
+		:rtype: dict
+		"""
+		graph = self.graph
+		(obj_type, obj_id) = objs[0].split()
+		if dep_limit < 1 or obj_limit < 1:
+			self.layers = 1
+			return graph.to_network()[0]
+		start = self.start_layer()
+		try:
+			rows = self.run_query(self.builder.get('traversal'), (obj_type, obj_id, dep_limit, obj_limit))
+		except pcg2.extensions.QueryCanceledError: # the query is all or nothing, so there is nothing to return
+			self.root_logger.info("DEADLINE REACHED")
+			self.truncated = 'deadline'
+			self.end_layer(None, start)
+			return graph.to_network()[0]
+		if len(rows) == 0 or rows[0][0] != 0: # the starting object is missing (raises), or its type has no edges
+			graph.add_node(obj_type, obj_id, self.get_node_info(obj_id, obj_type))
+		for r in rows:
+			graph.add_node(r[1], r[2], r[4:8])
+		for r in rows:
+			for pointer in r[8]:
+				graph.add_edge(r[0], pointer)
+		self.end_layer(None, start)
+
+		depth = max([r[3] for r in rows] + [0])
+		if depth < dep_limit and len(graph) < obj_limit: # counted the way iter_bf_graph counts an exhausted search
+			self.layers = depth + 2
+			self.root_logger.info('ALL CONNECTED OBJECTS FOUND')
 		else:
-			self.root_logger.info('LAYER ' + str(self.layers - 1) + ' DONE. SEARCHING LAYER ' + str(self.layers) + '...\n')
-		working_objects = []
-		for obj in objs:
-			current = self.existing_nodes[obj]
-			success_counter = len(output) - 1 - current # used to keep track of next available index	
-			parts = obj.split() # each obj in the list stored as "objecttype objectid" (delimited by a space)
-			for obj_type in self.pointers_to[obj.split()[0]]: # adding parent nodes that the current object points to
-				if obj_type == 'order_' or obj_type == 'user_': #since ids stored under user_id and order_id fields
-					sql_query = "SELECT obj->>'" + obj_type + "id' FROM " + parts[0] + " WHERE obj->>'id'='" + parts[1] + "'"
+			self.layers = depth
+			if len(graph) >= obj_limit:
+				self.root_logger.info("OBJECT LIMIT REACHED")
+				self.truncated = 'objects'
+			else:
+				self.truncated = 'depth'
+		return graph.to_network()[0]
+
+	def iter_bf_graph(self, objs, dep_limit = 2, obj_limit = 100):
+		"""
+		Generates a network of objects connected to one object breadth-first, one layer at a time, in self.graph
+		:param objs: the starting object, as a one-item list of "objecttype objectid"
+		:type objs: list
+		:param dep_limit: the maximum depth that the search is allowed to reach
+		:type dep_limit: int
+		:param obj_limit: the maximum number of objects that can be in the generated network
+		:type obj_limit: int
+		:returns: the running network, yielded once the starting object is added and again after each layer is searched (nodes and edges are only ever appended)
+		:rtype: generator of GraphStore
+		"""
+		graph = self.graph
+		frontier = []
+		while True:
+			self.layers+=1
+			if self.layers > dep_limit or (self.layers > 1 and len(frontier) == 0):
+				self.root_logger.info('LAYER ' + str(self.layers - 1) + ' DONE\n')
+				if len(frontier) == 0:
+					self.root_logger.info('ALL CONNECTED OBJECTS FOUND')
 				else:
-					sql_query = "SELECT obj->>'" + obj_type + "_id' FROM " + parts[0] + " WHERE obj->>'id'='" + parts[1] + "'"
+					self.layers -= 1
+					self.truncated = 'depth'
+				return
 
-				self.queries[sql_query] = True
-				self.cur.execute(sql_query)
+			if (self.layers == 1):
+				start = self.start_layer()
+				(obj_type, obj_id) = objs[0].split()
+				frontier = [graph.add_node(obj_type, obj_id, self.get_node_info(obj_id, obj_type))]
+				self.end_layer(0, start)
+				yield graph
+			else:
+				self.root_logger.info('LAYER ' + str(self.layers - 1) + ' DONE. SEARCHING LAYER ' + str(self.layers) + '...\n')
 
-				result = self.cur.fetchall()
-				
+			if self.out_of_budget():
+				self.root_logger.info("DEADLINE REACHED")
+				self.layers -= 1
+				return
+			start = self.start_layer()
+			try:
+				(frontier, limit_reached) = self.expand_layer(frontier, obj_limit)
+			except pcg2.extensions.QueryCanceledError: # the layer is dropped whole, since expand_layer only adds nodes once all its lookups are done
+				self.root_logger.info("DEADLINE REACHED")
+				self.truncated = 'deadline'
+				self.layers -= 1
+				self.end_layer(self.layers + 1, start)
+				return
+			self.end_layer(self.layers, start)
+			if limit_reached:
+				self.truncated = 'objects'
+			yield graph
+			if limit_reached:
+				return
 
-				if len(result) != 0 and result[0][0] != None and (obj_type + " " + result[0][0]) in self.existing_nodes:
-					if self.existing_nodes[obj] not in output[self.existing_nodes[obj_type + " " + result[0][0]]]['pointers_from']:
-						output[self.existing_nodes[obj_type + " " + result[0][0]]]['pointers_from'].append(self.existing_nodes[obj])
-				elif len(result) != 0 and result[0][0] != None:
-					try:
-						info = self.get_node_info(result[0][0], obj_type, pointer = obj)
-						working_objects.append(obj_type + " " + result[0][0])
-						success_counter += 1
-						self.existing_nodes[working_objects[-1]] = current + success_counter
-						if (current + success_counter) in output:
-							output[current + success_counter]['pointers_from'].append(self.existing_nodes[obj])
-						else:
-							output[current + success_counter] = {'pointers_from': [self.existing_nodes[obj]], 'id': result[0][0], 'type': obj_type, 'name': info[0], 'status': info[1], 'deleted': info[2], 'type_full': info[3]}
-
-						if len(self.existing_nodes) >= obj_limit:
-							self.root_logger.info("OBJECT LIMIT REACHED")
-							return output
-					except Exception as e:
-						pass
+	def expand_layer(self, objs, obj_limit):
+		"""
+		Adds the objects one layer out from a frontier to self.graph. The layer is expanded with one query per
+		(object type, edge type) pair in the frontier rather than one per object, then the results are replayed in
+		frontier order so nodes are numbered exactly as a per-object walk would number them
+		:param objs: the frontier, as node indices
+		:type objs: list
+		:param obj_limit: the maximum number of objects that can be in the generated network
+		:type obj_limit: int
+		:returns: the next frontier, and whether the object limit was reached
+		:rtype: tuple (list, bool)
+		"""
+		graph = self.graph
+		frontier = {} # object type -> ids of the frontier's objects of that type
+		for node in objs:
+			frontier.setdefault(graph.type_of(node), []).append(graph.node_id[node])
 
+		keys = [] # ('parents' or 'children', object type, edge type) for each lookup
+		jobs = []
+		costs = [] # the rows each lookup is expected to return, from the edge catalog's cardinality estimates if loaded
+		for (obj_type, obj_ids) in frontier.items():
+			parent_types = [parent_type for parent_type in self.pointers_to.get(obj_type, []) if self.builder.has_table(parent_type)]
+			if len(parent_types) > 0: # one lookup for every parent type
+				keys.append(('parents', obj_type, None))
+				jobs.append((self.fetch_parent_ids, (obj_type, obj_ids)))
+				costs.append(len(obj_ids) * sum(self.schema.edge_cost(obj_type, parent_type) or 1 for parent_type in parent_types))
+			for child_type in self.pointed_to_by.get(obj_type, []):
+				if self.builder.has_table(child_type):
+					costs.append(len(obj_ids) * (self.schema.edge_cost(child_type, obj_type, parents=False) or 1))
+					if self.sample: # children are only counted here, then fetched once the layer's budget is split up
+						keys.append(('child_counts', obj_type, child_type))
+						jobs.append((self.fetch_child_counts, (obj_type, obj_ids, child_type)))
+						continue
+					keys.append(('children', obj_type, child_type))
+					jobs.append((self.fetch_children, (obj_type, obj_ids, child_type)))
+
+		parents = {} # (object type, parent type) -> {object id: [parent ids]}
+		new_parents = {} # parent type -> parent ids not yet in the network
+		children = {} # (object type, child type) -> {object id: [child rows]}
+		counts = {} # (object type, child type) -> {object id: number of children}, when sampling
+		for ((kind, obj_type, edge_type), found) in zip(keys, self.run_jobs(jobs, costs)):
+			if kind == 'children':
+				children[(obj_type, edge_type)] = found
+				continue
+			if kind == 'child_counts':
+				counts[(obj_type, edge_type)] = found
+				continue
+			for (parent_type, found_ids) in found.items():
+				parents[(obj_type, parent_type)] = found_ids
+				for parent_ids in found_ids.values():
+					for parent_id in parent_ids:
+						if graph.find(parent_type, parent_id) is None:
+							new_parents.setdefault(parent_type, set()).add(parent_id)
+		parent_types = list(new_parents)
+		jobs = [(self.fetch_node_infos, (parent_type, new_parents[parent_type])) for parent_type in parent_types]
+		costs = [len(new_parents[parent_type]) for parent_type in parent_types]
+		groups = []
+		if self.sample: # new parents are few and are kept whole, so children get whatever budget they leave
+			(limits, whole) = self.schedule_children(counts, obj_limit - len(graph) - sum(len(parent_ids) for parent_ids in new_parents.values()))
+			for (group, per_object) in limits.items():
+				groups.append(group)
+				costs.append(sum(per_object.values()))
+				if group in whole:
+					jobs.append((self.fetch_children, (group[0], list(per_object), group[1])))
 				else:
-					try:
-						if obj_type == 'user_' or obj_type == 'order_':
-							sql_query = "SELECT obj->>'" + obj_type + "ids' FROM " + parts[0] + " WHERE obj->>'id'='" + parts[1] + "'"
-						else:
-							sql_query = "SELECT obj->>'" + obj_type + "_ids' FROM " + parts[0] + " WHERE obj->>'id'='" + parts[1] + "'"
-						self.cur.execute(sql_query)
-						
-						results = json.loads(self.cur.fetchall()[0][0]).keys()
-						self.queries[sql_query] = True
-						for r in results:
-							if (obj_type + " " + r) in self.existing_nodes:
-								if self.existing_nodes[obj] not in output[self.existing_nodes[obj_type + " " + r]]['pointers_from']:
-									output[self.existing_nodes[obj_type + " " + r]]['pointers_from'].append(self.existing_nodes[obj])
-							else:
-								information = self.get_node_info(r, obj_type, pointer = obj)
-								working_objects.append(obj_type + " " + r)
-								success_counter += 1
-								self.existing_nodes[working_objects[-1]] = current + success_counter
-								if (current + success_counter) in output:
-									output[self.existing_nodes[obj_type + " " + r]]['pointers_from'].append(self.existing_nodes[obj])
-								else:
-									
-									output[current + success_counter] = {'pointers_from': [self.existing_nodes[obj]], 'id': r, 'type': obj_type, 'name': information[0], 'status': information[1], 'deleted': information[2], 'type_full': information[3]}
-								if len(self.existing_nodes) >= obj_limit:
-									self.root_logger.info("OBJECT LIMIT REACHED")
-									return output
-					except Exception as e:
-						pass
-			try: #adding child nodes that point to the object
-				for obj_type in self.pointed_to_by[obj.split()[0]]:
-					if parts[0] == 'user_' or parts[0] == 'order_':
-						sql_query = "SELECT obj->>'id', obj->>'name', obj->>'status', obj->>'deleted', obj->>'type_full' FROM " + obj_type + " WHERE obj->>'" + parts[0] + "id'='" + parts[1] + "'"
+					jobs.append((self.fetch_children_sample, (group[0], per_object, group[1])))
+		results = self.run_jobs(jobs, costs)
+		parent_infos = dict(zip(parent_types, results[:len(parent_types)]))
+		children.update(zip(groups, results[len(parent_types):]))
+
+		working_objects = []
+		for current in objs:
+			(current_type, current_id) = (graph.type_of(current), graph.node_id[current])
+			for obj_type in self.pointers_to.get(current_type, []): # adding parent nodes that the current object points to
+				for r in parents.get((current_type, obj_type), {}).get(current_id, []):
+					found = graph.find(obj_type, r)
+					if found is not None:
+						graph.add_edge(found, current)
+					elif r in parent_infos[obj_type]:
+						this_index = graph.add_node(obj_type, r, parent_infos[obj_type][r])
+						graph.add_edge(this_index, current)
+						working_objects.append(this_index)
+						if len(graph) >= obj_limit:
+							self.root_logger.info("OBJECT LIMIT REACHED")
+							return (working_objects, True)
+					else:
+						self.root_logger.info(obj_type + " " + r + " (POINTED TO BY " + current_type + " " + current_id + ") DID NOT PARSE, POSSIBLY DOES NOT EXIST IN DATABASE")
+			for obj_type in self.pointed_to_by.get(current_type, []): # adding child nodes that point to the object
+				for r in children.get((current_type, obj_type), {}).get(current_id, []):
+					found = graph.find(obj_type, r[0])
+					if found is not None:
+						graph.add_edge(current, found)
 					else:
-						sql_query = "SELECT obj->>'id', obj->>'name', obj->>'status', obj->>'deleted', obj->>'type_full' FROM " + obj_type + " WHERE obj->>'" + parts[0] + "_id'='" + parts[1] + "'"
-					
-					self.cur.execute(sql_query)
-					results = self.cur.fetchall()
-					self.queries[sql_query] = True
-
-					for r in results:
-						if r[0] != None:
-							if (obj_type + " " + r[0]) in self.existing_nodes:
-								if self.existing_nodes[obj_type + " " + r[0]] not in output[current]['pointers_from']:
-									output[current]['pointers_from'].append(self.existing_nodes[obj_type + " " + r[0]])
-							else:
-								working_objects.append(obj_type + " " + r[0])
-								success_counter += 1
-								self.existing_nodes[working_objects[-1]] = current + success_counter
-								output[current]['pointers_from'].append(current + success_counter)
-								if (current + success_counter) not in output:
-									output[current + success_counter] = {'pointers_from': [], 'id': r[0], 'type': obj_type, 'name': r[1], 'status': r[2], 'deleted': r[3], 'type_full': r[4]}
-								if len(self.existing_nodes) >= obj_limit:
-									self.root_logger.info("OBJECT LIMIT REACHED")
-									return output
+						this_index = graph.add_node(obj_type, r[0], r[1:])
+						graph.add_edge(current, this_index)
+						working_objects.append(this_index)
+						if len(graph) >= obj_limit:
+							self.root_logger.info("OBJECT LIMIT REACHED")
+							return (working_objects, True)
 
-			except Exception as e:
-				pass
+		return (working_objects, False)
 
-		return self.find_nearby_nodes_bf_graph(working_objects, dep_limit, output, obj_limit)
+	def expand_known(self, objs, indices, next_index, obj_limit, bloom = None, unexpanded = ()):
+		"""
+		Finds the objects one step from some objects of a network the client already holds, with the same lookups as a
+		layer of the breadth-first search (see expand_layer), and numbers the ones the client does not have yet from
+		next_index on, in the order the search finds them, so they merge into the client's network. Known objects other
+		than objs and unexpanded are taken to have been expanded already, as the search would have, so the edges their
+		expansion found are left out rather than sent again
+		:param objs: the objects to expand, as "objecttype objectid"
+		:type objs: list
+		:param indices: the client's index of every object it has numbered, keyed by "objecttype objectid"; must include objs
+		:type indices: dict
+		:param next_index: the first index the client has not used
+		:type next_index: int
+		:param obj_limit: the maximum number of objects one step out to find
+		:type obj_limit: int
+		:param bloom: the client's whole network as a Bloom filter (see in_bloom_filter), as (bits, number of hashes), if indices does not hold all of it
+		:type bloom: tuple (bytes, int)
+		:param unexpanded: the known objects besides objs that the client has not expanded yet, as "objecttype objectid"
+		:type unexpanded: set
+		:returns: the new objects keyed by index, like a stream layer's nodes, the edges the client does not have yet between objects it already has as [node, pointer] pairs (a known object the client did not number is given as "objecttype objectid"), and the number of known objects found
+		:rtype: tuple (dict, list, int)
+		"""
+		graph = self.graph
+		by_type = {} # object type -> ids of the objects to expand of that type, looked up in one query per type as expand_layer does
+		for obj in objs:
+			(obj_type, obj_id) = obj.split()
+			by_type.setdefault(obj_type, []).append(obj_id)
+		try:
+			infos = dict((obj_type, self.fetch_node_infos(obj_type, obj_ids)) for (obj_type, obj_ids) in by_type.items())
+		except pcg2.extensions.QueryCanceledError:
+			self.root_logger.info("DEADLINE REACHED")
+			self.truncated = 'deadline'
+			return ({}, [], 0)
+		for obj in objs:
+			(obj_type, obj_id) = obj.split()
+			if obj_id not in infos[obj_type]:
+				raise ObjectNotFound(obj + " does not exist")
+			graph.add_node(obj_type, obj_id, infos[obj_type][obj_id])
+		first = len(graph)
+		self.layers = 1
+		start = self.start_layer()
+		try:
+			(frontier, limit_reached) = self.expand_layer(list(range(first)), first + obj_limit)
+			if limit_reached:
+				self.truncated = 'objects'
+		except pcg2.extensions.QueryCanceledError:
+			self.root_logger.info("DEADLINE REACHED")
+			self.truncated = 'deadline'
+			return ({}, [], 0)
+		finally:
+			self.end_layer(1, start)
+
+		client = [indices[obj] for obj in objs] # graph node -> the client's index, or its key if the client has it unnumbered
+		new = []
+		expanded = set() # known nodes the client has expanded before
+		for node in range(first, len(graph)):
+			key = graph.types[graph.node_type[node]] + " " + graph.node_id[node]
+			if key in indices:
+				client.append(indices[key])
+			elif bloom is not None and in_bloom_filter(bloom[0], bloom[1], key):
+				client.append(key)
+			else:
+				client.append(next_index + len(new))
+				new.append(node)
+				continue
+			if key not in unexpanded:
+				expanded.add(node)
+		# an expanded object's lookups found every object it points to, and the objects that point to it by their single id field
+		held = set((node, pointer) for (node, pointer) in zip(graph.edge_node, graph.edge_pointer) if pointer in expanded)
+		children = {} # (parent type, child type) -> expanded parent id -> the nodes being expanded that point to it
+		for (node, pointer) in zip(graph.edge_node, graph.edge_pointer):
+			if node in expanded and pointer < first:
+				children.setdefault((graph.type_of(node), graph.type_of(pointer)), {}).setdefault(graph.node_id[node], []).append(pointer)
+		try:
+			for ((obj_type, child_type), found) in children.items():
+				for (obj_id, rows) in self.fetch_children(obj_type, list(found), child_type).items():
+					child_ids = set(r[0] for r in rows)
+					held.update((graph.find(obj_type, obj_id), pointer) for pointer in found.get(obj_id, []) if graph.node_id[pointer] in child_ids)
+		except pcg2.extensions.QueryCanceledError:
+			self.root_logger.info("DEADLINE REACHED")
+			self.truncated = 'deadline'
+			return ({}, [], 0)
+		pointers = {}
+		edges = []
+		for (node, pointer) in zip(graph.edge_node, graph.edge_pointer):
+			if node >= first and isinstance(client[node], int) and client[node] >= next_index and isinstance(client[pointer], int):
+				pointers.setdefault(node, []).append(client[pointer])
+			elif (node, pointer) not in held:
+				edges.append([client[node], client[pointer]])
+		nodes = dict((client[node], graph.node_dict(node, pointers.get(node, []))) for node in new)
+		return (nodes, edges, len(graph) - first - len(new))
 
-	def get_output_stats(self, output):
+	def type_distances(self, obj_type):
 		"""
-		Produces statistics about the generated network of objects, including counts/frequencies of object types and subtypes and maximum depth
-		:param output: the generated network of objects
-		:type output: dict
-		:returns: statistics about the object network
+		Finds how many edges apart every object type is from one type in the object type graph, following edges either way
+		:param obj_type: the type to measure from
+		:type obj_type: str
+		:returns: the distance of every type that can be reached, keyed by type
 		:rtype: dict
 		"""
-		type_dict = {}
-		type_full_dict = {}
-		total = 0
-		for key in output.keys():
-			if output[key]['deleted'] == "0":
-				try:
-					type_dict[output[key]['type']] += 1
-				except:
-					type_dict[output[key]['type']] = 1
-				try:
-					type_full_dict[output[key]['type_full']] += 1
-				except:
-					type_full_dict[output[key]['type_full']] = 1
-				total += 1
-		final_stats = {}
-		for key in type_dict.keys():
-			final_stats[key + "(" + str(type_dict[key]) + "/" + str(int(np.rint((type_dict[key]/total)*100))) + "%)"] = {'count': type_dict[key], 'percent_of_total': (type_dict[key]/total)*100}
-			for k in type_full_dict.keys():
-				if k == None:
-					pass
-				elif k.startswith(key):
-					final_stats[key + "(" + str(type_dict[key]) + "/" + str(int(np.rint((type_dict[key]/total)*100))) + "%)"][k + "(" + str(type_full_dict[k]) + "/" + str(int(np.rint((type_full_dict[k]/total)*100))) + "%)"] = {'count': type_full_dict[k], 'percent_of_total': (type_full_dict[k]/total)*100, 'percent_of_' + key + '(s)': (type_full_dict[k]/type_dict[key])*100}
-		return (final_stats, total)
+		distances = {obj_type: 0}
+		frontier = [obj_type]
+		while len(frontier) > 0:
+			next_frontier = []
+			for current in frontier:
+				for neighbor in self.pointers_to.get(current, []) + self.pointed_to_by.get(current, []):
+					if neighbor not in distances and self.builder.has_table(neighbor):
+						distances[neighbor] = distances[current] + 1
+						next_frontier.append(neighbor)
+			frontier = next_frontier
+		return distances
+
+	def find_paths(self, source, target, dep_limit = 6, k = 1, obj_limit = 10000):
+		"""
+		Finds up to k shortest paths between two objects with a bidirectional breadth-first search: one search from each
+		end, always expanding whichever frontier is smaller by a whole layer, until the two meet. Before any query runs,
+		the object type graph is checked for a path of types short enough, and each search only follows edges to types
+		that can still reach the other end within the depth limit. Unlike a network search, children that point to an object
+		through a map of ids are found from the object's side too (see fetch_plural_children), so both searches see every
+		edge and the paths are the shortest ones. The paths' objects are added to self.graph
+		:param source: the object the paths start from, as "objecttype objectid"
+		:type source: str
+		:param target: the object the paths end at, as "objecttype objectid"
+		:type target: str
+		:param dep_limit: the maximum number of edges a path may have
+		:type dep_limit: int
+		:param k: the maximum number of paths to return; all of them have the shortest length found
+		:type k: int
+		:param obj_limit: the maximum number of objects the two searches may visit together
+		:type obj_limit: int
+		:returns: the paths, as lists of node indices in self.graph from source to target; empty if there is no path, and self.truncated is set if a budget ran out first
+		:rtype: list
+		"""
+		ends = [tuple(source.split()), tuple(target.split())]
+		infos = {}
+		for end in ends:
+			infos[end] = self.get_node_info(end[1], end[0])
+		# the distance of each type from the other end bounds how far each search's objects of that type are worth following
+		remaining = [self.type_distances(ends[1][0]), self.type_distances(ends[0][0])]
+		if remaining[0].get(ends[0][0], dep_limit + 1) > dep_limit:
+			self.root_logger.info("NO PATH OF TYPES BETWEEN " + source + " AND " + target)
+			return []
+		visited = [{ends[0]: 0}, {ends[1]: 0}] # each search's objects and their distance from its end
+		previous = [{ends[0]: []}, {ends[1]: []}] # each search's objects and the objects one step closer to its end
+		links = set() # (child, parent) for every edge followed
+		frontiers = [[ends[0]], [ends[1]]]
+		depths = [0, 0]
+		meeting = [ends[0]] if ends[0] == ends[1] else []
+		start = self.start_layer()
+		while len(meeting) == 0:
+			if depths[0] + depths[1] >= dep_limit or len(frontiers[0]) == 0 or len(frontiers[1]) == 0:
+				break
+			if self.out_of_budget():
+				break
+			if len(visited[0]) + len(visited[1]) >= obj_limit:
+				self.truncated = 'objects'
+				break
+			side = 0 if len(frontiers[0]) <= len(frontiers[1]) else 1
+			depth = depths[side] + 1
+			try:
+				found = self.expand_path_layer(frontiers[side], infos, links)
+			except pcg2.extensions.QueryCanceledError:
+				self.truncated = 'deadline'
+				break
+			frontiers[side] = []
+			for (node, neighbor) in found:
+				if visited[side].get(neighbor, depth) < depth or depth + remaining[side].get(neighbor[0], dep_limit + 1) > dep_limit:
+					continue
+				if neighbor not in visited[side]:
+					visited[side][neighbor] = depth
+					previous[side][neighbor] = []
+					frontiers[side].append(neighbor)
+				if node not in previous[side][neighbor]:
+					previous[side][neighbor].append(node)
+			depths[side] = depth
+			if len(frontiers[side]) > 0:
+				shortest = min(depth + visited[1 - side].get(node, dep_limit + 1) for node in frontiers[side])
+				meeting = [node for node in frontiers[side] if depth + visited[1 - side].get(node, dep_limit + 1) == shortest and shortest <= dep_limit]
+		self.end_layer(None, start)
+		self.layers = depths[0] + depths[1]
+
+		def halves(node, side):
+			# every shortest route from a search's end to one of its objects, end first
+			if len(previous[side][node]) == 0:
+				yield [node]
+			for prev in previous[side][node]:
+				for route in halves(prev, side):
+					yield route + [node]
+
+		def routes():
+			for node in meeting:
+				for head in halves(node, 0):
+					for tail in halves(node, 1):
+						yield head + tail[::-1][1:]
+
+		paths = list(itertools.islice(routes(), k))
+		graph = self.graph
+		node_paths = []
+		for path in paths:
+			for obj in path:
+				if graph.find(obj[0], obj[1]) is None:
+					graph.add_node(obj[0], obj[1], infos[obj])
+			node_paths.append([graph.find(obj[0], obj[1]) for obj in path])
+			for (a, b) in zip(path, path[1:]):
+				if (a, b) in links:
+					graph.add_edge(graph.find(b[0], b[1]), graph.find(a[0], a[1]))
+				if (b, a) in links:
+					graph.add_edge(graph.find(a[0], a[1]), graph.find(b[0], b[1]))
+		self.path_visited = len(visited[0]) + len(visited[1])
+		return node_paths
+
+	def expand_path_layer(self, frontier, infos, links):
+		"""
+		Finds the objects one step from a layer of a path search, with one lookup per (object type, edge type) pair
+		:param frontier: the layer's objects, as (type, id) pairs
+		:type frontier: list
+		:param infos: the name, status, deleted and type_full of every object found so far, keyed by (type, id), which the new objects' are added to
+		:type infos: dict
+		:param links: (child, parent) for every edge followed so far, which the new edges are added to
+		:type links: set
+		:returns: (object in the layer, object one step from it) for every edge from the layer to an object that exists, in layer order
+		:rtype: list
+		"""
+		by_type = {}
+		for (obj_type, obj_id) in frontier:
+			by_type.setdefault(obj_type, []).append(obj_id)
+		keys = []
+		jobs = []
+		for (obj_type, obj_ids) in by_type.items():
+			if any(self.builder.has_table(parent_type) for parent_type in self.pointers_to.get(obj_type, [])):
+				keys.append((obj_type, None))
+				jobs.append((self.fetch_parent_ids, (obj_type, obj_ids)))
+			for child_type in self.pointed_to_by.get(obj_type, []):
+				if self.builder.has_table(child_type):
+					keys.append((obj_type, child_type))
+					jobs.append((self.fetch_children, (obj_type, obj_ids, child_type)))
+					keys.append((obj_type, child_type, 'plural'))
+					jobs.append((self.fetch_plural_children, (obj_type, obj_ids, child_type)))
+		results = dict(zip(keys, self.run_jobs(jobs)))
+		new_parents = {}
+		for key in keys:
+			if key[1] is None:
+				for (parent_type, found) in results[key].items():
+					for parent_ids in found.values():
+						new_parents.setdefault(parent_type, set()).update(parent_id for parent_id in parent_ids if (parent_type, parent_id) not in infos)
+			else:
+				for rows in results[key].values():
+					for r in rows:
+						infos[(key[1], r[0])] = r[1:]
+		parent_types = list(new_parents)
+		for (parent_type, found) in zip(parent_types, self.run_jobs([(self.fetch_node_infos, (parent_type, list(new_parents[parent_type]))) for parent_type in parent_types])):
+			for (parent_id, info) in found.items():
+				infos[(parent_type, parent_id)] = info
+
+		steps = []
+		for node in frontier:
+			(obj_type, obj_id) = node
+			for parent_type in self.pointers_to.get(obj_type, []):
+				for parent_id in results.get((obj_type, None), {}).get(parent_type, {}).get(obj_id, []):
+					if (parent_type, parent_id) in infos:
+						links.add((node, (parent_type, parent_id)))
+						steps.append((node, (parent_type, parent_id)))
+			for child_type in self.pointed_to_by.get(obj_type, []):
+				for r in results.get((obj_type, child_type), {}).get(obj_id, []) + results.get((obj_type, child_type, 'plural'), {}).get(obj_id, []):
+					links.add(((child_type, r[0]), node))
+					steps.append((node, (child_type, r[0])))
+		return steps
+
+	def get_output_stats(self):
+		"""
+		Produces statistics about the generated network of objects, including counts/frequencies of object types and subtypes,
+		from the counters self.graph keeps as objects are added
+		:returns: the counts of object types and subtypes, and the number of non-deleted objects
+		:rtype: tuple
+		"""
+		return format_output_stats(*self.graph.live_type_counts())
+
+	def get_full_stats(self, obj_type, obj_id, dep_limit):
+		"""
+		Counts the object types and subtypes of an object's whole depth-limited neighborhood with one aggregate query (see
+		queries.compile_traversal), however many objects the object limit kept out of the network, up to
+		MAX_FULL_STATS_OBJECTS objects
+		:param obj_type: the type of the starting object
+		:type obj_type: str
+		:param obj_id: the id of the starting object
+		:type obj_id: str
+		:param dep_limit: the maximum depth that the search is allowed to reach
+		:type dep_limit: int
+		:returns: the counts of object types and subtypes, the number of non-deleted objects, the number of objects, and whether MAX_FULL_STATS_OBJECTS cut the count short; or None if searching a snapshot or the deadline passed
+		:rtype: dict
+		"""
+		if self.cur is None or dep_limit < 1:
+			return None
+		try:
+			rows = self.run_query(self.builder.get('traversal_stats'), (obj_type, obj_id, dep_limit, MAX_FULL_STATS_OBJECTS))
+		except pcg2.extensions.QueryCanceledError:
+			self.root_logger.info("DEADLINE REACHED")
+			return None
+		if len(rows) == 0: # the starting object's type has no edges, so the network is the whole neighborhood
+			(types, total) = self.get_output_stats()
+			return {'types': types, 'total_non-deleted_objects': total, 'objects': len(self.graph), 'capped': False}
+		type_counts = {}
+		type_full_counts = {}
+		objects = 0
+		for (row_type, type_full, live, n) in rows:
+			objects += n
+			if live:
+				type_counts[row_type] = type_counts.get(row_type, 0) + n
+				type_full_counts[(row_type, type_full)] = n
+		(types, total) = format_output_stats(type_counts, type_full_counts)
+		return {'types': types, 'total_non-deleted_objects': total, 'objects': objects, 'capped': objects >= MAX_FULL_STATS_OBJECTS}
 
 #EMPTY TALBES IN DB DUMP:
 #acl, ad_deleted, ad_deleted_bak, adunit_deleted, adunit_deleted_bak, adunitgroup_adunit_xref,
@@ -410,20 +1413,473 @@ class ObjectTree:
 #seat, site_deleted, site_deleted_bak, targeting_options, type_uuid_mapping, user_partner_xref
 
 
+def allocate_budget(demands, budget):
+	"""
+	Splits an object budget across groups of candidate objects in proportion to each group's size times its weight,
+	never giving a group more than its size; whatever a capped group does not use is split among the rest, and
+	rounding is settled by largest remainder
+	:param demands: (size, weight) of each group, keyed by anything
+	:type demands: dict
+	:param budget: the number of objects to hand out
+	:type budget: int
+	:returns: the number of objects each group gets, keyed like demands
+	:rtype: dict
+	"""
+	allocation = dict((key, 0) for key in demands)
+	left = [key for key in demands if demands[key][0] > 0 and demands[key][1] > 0]
+	while budget > 0 and len(left) > 0:
+		total = sum(demands[key][0] * demands[key][1] for key in left)
+		shares = dict((key, budget * demands[key][0] * demands[key][1] / total) for key in left)
+		capped = [key for key in left if shares[key] >= demands[key][0]]
+		if len(capped) > 0:
+			for key in capped:
+				allocation[key] = demands[key][0]
+				budget -= demands[key][0]
+			left = [key for key in left if key not in capped]
+			continue
+		for key in left:
+			allocation[key] = int(shares[key])
+		remainder = budget - sum(allocation[key] for key in left)
+		for key in sorted(left, key=lambda key: allocation[key] - shares[key])[:remainder]:
+			allocation[key] += 1
+		break
+	return allocation
+
+def format_output_stats(type_counts, type_full_counts):
+	"""
+	Formats counts of non-deleted objects the way getNetwork reports them: each type keyed as "type(count/percent%)",
+	holding its count, its share of the total, and each of its subtypes whose type_full starts with the type's name
+	:param type_counts: object type -> count
+	:type type_counts: dict
+	:param type_full_counts: (object type, type_full) -> count
+	:type type_full_counts: dict
+	:returns: the counts of object types and subtypes, and the number of non-deleted objects
+	:rtype: tuple
+	"""
+	total = sum(type_counts.values())
+	final_stats = {}
+	keys = {}
+	for (key, count) in type_counts.items():
+		keys[key] = key + "(" + str(count) + "/" + str(int(round(count / total * 100))) + "%)"
+		final_stats[keys[key]] = {'count': count, 'percent_of_total': (count / total) * 100}
+	for ((key, k), count) in type_full_counts.items():
+		if k is not None and k.startswith(key):
+			final_stats[keys[key]][k + "(" + str(count) + "/" + str(int(round(count / total * 100))) + "%)"] = {'count': count, 'percent_of_total': (count / total) * 100, 'percent_of_' + key + '(s)': (count / type_counts[key]) * 100}
+	return (final_stats, total)
+
+def in_bloom_filter(bits, hashes, key):
+	"""
+	Checks whether a Bloom filter may hold a key. Bit i of the filter is bits[i // 8] & (1 << (i % 8)), and the key's
+	bits are (h1 + j * h2) mod the filter's size for j below hashes, where h1 and h2 are the first two big-endian 64-bit
+	words of the SHA-256 of the key
+	:param bits: the filter
+	:type bits: bytes
+	:param hashes: the number of bits set per key
+	:type hashes: int
+	:param key: the key, as "objecttype objectid"
+	:type key: str
+	:returns: whether all of the key's bits are set; False means the filter certainly does not hold it
+	:rtype: bool
+	"""
+	digest = hashlib.sha256(key.encode('utf-8')).digest()
+	(h1, h2) = (int.from_bytes(digest[:8], 'big'), int.from_bytes(digest[8:16], 'big'))
+	size = len(bits) * 8
+	for j in range(hashes):
+		bit = (h1 + j * h2) % size
+		if not bits[bit // 8] & (1 << (bit % 8)):
+			return False
+	return True
+
+def objects_etag(fields, hashes):
+	"""
+	Builds the ETag of a getObjectsInfo response, which changes whenever any of the objects, the set of objects asked
+	for, or the fields asked for do
+	:param fields: the top-level fields asked for, or None for whole objects
+	:type fields: list
+	:param hashes: an md5 of each stored object (None for objects that do not exist), keyed by "objecttype objectid"
+	:type hashes: dict
+	:returns: the ETag, unquoted
+	:rtype: str
+	"""
+	return hashlib.md5(json.dumps([fields, sorted(hashes.items())]).encode('utf-8')).hexdigest()
+
+def setup_logging():
+	"""
+	Attaches the runtime.log and stdout handlers to the root logger, once per process. It runs when the server takes
+	its first request or the command line starts, not on import, so importing api (e.g. from benchmark.py) leaves the
+	log of a server running in the same directory alone
+	"""
+	root_logger = logging.getLogger()
+	if getattr(root_logger, 'objviz_configured', False):
+		return
+	root_logger.setLevel(logging.DEBUG)
+	handler = logging.FileHandler('runtime.log', 'w', 'utf-8')
+	handler.setFormatter(logging.Formatter('%(name)s %(message)s'))
+	second_handler = logging.StreamHandler(sys.stdout)
+	second_handler.setLevel(logging.DEBUG)
+	second_handler.setFormatter(logging.Formatter('%(name)s %(message)s'))
+	root_logger.addHandler(handler)
+	root_logger.addHandler(second_handler)
+	root_logger.objviz_configured = True
+
 app = flask.Flask(__name__)
 app.config["DEBUG"] = True
 
+DEFAULT_CONCURRENCY = 4 # connections each getNetwork layer's lookups are spread over, unless the request asks otherwise
+MAX_CONCURRENCY = 8
+MAX_EXPLAIN = 5 # query templates a getNetwork request may ask to have explained
+DEFAULT_TIMEOUT_MS = int(os.environ.get('OBJVIZ_TIMEOUT_MS', 30000)) # how long a getNetwork search may run, unless the request asks otherwise
+MAX_TIMEOUT_MS = 300000
+MAX_FULL_STATS_OBJECTS = 1000000 # objects a fullStats=true count may walk before it stops
+MAX_INFO_OBJECTS = 1000 # objects one getObjectsInfo request may ask for
+DEFAULT_PATH_DEPTH = 6 # edges a getPath path may have, unless the request asks otherwise
+MAX_PATH_DEPTH = 12
+MAX_PATHS = 10 # paths one getPath request may ask for
+DEFAULT_PATH_OBJECTS = 20000 # objects a getPath search may visit, unless the request asks otherwise
+MAX_EXPAND_NODES = 1000 # objects one expand request may expand
+DEFAULT_EXPAND_OBJECTS = 1000 # objects an expand request may find, unless the request asks otherwise
+
+@app.before_first_request
+def start_logging():
+	setup_logging()
+
+@app.before_request
+def start_timer():
+	flask.g.started = time.time()
+
+@app.after_request
+def record_request(response):
+	endpoint = str(flask.request.endpoint)
+	metrics.inc('objviz_requests_total', endpoint=endpoint, status=str(response.status_code))
+	metrics.observe('objviz_request_duration_seconds', time.time() - flask.g.started, endpoint=endpoint)
+	return response
+
+@app.errorhandler(UnknownTable)
+def unknown_table(e):
+	return flask.jsonify({"success" : False, "error" : {"type" : "UnknownObjectType", "message" : str(e)}}), 400
+
+@app.errorhandler(ObjectNotFound)
+def object_not_found(e):
+	return flask.jsonify({"success" : False, "error" : {"type" : "ObjectNotFound", "message" : str(e)}}), 404
+
+@app.errorhandler(Overloaded)
+def overloaded(e):
+	metrics.inc('objviz_admission_total', outcome='rejected')
+	response = flask.jsonify({"success" : False, "error" : {"type" : "TooManyRequests", "message" : str(e), "cost" : e.cost, "retryAfter" : e.retry_after}})
+	response.headers['Retry-After'] = str(e.retry_after)
+	return response, 429
 
 
 @app.route('/api/verifyURI', methods=['GET'])
 def verify_connection():
 	try:
 		url = flask.request.args.get('uri')
-		test = ObjectTree(url, 'connections.txt')
-		return flask.jsonify(success=True), 200
+		with ObjectTree(url, SCHEMA_PATH) as test:
+			return flask.jsonify(success=True), 200
 	except:
 		return flask.jsonify({"success" : False, "error" : {"type" : "InvalidDatabaseCredentials", "message" : "Could not connect to database with given credentials"}})
 
+def open_tree(url, source = None):
+	"""
+	Makes the tree a getNetwork request traverses
+	:param url: the url of the database
+	:type url: str
+	:param source: "snapshot" to traverse the database's snapshot (see api.py --snapshot) instead of the database
+	:type source: str
+	:returns: the tree
+	:rtype: ObjectTree
+	"""
+	if source == 'snapshot':
+		return ObjectTree(url, SCHEMA_PATH, snapshot=SnapshotSource(load_snapshot(snapshot_path(url))))
+	return ObjectTree(url, SCHEMA_PATH)
+
+def network_statistics(tree, full = None):
+	"""
+	Builds the statistics block of a getNetwork response
+	:param tree: the tree that generated the network
+	:type tree: ObjectTree
+	:param full: the type counts of the whole neighborhood, if asked for (see ObjectTree.get_full_stats)
+	:type full: dict
+	:returns: the counts of object types and subtypes, the maximum depth, the node cache's hits and misses, the queries run, their rows and time, how long each layer took, what cut the search short, if anything, for a sampled search, the true number of children per edge type and per sampled node, and the whole neighborhood's counts, if asked for
+	:rtype: dict
+	"""
+	statistics = tree.get_output_stats()
+	stats = {'types': statistics[0], 'max_depth': tree.layers, 'total_non-deleted_objects': statistics[1], 'cache': {'hits': tree.cache_hits, 'misses': tree.cache_misses},
+		'queries': tree.query_count, 'rows': tree.rows_fetched, 'db_ms': round(tree.db_seconds * 1000, 3), 'layer_timings': tree.layer_timings, 'truncated': tree.truncated}
+	if tree.sample:
+		stats['fan_out'] = {'edges': tree.edge_counts, 'sampled': dict((str(node), counts) for (node, counts) in tree.sampled.items())}
+	if full is not None:
+		stats['full'] = full
+	return stats
+
+def record_traversal(tree, engine):
+	"""
+	Adds a finished search to the /metrics counters
+	:param tree: the tree that generated the network
+	:type tree: ObjectTree
+	:param engine: the engine that searched, as given in the request
+	:type engine: str
+	"""
+	engine = engine or 'bfs'
+	metrics.inc('objviz_traversals_total', engine=engine)
+	metrics.inc('objviz_traversal_seconds_total', sum(timing['ms'] for timing in tree.layer_timings) / 1000, engine=engine) # excludes time spent sending streamed layers
+	metrics.inc('objviz_traversal_db_seconds_total', tree.db_seconds, engine=engine)
+	metrics.inc('objviz_traversal_objects_total', len(tree.graph), engine=engine)
+	if tree.truncated is not None:
+		metrics.inc('objviz_traversals_truncated_total', engine=engine, reason=tree.truncated)
+	metrics.inc('objviz_cache_hits_total', tree.cache_hits)
+	metrics.inc('objviz_cache_misses_total', tree.cache_misses)
+
+def stream_network(url, obj_type, obj_id, depth_limit, obj_limit, concurrency = DEFAULT_CONCURRENCY, source = None, sse = False, engine = None, explain = 0, deadline = None, query_limit = None, sample = False, weights = None, full_stats = False, sql_queries = True):
+	"""
+	Generates a network breadth-first and sends it one layer at a time, as newline-delimited JSON or server-sent events.
+	Each "layer" message holds the nodes found in that layer, keyed by index, the edges added to nodes sent in earlier
+	layers as [node index, index of the node pointing to it] pairs, and the type counts of the network so far; a final
+	"statistics" message holds the statistics and SQL queries of the whole network
+	:param url: the url of the database
+	:type url: str
+	:param obj_type: the type of the starting object
+	:type obj_type: str
+	:param obj_id: the id of the starting object
+	:type obj_id: str
+	:param depth_limit: the maximum depth that the search is allowed to reach
+	:type depth_limit: int
+	:param obj_limit: the maximum number of objects that can be in the generated network
+	:type obj_limit: int
+	:param concurrency: how many connections each layer's lookups may be spread over
+	:type concurrency: int
+	:param source: "snapshot" to traverse the database's snapshot instead of the database
+	:type source: str
+	:param sse: whether to send server-sent events instead of newline-delimited JSON
+	:type sse: bool
+	:param engine: "sql" to search with one recursive query, or "dfs" to search depth-first, either of which sends the whole network as a single layer, or "edges" to search layer by layer in the edge table
+	:type engine: str
+	:param explain: how many of the slowest query templates to explain in the statistics message (see ObjectTree.explain_slowest)
+	:type explain: int
+	:param deadline: the time (as from time.time()) by which the search must stop, if any (see ObjectTree.set_deadline)
+	:type deadline: float
+	:param query_limit: with engine "dfs", the maximum number of statements the search may execute, if any
+	:type query_limit: int
+	:param sample: whether the breadth-first search samples children to fit the object limit (see ObjectTree.schedule_children)
+	:type sample: bool
+	:param weights: child type -> weight of its share of a sampled layer's object budget
+	:type weights: dict
+	:param full_stats: whether to also count the types of the whole neighborhood, past the object limit (see ObjectTree.get_full_stats)
+	:type full_stats: bool
+	:param sql_queries: whether the statistics message includes the statistics of each query template
+	:type sql_queries: bool
+	:returns: the encoded messages
+	:rtype: generator of str
+	"""
+	def encode(message):
+		if sse:
+			return "event: " + message['type'] + "\ndata: " + json.dumps(message) + "\n\n"
+		return json.dumps(message) + "\n"
+
+	try:
+		with open_tree(url, source) as test:
+			test.concurrency = concurrency
+			test.sample = sample
+			test.weights = weights or {}
+			test.edge_table = (engine == 'edges')
+			test.set_deadline(deadline)
+			(sent_nodes, sent_edges) = (0, 0)
+			layer = 0
+			if engine == 'sql':
+				test.find_nearby_nodes_sql_graph([obj_type + " " + obj_id], depth_limit, obj_limit)
+				graphs = [test.graph]
+			elif engine == 'dfs':
+				test.find_nearby_nodes_df_graph([obj_type + " " + obj_id], depth_limit, obj_limit, query_limit)
+				graphs = [test.graph]
+			else:
+				graphs = test.iter_bf_graph([obj_type + " " + obj_id], depth_limit, obj_limit)
+			for graph in graphs:
+				(nodes, edges) = graph.to_network(sent_nodes, sent_edges)
+				(sent_nodes, sent_edges) = (len(graph), graph.edge_count())
+				(types, total) = test.get_output_stats()
+				yield encode({'type': 'layer', 'layer': layer, 'nodes': nodes, 'edges': edges, 'statistics': {'types': types, 'total_non-deleted_objects': total}})
+				layer += 1
+			full = test.get_full_stats(obj_type, obj_id, depth_limit) if full_stats else None
+			test.explain_slowest(explain)
+	except Exception as e:
+		logging.getLogger().info(traceback.format_exc())
+		yield encode({'type': 'error', 'error': {'type': type(e).__name__, 'message': str(e)}})
+		return
+	test.root_logger.info(str(len(test.graph)) + " OBJECTS FOUND")
+	record_traversal(test, engine)
+	message = {'type': 'statistics', 'statistics': network_statistics(test, full)}
+	if sql_queries:
+		message['sqlQueries'] = test.queries
+	yield encode(message)
+
+def build_network(url, obj_type, obj_id, depth_limit, obj_limit, concurrency, source, engine, explain, query_limit, sample, weights, full_stats, fmt, sql_queries, deadline = None):
+	"""
+	Generates a network and serializes the getNetwork response for it (see parse_request for the parameters)
+	:returns: the serialized response, and whether it may be cached, i.e. the deadline did not cut the search or its full statistics short
+	:rtype: tuple (bytes, bool)
+	"""
+	with open_tree(url, source) as test:
+		test.concurrency = concurrency
+		test.sample = sample
+		test.weights = weights
+		test.edge_table = (engine == 'edges')
+		test.set_deadline(deadline)
+		if engine == 'sql':
+			output = test.find_nearby_nodes_sql_graph([obj_type + " " + obj_id], depth_limit, obj_limit=obj_limit)
+		elif engine == 'dfs':
+			output = test.find_nearby_nodes_df_graph([obj_type + " " + obj_id], depth_limit, obj_limit=obj_limit, query_limit=query_limit)
+		else:
+			output = test.find_nearby_nodes_bf_graph(np.array([obj_type + " " + obj_id]), depth_limit, obj_limit=obj_limit)
+		full = test.get_full_stats(obj_type, obj_id, depth_limit) if full_stats else None
+		test.explain_slowest(explain)
+	test.root_logger.info(str(len(output)) + " OBJECTS FOUND")
+	record_traversal(test, engine)
+	body = {'network': output if fmt == 'json' else test.graph.to_columns(), 'statistics': network_statistics(test, full)}
+	if sql_queries:
+		body['sqlQueries'] = test.queries
+	test.root_logger.info('SENDING RESPONSE')
+	return (encode_body(body, fmt), test.truncated != 'deadline' and (full is not None or not full_stats))
+
+def admit_search(url, depth_limit, obj_limit, deadline):
+	"""
+	Waits for one of the database's search slots (see AdmissionLimiter), for as long as the request's deadline allows
+	:param url: the url of the database
+	:type url: str
+	:param depth_limit: the search's depth limit
+	:type depth_limit: int
+	:param obj_limit: the search's object limit
+	:type obj_limit: int
+	:param deadline: the request's deadline, as a time.time() timestamp, or None
+	:type deadline: float
+	:returns: the slot's token, to pass to the limiter's release
+	:rtype: tuple
+	"""
+	timeout = ADMISSION_QUEUE_TIMEOUT if deadline is None else max(0, min(ADMISSION_QUEUE_TIMEOUT, deadline - time.time()))
+	token = get_limiter(url).acquire(search_cost(depth_limit, obj_limit), timeout)
+	metrics.inc('objviz_admission_total', outcome='admitted')
+	return token
+
+def release_once(url, token):
+	"""
+	Makes a function that frees a search slot taken with admit_search the first time it is called, and does nothing after
+	:param url: the url of the database
+	:type url: str
+	:param token: what admit_search returned
+	:type token: tuple
+	:returns: the function
+	:rtype: callable
+	"""
+	released = []
+	lock = threading.Lock()
+	def release():
+		with lock:
+			if len(released) > 0:
+				return
+			released.append(True)
+		get_limiter(url).release(token)
+	return release
+
+def releasing(messages, release):
+	"""
+	Passes a streamed response's messages on, then calls release once they have all been sent or the stream is closed
+	:param messages: the messages
+	:type messages: generator of str
+	:param release: what to call at the end
+	:type release: callable
+	:returns: the messages
+	:rtype: generator of str
+	"""
+	try:
+		for message in messages:
+			yield message
+	finally:
+		release()
+
+def admitted_network(key, args, deadline):
+	"""
+	Generates a getNetwork response once a search slot is free, and caches it if it may be (see build_network)
+	:param key: the response's cache key
+	:type key: tuple
+	:param args: the arguments of build_network
+	:type args: tuple
+	:param deadline: the request's deadline, as a time.time() timestamp
+	:type deadline: float
+	:returns: the serialized response, whether it was cached, and its gzipped copy if it was
+	:rtype: tuple (bytes, bool, bytes)
+	"""
+	limiter = get_limiter(args[0])
+	token = admit_search(args[0], args[3], args[4], deadline)
+	try:
+		(payload, storable) = build_network(*args, deadline=deadline)
+	finally:
+		limiter.release(token)
+	gzipped = None
+	if storable:
+		gzipped = compress(payload, 'gzip')
+		response_cache.put(key, gzipped)
+	return (payload, storable, gzipped)
+
+def network_cache_key(url, obj_type, obj_id, depth_limit, obj_limit, engine, source, query_limit, sample, weights, full_stats, fmt, sql_queries):
+	"""
+	Gets the response cache key of a getNetwork request, from every parameter that changes the response it gets
+	:returns: the key, starting with the database's dsn_fingerprint
+	:rtype: tuple
+	"""
+	return (dsn_fingerprint(url), obj_type, obj_id, depth_limit, obj_limit, engine or 'bfs', source or 'db', query_limit if engine == 'dfs' else None, sample, tuple(sorted(weights.items())) if sample else (), full_stats, fmt, sql_queries)
+
+def refresh_network(key, args, timeout_ms):
+	"""
+	Regenerates a stale cached getNetwork response in the background, after its stale copy has been sent
+	:param key: the response's cache key
+	:type key: tuple
+	:param args: the arguments of build_network
+	:type args: tuple
+	:param timeout_ms: how long the search may run
+	:type timeout_ms: int
+	"""
+	try:
+		network_flights.do(key, admitted_network, key, args, time.time() + timeout_ms / 1000)
+	except Overloaded as e:
+		metrics.inc('objviz_admission_total', outcome='rejected')
+		logging.getLogger().info("REFRESH SKIPPED: " + str(e))
+	except Exception as e:
+		logging.getLogger().info("REFRESH FAILED: " + traceback.format_exc())
+	finally:
+		response_cache.finish_refresh(key)
+
+def send_payload(mimetype, cache_status, age, payload = None, gzipped = None):
+	"""
+	Sends a serialized response compressed with the best encoding the client accepts. A cached, gzipped copy is sent
+	as is to any client that accepts gzip at all
+	:param mimetype: the response's media type
+	:type mimetype: str
+	:param cache_status: the Cache-Status header, saying how the response cache answered
+	:type cache_status: str
+	:param age: how many seconds ago the response was generated, if it came from the cache
+	:type age: int
+	:param payload: the serialized response, if at hand
+	:type payload: bytes
+	:param gzipped: the gzipped serialized response, if at hand
+	:type gzipped: bytes
+	:returns: the response
+	:rtype: flask.Response
+	"""
+	encoding = flask.request.accept_encodings.best_match(available_encodings())
+	if gzipped is not None and (encoding == 'gzip' or (payload is None and 'gzip' in flask.request.accept_encodings)):
+		(data, encoding) = (gzipped, 'gzip')
+	else:
+		if payload is None:
+			payload = gzip.decompress(gzipped)
+		data = payload if encoding is None else compress(payload, encoding)
+	response = flask.Response(data, mimetype=mimetype)
+	if encoding is not None:
+		response.headers['Content-Encoding'] = encoding
+	response.headers['Vary'] = 'Accept, Accept-Encoding'
+	response.headers['Cache-Status'] = cache_status
+	if age is not None:
+		response.headers['Age'] = str(age)
+	return response
+
 @app.route('/api/getNetwork', methods=['GET'])
 def parse_request():
 	obj_id = flask.request.args.get('id')
@@ -433,49 +1889,301 @@ def parse_request():
 		obj_limit = int(flask.request.args.get('objectLimit'))
 	except:
 		obj_limit = 100
+	try:
+		concurrency = max(1, min(int(flask.request.args.get('concurrency')), MAX_CONCURRENCY))
+	except:
+		concurrency = DEFAULT_CONCURRENCY
+	try:
+		explain = max(0, min(int(flask.request.args.get('explain')), MAX_EXPLAIN))
+	except:
+		explain = 0
+	try:
+		timeout_ms = max(1, min(int(flask.request.args.get('timeoutMs')), MAX_TIMEOUT_MS))
+	except:
+		timeout_ms = DEFAULT_TIMEOUT_MS
+	deadline = flask.g.started + timeout_ms / 1000
+	try:
+		query_limit = int(flask.request.args.get('queryLimit'))
+	except:
+		query_limit = None
+	sample = flask.request.args.get('sample') in ["True", "true"]
+	weights = {}
+	for pair in flask.request.args.get('weights', "").split(","): # e.g. weights=site:2,creative:0.5
+		try:
+			(child_type, weight) = pair.split(":")
+			weights[child_type] = float(weight)
+		except:
+			pass
+	full_stats = flask.request.args.get('fullStats') in ["True", "true"] # also count the whole neighborhood's types, past the object limit
 	
 	url = flask.request.args.get('uri')
-	test = ObjectTree(url, 'connections.txt')
-	
-	#FOR IMPLEMENTING DEPTH-FIRST QUERY:
-	# if flask.request.args.get('depthFirst') in ["True", "true"]:
-	# 	df = True
-	# else:
-	# 	df = False
-	# if df:
-	# 	output = test.find_nearby_nodes_df_graph(obj_limit, (obj_type + " " + obj_id))
-	# else:
-	# 	output = test.find_nearby_nodes_bf_graph(np.array([obj_type + " " + obj_id]), depth_limit, obj_limit=obj_limit)
-
-	output = test.find_nearby_nodes_bf_graph(np.array([obj_type + " " + obj_id]), depth_limit, obj_limit=obj_limit)
-	max_depth = test.layers
-	test.cur.close()
-	test.con.close()
-	test.root_logger.info(str(len(output)) + " OBJECTS FOUND")
-	statistics = test.get_output_stats(output)
-	stats = {'types': statistics[0], 'max_depth': max_depth, 'total_non-deleted_objects': statistics[1]}
-	test.root_logger.info('SENDING RESPONSE')
-	return flask.jsonify({'network': output, 'sqlQueries': test.queries, 'statistics': stats})
+	source = flask.request.args.get('source')
+	if source == 'snapshot' and not os.path.exists(snapshot_path(url)):
+		return flask.jsonify({"success" : False, "error" : {"type" : "SnapshotNotFound", "message" : "No snapshot has been built for this database; run api.py --snapshot"}}), 404
+	engine = flask.request.args.get('engine') # "sql" for one recursive query, "dfs" for depth-first, "edges" for the layer-by-layer search over the edge table, else the layer-by-layer search
+	if flask.request.args.get('depthFirst') in ["True", "true"]:
+		engine = 'dfs'
+	if engine in ['sql', 'edges'] and source == 'snapshot':
+		return flask.jsonify({"success" : False, "error" : {"type" : "InvalidParameters", "message" : "engine=" + engine + " searches the database itself and cannot be combined with source=snapshot"}}), 400
+	if engine == 'edges':
+		def check_edge_table():
+			with ObjectTree(url, SCHEMA_PATH) as test:
+				return edge_table_installed(test.cur)
+		if not edge_table_ready(url, check_edge_table):
+			return flask.jsonify({"success" : False, "error" : {"type" : "EdgeTableNotFound", "message" : "No edge table has been installed in this database; run api.py --install-edges"}}), 404
+	sql_queries = flask.request.args.get('sqlQueries') not in ["False", "false"] # sqlQueries=false leaves the per-template query statistics out
+	fmt = flask.request.args.get('format') # "json", "columns", "msgpack" or "arrow"; else chosen by the Accept header
+	if fmt is None:
+		fmt = negotiate_format(flask.request.accept_mimetypes)
+	if fmt not in available_formats():
+		return flask.jsonify({"success" : False, "error" : {"type" : "NotAcceptable", "message" : "format must be one of " + ", ".join(available_formats()) + "; msgpack and arrow are only offered when their packages are installed"}}), 406
+	stream = flask.request.args.get('stream')
+	if stream in ["True", "true", "ndjson", "sse"]:
+		headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'} # so proxies pass each layer on as soon as it is sent
+		release = release_once(url, admit_search(url, depth_limit, obj_limit, deadline)) # the slot is held until the last message is sent or the client goes away
+		messages = stream_network(url, obj_type, obj_id, depth_limit, obj_limit, concurrency, source, sse=(stream == "sse"), engine=engine, explain=explain, deadline=deadline, query_limit=query_limit, sample=sample, weights=weights, full_stats=full_stats, sql_queries=sql_queries)
+		response = flask.Response(releasing(messages, release), mimetype='text/event-stream' if stream == "sse" else 'application/x-ndjson', headers=headers)
+		response.call_on_close(release)
+		return response
+
+	args = (url, obj_type, obj_id, depth_limit, obj_limit, concurrency, source, engine, explain, query_limit, sample, weights, full_stats, fmt, sql_queries)
+	if explain > 0: # explained plans are only wanted fresh
+		token = admit_search(url, depth_limit, obj_limit, deadline)
+		try:
+			(payload, storable) = build_network(*args, deadline=deadline)
+		finally:
+			get_limiter(url).release(token)
+		return send_payload(MEDIA_TYPES[fmt], "objviz; fwd=bypass", None, payload=payload)
+	key = network_cache_key(url, obj_type, obj_id, depth_limit, obj_limit, engine, source, query_limit, sample, weights, full_stats, fmt, sql_queries)
+	if 'no-cache' not in flask.request.headers.get('Cache-Control', ""):
+		cached = response_cache.get(key)
+		if cached is not None:
+			(gzipped, age, ttl) = cached
+			if ttl < 0 and response_cache.start_refresh(key):
+				threading.Thread(target=refresh_network, args=(key, args, timeout_ms), daemon=True).start()
+			metrics.inc('objviz_response_cache_total', status='hit' if ttl >= 0 else 'stale')
+			return send_payload(MEDIA_TYPES[fmt], "objviz; hit; ttl=" + str(ttl), age, gzipped=gzipped)
+	# identical requests that arrive while this one's search runs wait for it instead of searching again
+	((payload, storable, gzipped), shared) = network_flights.do(key, admitted_network, key, args, deadline)
+	if shared:
+		metrics.inc('objviz_coalesced_total')
+	metrics.inc('objviz_response_cache_total', status='miss')
+	return send_payload(MEDIA_TYPES[fmt], "objviz; fwd=miss" + ("; collapsed" if shared else "") + ("; stored" if storable else ""), 0, payload=payload, gzipped=gzipped)
+
+@app.route('/api/getPath', methods=['GET'])
+def get_path():
+	"""
+	Finds up to k shortest paths between two objects (see ObjectTree.find_paths). Takes from and to as "objecttype
+	objectid", maxDepth (the most edges a path may have), k, objectLimit (the most objects the search may visit),
+	timeoutMs, uri and source. Responds with the paths' objects as a network, like getNetwork's, and each path as a list
+	of their indices; 404 NoPath if there is provably no path within maxDepth
+	"""
+	url = flask.request.args.get('uri')
+	source = flask.request.args.get('source')
+	ends = [flask.request.args.get('from', ""), flask.request.args.get('to', "")]
+	if any(len(end.split()) != 2 for end in ends):
+		return flask.jsonify({"success" : False, "error" : {"type" : "InvalidParameters", "message" : "from and to must both be given as \"objecttype objectid\""}}), 400
+	try:
+		dep_limit = max(0, min(int(flask.request.args.get('maxDepth')), MAX_PATH_DEPTH))
+	except:
+		dep_limit = DEFAULT_PATH_DEPTH
+	try:
+		k = max(1, min(int(flask.request.args.get('k')), MAX_PATHS))
+	except:
+		k = 1
+	try:
+		obj_limit = int(flask.request.args.get('objectLimit'))
+	except:
+		obj_limit = DEFAULT_PATH_OBJECTS
+	try:
+		timeout_ms = max(1, min(int(flask.request.args.get('timeoutMs')), MAX_TIMEOUT_MS))
+	except:
+		timeout_ms = DEFAULT_TIMEOUT_MS
+	if source == 'snapshot' and not os.path.exists(snapshot_path(url)):
+		return flask.jsonify({"success" : False, "error" : {"type" : "SnapshotNotFound", "message" : "No snapshot has been built for this database; run api.py --snapshot"}}), 404
+	with open_tree(url, source) as test:
+		test.set_deadline(flask.g.started + timeout_ms / 1000)
+		try:
+			paths = test.find_paths(ends[0], ends[1], dep_limit, k, obj_limit)
+		except ObjectNotFound:
+			return flask.jsonify({"success" : False, "error" : {"type" : "ObjectNotFound", "message" : "Both " + ends[0] + " and " + ends[1] + " must exist"}}), 404
+	metrics.inc('objviz_paths_total', found=str(len(paths) > 0).lower())
+	if len(paths) == 0 and test.truncated is None:
+		return flask.jsonify({"success" : False, "error" : {"type" : "NoPath", "message" : "No path of at most " + str(dep_limit) + " edges connects " + ends[0] + " and " + ends[1]}}), 404
+	stats = {'length': len(paths[0]) - 1 if len(paths) > 0 else None, 'visited': test.path_visited, 'cache': {'hits': test.cache_hits, 'misses': test.cache_misses},
+		'queries': test.query_count, 'rows': test.rows_fetched, 'db_ms': round(test.db_seconds * 1000, 3), 'truncated': test.truncated}
+	return flask.jsonify({'network': test.graph.to_network()[0], 'paths': paths, 'statistics': stats, 'sqlQueries': test.queries})
+
+@app.route('/api/expand', methods=['POST'])
+def expand_nodes():
+	"""
+	Finds the objects one step from some objects of a network the client already holds (see ObjectTree.expand_known),
+	instead of searching the whole network again one layer deeper. Takes a JSON body with uri, source, nodes (the
+	objects to expand, as {"objecttype objectid": index}), the rest of the client's network as either known (every
+	object, as "objecttype objectid", in index order) or bloom ({"bits": base64, "hashes": k}, see in_bloom_filter),
+	unexpanded (the objects besides nodes that the client holds but has not expanded, by default none, as when nodes is
+	the last layer of a getNetwork network), next (the first unused index, by default one past the highest index in nodes
+	and known), objectLimit and timeoutMs. Responds like a stream layer: the new objects keyed by index, the edges the
+	client does not have yet between objects it already has, and the next unused index
+	"""
+	body = flask.request.get_json(silent=True) or {}
+	url = body.get('uri')
+	source = body.get('source')
+	nodes = body.get('nodes')
+	known = body.get('known', [])
+	unexpanded = body.get('unexpanded', [])
+	if not isinstance(nodes, dict) or len(nodes) == 0 or len(nodes) > MAX_EXPAND_NODES or not isinstance(known, list) or not isinstance(unexpanded, list):
+		return flask.jsonify({"success" : False, "error" : {"type" : "InvalidParameters", "message" : "nodes must map between 1 and " + str(MAX_EXPAND_NODES) + " \"objecttype objectid\" keys to their indices, and known and unexpanded must be lists"}}), 400
+	unexpanded = set(" ".join(str(key).split()) for key in unexpanded)
+	indices = dict((key, index) for (index, key) in enumerate(known))
+	bloom = None
+	try:
+		for (key, index) in nodes.items():
+			if len(key.split()) != 2:
+				raise ValueError(key + " is not \"objecttype objectid\"")
+			indices[" ".join(key.split())] = int(index)
+		if body.get('bloom') is not None:
+			bloom = (base64.b64decode(body['bloom']['bits']), max(1, int(body['bloom']['hashes'])))
+			if len(bloom[0]) == 0:
+				raise ValueError("the Bloom filter is empty")
+		next_index = int(body.get('next', max(indices.values()) + 1))
+		if next_index <= max(indices.values()):
+			raise ValueError("next must be above every index the client has used")
+	except (ValueError, TypeError, KeyError) as e:
+		return flask.jsonify({"success" : False, "error" : {"type" : "InvalidParameters", "message" : str(e)}}), 400
+	try:
+		obj_limit = max(1, int(body.get('objectLimit')))
+	except:
+		obj_limit = DEFAULT_EXPAND_OBJECTS
+	try:
+		timeout_ms = max(1, min(int(body.get('timeoutMs')), MAX_TIMEOUT_MS))
+	except:
+		timeout_ms = DEFAULT_TIMEOUT_MS
+	if source == 'snapshot' and not os.path.exists(snapshot_path(url)):
+		return flask.jsonify({"success" : False, "error" : {"type" : "SnapshotNotFound", "message" : "No snapshot has been built for this database; run api.py --snapshot"}}), 404
+	deadline = flask.g.started + timeout_ms / 1000
+	token = admit_search(url, 1, obj_limit, deadline)
+	try:
+		with open_tree(url, source) as test:
+			test.set_deadline(deadline)
+			try:
+				objs = sorted(set(" ".join(key.split()) for key in nodes), key=lambda key: indices[key]) # in the client's order, which JSON objects need not keep
+				(found, edges, found_known) = test.expand_known(objs, indices, next_index, obj_limit, bloom, unexpanded)
+			except ObjectNotFound as e:
+				return flask.jsonify({"success" : False, "error" : {"type" : "ObjectNotFound", "message" : "Every object in nodes must exist in the database"}}), 404
+	finally:
+		get_limiter(url).release(token)
+	record_traversal(test, 'expand')
+	stats = {'new': len(found), 'known': found_known, 'cache': {'hits': test.cache_hits, 'misses': test.cache_misses}, 'queries': test.query_count, 'rows': test.rows_fetched,
+		'db_ms': round(test.db_seconds * 1000, 3), 'layers': test.layer_timings, 'truncated': test.truncated}
+	return flask.jsonify({'nodes': found, 'edges': edges, 'next': next_index + len(found), 'statistics': stats})
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+	return flask.Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/cache/flush', methods=['POST'])
+def flush_cache():
+	url = flask.request.args.get('uri') # flushes every database's cache if not given
+	return flask.jsonify(success=True, flushed=flush_node_caches(url) + response_cache.flush(url))
 
 @app.route('/api/getTypes', methods=['GET'])
 def return_types():
 	url = flask.request.args.get('uri')
-	test = ObjectTree(url, 'connections.txt')
-	output = test.get_tables()
-	test.cur.close()
-	test.con.close()
+	with ObjectTree(url, SCHEMA_PATH) as test:
+		output = test.get_tables()
 	return flask.jsonify(output)
 
 @app.route('/api/getObjectInfo', methods=['GET'])
 def get_info():
 	url = flask.request.args.get('uri')
-	test = ObjectTree(url, 'connections.txt')
 	obj_id = flask.request.args.get('id')
 	obj_type = flask.request.args.get('type')
-	output = test.query_current_node_info(obj_id, obj_type)
-	test.cur.close()
-	test.con.close()
+	with ObjectTree(url, SCHEMA_PATH) as test:
+		output = test.query_current_node_info(obj_id, obj_type)
 	return flask.jsonify(output)
 
+@app.route('/api/getObjectsInfo', methods=['POST'])
+def get_infos():
+	"""
+	Looks up many objects at once. The body is {"objects": [...]}, each object either a {"type": ..., "id": ...} dict or
+	an "objecttype objectid" string, and fields=name,status,... limits each object to those top-level fields. Responds
+	with each object's information keyed by "objecttype objectid" (null if it does not exist), tagged with an ETag
+	derived from the stored objects, so a request sent with a matching If-None-Match gets an empty 304
+	"""
+	url = flask.request.args.get('uri')
+	fields = flask.request.args.get('fields')
+	if fields is not None:
+		fields = [field for field in fields.split(",") if field != ""]
+	body = flask.request.get_json(silent=True) or {}
+	objs = []
+	try:
+		for obj in body['objects']:
+			if isinstance(obj, dict):
+				objs.append((str(obj['type']), str(obj['id'])))
+			else:
+				(obj_type, obj_id) = obj.split()
+				objs.append((obj_type, obj_id))
+	except Exception:
+		return flask.jsonify({"success" : False, "error" : {"type" : "InvalidParameters", "message" : "The body must be {\"objects\": [...]}, each object a {\"type\": ..., \"id\": ...} dict or an \"objecttype objectid\" string"}}), 400
+	if len(objs) > MAX_INFO_OBJECTS:
+		return flask.jsonify({"success" : False, "error" : {"type" : "InvalidParameters", "message" : "At most " + str(MAX_INFO_OBJECTS) + " objects can be looked up at once"}}), 400
+	with ObjectTree(url, SCHEMA_PATH) as test:
+		(output, hashes) = test.query_objects_info(objs, fields)
+	etag = objects_etag(fields, hashes)
+	if flask.request.if_none_match.contains(etag):
+		response = flask.Response(status=304)
+	else:
+		response = flask.jsonify(output)
+	response.set_etag(etag)
+	response.headers['Cache-Control'] = 'no-cache' # always revalidate, since the objects can change
+	return response
+
 if __name__ == "__main__":
-	app.run()
+	parser = argparse.ArgumentParser(description="Serves the objviz API, or manages the database it reads from")
+	parser.add_argument('--ensure-indexes', action='store_true', help="create the expression indexes traversal queries need, then exit")
+	parser.add_argument('--dry-run', action='store_true', help="with --ensure-indexes, only report which indexes exist")
+	parser.add_argument('--snapshot', action='store_true', help="scan the whole object graph into a snapshot for source=snapshot requests, then exit")
+	parser.add_argument('--discover', action='store_true', help="infer the object type graph from the database's jsonb keys and write it as an edge catalog, then exit")
+	parser.add_argument('--output', default="edges.json", help="with --discover, the file to write the edge catalog to; serve it by setting OBJVIZ_SCHEMA to its path")
+	parser.add_argument('--install-edges', action='store_true', help="create (or rebuild) the trigger-maintained edge table for engine=edges requests, then exit")
+	parser.add_argument('--drop-edges', action='store_true', help="remove the edge table and its triggers, then exit")
+	parser.add_argument('--uri', help="the url of the database to manage")
+	args = parser.parse_args()
+	setup_logging()
+	if args.ensure_indexes:
+		with ObjectTree(args.uri, SCHEMA_PATH) as tree:
+			for entry in tree.ensure_indexes(create=not args.dry_run):
+				line = entry['status'].upper().ljust(8) + " " + entry['kind'].ljust(5) + " " + entry['table'] + " (" + entry['key'] + ") " + entry['index']
+				if 'cost_after' in entry:
+					line += " cost " + str(entry['cost_before']) + " -> " + str(entry['cost_after']) + " (" + str(round(entry['cost_before'] / max(entry['cost_after'], 0.01), 1)) + "x)"
+				elif 'cost_before' in entry:
+					line += " cost " + str(entry['cost_before'])
+				print(line)
+	elif args.discover:
+		with ObjectTree(args.uri, SCHEMA_PATH) as tree:
+			catalog = discover_catalog(tree.con, tree.get_tables())
+		write_catalog(catalog, args.output)
+		for edge in catalog['edges']:
+			print((edge['child'] + " -> " + edge['parent']).ljust(40) + " " + edge['key'].ljust(24) + " coverage " + str(edge['coverage']).ljust(7) + " parents/child " + str(edge['parents_per_child']).ljust(8) + " children/parent " + str(edge['children_per_parent']))
+		for field in catalog['unresolved']:
+			print("UNRESOLVED " + field['table'] + "." + field['key'] + (" -> " + field['points_to'] if 'points_to' in field else "") + " (" + str(field['objects']) + " objects)")
+		print("EDGE CATALOG WRITTEN TO " + args.output + ": " + str(len(catalog['edges'])) + " EDGES BETWEEN " + str(len(catalog['tables'])) + " TABLES IN " + str(catalog['discovery_seconds']) + "s")
+	elif args.snapshot:
+		with ObjectTree(args.uri, SCHEMA_PATH) as tree:
+			tables = tree.get_tables()
+		meta = build_snapshot(args.uri, load_schema(SCHEMA_PATH), tables, snapshot_path(args.uri))
+		print("SNAPSHOT WRITTEN TO " + snapshot_path(args.uri) + ": " + str(meta['nodes']) + " OBJECTS, " + str(meta['parent_edges']) + " POINTERS IN " + str(meta['build_seconds']) + "s")
+	elif args.install_edges or args.drop_edges:
+		with ObjectTree(args.uri, SCHEMA_PATH) as tree:
+			tables = tree.get_tables()
+		if args.drop_edges:
+			drop_edge_table(args.uri, load_schema(SCHEMA_PATH), tables)
+			print("EDGE TABLE " + EDGE_TABLE + " DROPPED")
+		else:
+			report = install_edge_table(args.uri, load_schema(SCHEMA_PATH), tables)
+			for entry in report:
+				print(entry['table'].ljust(40) + " " + str(entry['edges']).rjust(10) + " edges in " + str(entry['seconds']) + "s")
+			print("EDGE TABLE " + EDGE_TABLE + " WRITTEN: " + str(sum(entry['edges'] for entry in report)) + " EDGES FROM " + str(len(report)) + " TABLES")
+	else:
+		app.run()
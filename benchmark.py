@@ -0,0 +1,295 @@
+import argparse
+import io
+import json
+import logging
+import math
+import multiprocessing
+import platform
+import random
+import resource
+import sys
+import time
+import numpy as np
+import psycopg2 as pcg2
+from schema import SCHEMA_PATH, load_schema
+
+
+BENCH_ROOTS = 20 # accounts (and objects of any other type with no parents) in the synthetic dataset
+BENCH_FAN_OUT = 5 # children each parent has, on average, for edge types not given with --fan-out
+BENCH_MAX_ROWS = 50000 # cap on the rows generated for any one object type
+BENCH_HUBS = 2 # accounts that get BENCH_HUB_CHILDREN children, spread over every type that points to accounts
+BENCH_HUB_CHILDREN = 12000
+BENCH_IDS_RATE = 0.1 # share of pointers stored as a jsonb map of ids (e.g. site_ids) instead of a single id field
+BENCH_DANGLING_RATE = 0.01 # share of pointers to objects that do not exist
+BENCH_SEED = 7
+
+BENCH_ENGINES = ['bfs', 'sql', 'dfs']
+BENCH_STARTS = ['account 1', 'adunit 1', 'order_ 1', 'ad 1'] # account 1 is a hub
+BENCH_DEPTH_LIMITS = [2, 3, 4]
+BENCH_OBJECT_LIMITS = [100, 1000, 10000]
+BENCH_RUNS = 5 # timed runs per case, after one warm-up run
+
+
+def plan_counts(schema, roots, fan_out, max_rows, hubs, hub_children):
+	"""
+	Decides how many objects of each type the synthetic dataset gets. Types with no parents (other than themselves) get
+	roots objects, and every other type gets its average fan-out times the objects of the first parent type already
+	planned, plus room for the hub accounts' children
+	:param schema: the object type graph
+	:type schema: SchemaGraph
+	:param roots: objects of each type with no parents
+	:type roots: int
+	:param fan_out: average children per parent for each (child type, parent type) edge; others use BENCH_FAN_OUT
+	:type fan_out: dict
+	:param max_rows: cap on the objects of any one type
+	:type max_rows: int
+	:param hubs: how many accounts are hubs
+	:type hubs: int
+	:param hub_children: children of each hub account
+	:type hub_children: int
+	:returns: object type -> number of objects, and the number of children of each type every hub account gets
+	:rtype: tuple (dict, int)
+	"""
+	obj_types = sorted(set(schema.pointers_to) | set(schema.pointed_to_by))
+	counts = {}
+	for obj_type in obj_types:
+		if all(parent_type == obj_type for parent_type in schema.pointers_to.get(obj_type, [])):
+			counts[obj_type] = roots
+	hub_types = [obj_type for obj_type in schema.pointed_to_by.get('account', []) if obj_type != 'account']
+	hub_share = int(math.ceil(hub_children / max(len(hub_types), 1)))
+	while len(counts) < len(obj_types):
+		progress = False
+		for obj_type in obj_types:
+			if obj_type in counts:
+				continue
+			for parent_type in schema.pointers_to.get(obj_type, []):
+				if parent_type in counts:
+					count = fan_out.get((obj_type, parent_type), BENCH_FAN_OUT) * counts[parent_type]
+					if obj_type in hub_types:
+						count += hubs * hub_share
+					counts[obj_type] = max(1, min(count, max_rows))
+					progress = True
+					break
+		if not progress: # a cycle with no way in; give it roots objects too
+			for obj_type in obj_types:
+				counts.setdefault(obj_type, roots)
+	return (counts, hub_share)
+
+def generate_dataset(dsn, schema, roots = BENCH_ROOTS, fan_out = {}, max_rows = BENCH_MAX_ROWS, hubs = BENCH_HUBS, hub_children = BENCH_HUB_CHILDREN, ids_rate = BENCH_IDS_RATE, dangling_rate = BENCH_DANGLING_RATE, seed = BENCH_SEED):
+	"""
+	Replaces every table in the object type graph with synthetic objects shaped like the ad server's: one jsonb obj
+	column per table, ids "1" to "n" for each type, and pointer fields that are a single id, a jsonb map of ids, or an
+	id that does not exist. The first hubs accounts get hub_children children between them and the types that point to
+	accounts, so searches from account 1 hit a very wide layer. The same arguments always generate the same dataset
+	:param dsn: the url of the database; its object tables are dropped and recreated
+	:type dsn: str
+	:param schema: the object type graph
+	:type schema: SchemaGraph
+	:returns: the parameters the dataset was generated with, and the number of objects of each type
+	:rtype: dict
+	"""
+	(counts, hub_share) = plan_counts(schema, roots, fan_out, max_rows, hubs, hub_children)
+	rng = random.Random(seed)
+	con = pcg2.connect(dsn)
+	con.autocommit = True
+	cur = con.cursor()
+	started = time.time()
+	for obj_type in sorted(counts):
+		print("GENERATING " + str(counts[obj_type]) + " " + obj_type + " OBJECTS")
+		cur.execute("DROP TABLE IF EXISTS " + obj_type + " CASCADE")
+		cur.execute("CREATE TABLE " + obj_type + " (obj jsonb)")
+		buffer = io.StringIO()
+		for n in range(counts[obj_type]):
+			obj = {'id': str(n + 1), 'name': obj_type + " " + str(n + 1), 'status': rng.choice(['Active', 'Active', 'Paused', 'Inactive']), 'deleted': '1' if rng.random() < 0.1 else '0', 'type_full': obj_type + "." + rng.choice(['standard', 'custom', 'house'])}
+			for parent_type in schema.pointers_to.get(obj_type, []):
+				key = schema.id_key(parent_type, child_type=obj_type)
+				if parent_type == 'account' and obj_type != 'account' and n < hubs * hub_share:
+					obj[key] = str(n // hub_share + 1) # the first objects of each type belong to the hubs
+					continue
+				r = rng.random()
+				if r < dangling_rate:
+					obj[key] = str(counts[parent_type] + 1 + rng.randrange(1000))
+				elif r < dangling_rate + ids_rate:
+					obj[key] = None
+					obj[schema.id_key(parent_type, plural=True, child_type=obj_type)] = dict((str(rng.randrange(counts[parent_type]) + 1), {}) for i in range(rng.randint(1, 3)))
+				else:
+					obj[key] = str(rng.randrange(counts[parent_type]) + 1)
+			buffer.write(json.dumps(obj).replace("\\", "\\\\") + "\n")
+		buffer.seek(0)
+		cur.copy_expert("COPY " + obj_type + " (obj) FROM STDIN", buffer)
+	con.close()
+	return {'roots': roots, 'fan_out': dict((a + " -> " + b, n) for ((a, b), n) in fan_out.items()), 'max_rows': max_rows, 'hubs': hubs, 'hub_children': hub_children, 'ids_rate': ids_rate, 'dangling_rate': dangling_rate, 'seed': seed, 'counts': counts, 'total': sum(counts.values()), 'generate_seconds': round(time.time() - started, 2)}
+
+def percentiles(samples):
+	"""
+	Summarizes a list of latencies
+	:param samples: latencies in seconds
+	:type samples: list
+	:returns: the p50, p90, p99, mean, min and max, in milliseconds
+	:rtype: dict
+	"""
+	ms = np.array(samples) * 1000
+	summary = {'p50': np.percentile(ms, 50), 'p90': np.percentile(ms, 90), 'p99': np.percentile(ms, 99), 'mean': ms.mean(), 'min': ms.min(), 'max': ms.max()}
+	return dict((key, round(float(value), 2)) for (key, value) in summary.items())
+
+def run_case(dsn, engine, start, depth_limit, obj_limit, runs, warm, concurrency):
+	"""
+	Times one search, in a fresh process (see run_matrix) so that its peak RSS is its own. The node cache is flushed
+	before every run unless warm is set, so each run does all of its database work
+	:param dsn: the url of the database
+	:type dsn: str
+	:param engine: "bfs", "sql" (one recursive query) or "dfs"
+	:type engine: str
+	:param start: the starting object, as "objecttype objectid"
+	:type start: str
+	:param depth_limit: the maximum depth that the search is allowed to reach
+	:type depth_limit: int
+	:param obj_limit: the maximum number of objects that can be in the generated network
+	:type obj_limit: int
+	:param runs: timed runs, after one warm-up run that is not counted
+	:type runs: int
+	:param warm: whether to keep the node cache between runs
+	:type warm: bool
+	:param concurrency: how many connections each bfs layer's lookups may be spread over
+	:type concurrency: int
+	:returns: the case, its latency percentiles, and the queries, rows, objects and edges of its last run
+	:rtype: dict
+	"""
+	import api # imported here so the parent process never opens connections
+	from cache import flush_node_caches
+	logging.getLogger().setLevel(logging.WARNING) # per-object log lines would dominate the timings
+	result = {'engine': engine, 'start': start, 'depthLimit': depth_limit, 'objectLimit': obj_limit, 'concurrency': concurrency, 'warm': warm}
+	rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	samples = []
+	try:
+		for run in range(runs + 1):
+			if not warm:
+				flush_node_caches(dsn)
+			started = time.time()
+			with api.ObjectTree(dsn, SCHEMA_PATH) as tree:
+				tree.concurrency = concurrency
+				if engine == 'sql':
+					output = tree.find_nearby_nodes_sql_graph([start], depth_limit, obj_limit)
+				elif engine == 'dfs':
+					output = tree.find_nearby_nodes_df_graph([start], depth_limit, obj_limit)
+				else:
+					output = tree.find_nearby_nodes_bf_graph([start], depth_limit, obj_limit)
+			if run > 0:
+				samples.append(time.time() - started)
+	except Exception as e:
+		result['error'] = type(e).__name__ + ": " + str(e)
+		return result
+	result['latency_ms'] = percentiles(samples)
+	result['queries'] = tree.query_count
+	result['rows_fetched'] = tree.rows_fetched
+	result['objects'] = len(output)
+	result['edges'] = sum(len(node['pointers_from']) for node in output.values())
+	result['max_depth'] = tree.layers
+	result['peak_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss # kilobytes on Linux
+	result['baseline_rss_kb'] = rss_before
+	return result
+
+def run_matrix(dsn, engines, starts, depth_limits, obj_limits, runs = BENCH_RUNS, warm = False, concurrency = 4):
+	"""
+	Runs every combination of engine, starting object, depth limit and object limit, each in its own process
+	:returns: one result per case (see run_case)
+	:rtype: list
+	"""
+	results = []
+	context = multiprocessing.get_context('spawn')
+	for engine in engines:
+		for start in starts:
+			for depth_limit in depth_limits:
+				for obj_limit in obj_limits:
+					with context.Pool(1) as pool:
+						result = pool.apply(run_case, (dsn, engine, start, depth_limit, obj_limit, runs, warm, concurrency))
+					results.append(result)
+					if 'error' in result:
+						print(engine.ljust(4) + " " + start.ljust(12) + " depth " + str(depth_limit).ljust(4) + " limit " + str(obj_limit).ljust(6) + " ERROR " + result['error'])
+					else:
+						print(engine.ljust(4) + " " + start.ljust(12) + " depth " + str(depth_limit).ljust(4) + " limit " + str(obj_limit).ljust(6) + " p50 " + str(result['latency_ms']['p50']).rjust(9) + "ms p99 " + str(result['latency_ms']['p99']).rjust(9) + "ms " + str(result['objects']).rjust(6) + " objects " + str(result['queries']).rjust(5) + " queries " + str(result['rows_fetched']).rjust(7) + " rows " + str(result['peak_rss_kb']) + "kB")
+	return results
+
+def case_key(result):
+	return (result['engine'], result['start'], result['depthLimit'], result['objectLimit'])
+
+def compare(results, baseline, tolerance):
+	"""
+	Finds the cases that got slower than in an earlier report
+	:param results: the cases just run
+	:type results: list
+	:param baseline: the "cases" of an earlier report
+	:type baseline: list
+	:param tolerance: how much slower (as a fraction) a case's p50 may get before it counts as a regression
+	:type tolerance: float
+	:returns: one entry per regressed case, with its p50 before and after
+	:rtype: list
+	"""
+	before = dict((case_key(result), result) for result in baseline if 'latency_ms' in result)
+	regressions = []
+	for result in results:
+		old = before.get(case_key(result))
+		if old is None:
+			continue
+		if 'error' in result:
+			regressions.append({'case': case_key(result), 'error': result['error']})
+		elif result['latency_ms']['p50'] > old['latency_ms']['p50'] * (1 + tolerance):
+			regressions.append({'case': case_key(result), 'p50_before': old['latency_ms']['p50'], 'p50_after': result['latency_ms']['p50']})
+	return regressions
+
+def parse_fan_out(values):
+	fan_out = {}
+	for value in values:
+		(edge, n) = value.rsplit("=", 1)
+		(child_type, parent_type) = [part.strip() for part in edge.split("->")]
+		fan_out[(child_type, parent_type)] = int(n)
+	return fan_out
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Benchmarks the traversal engines against a database, optionally filling it with a synthetic dataset first")
+	parser.add_argument('--uri', required=True, help="the url of the database to benchmark against")
+	parser.add_argument('--generate', action='store_true', help="DROP and recreate every table in the schema (OBJVIZ_SCHEMA, connections.txt by default) with synthetic objects first")
+	parser.add_argument('--roots', type=int, default=BENCH_ROOTS, help="objects of each type with no parents (e.g. accounts)")
+	parser.add_argument('--fan-out', action='append', default=[], metavar="CHILD->PARENT=N", help="average children per parent for one edge type (default " + str(BENCH_FAN_OUT) + "); may be repeated")
+	parser.add_argument('--max-rows', type=int, default=BENCH_MAX_ROWS, help="cap on the objects of any one type")
+	parser.add_argument('--hubs', type=int, default=BENCH_HUBS, help="accounts with --hub-children children")
+	parser.add_argument('--hub-children', type=int, default=BENCH_HUB_CHILDREN, help="children of each hub account")
+	parser.add_argument('--ids-rate', type=float, default=BENCH_IDS_RATE, help="share of pointers stored as a jsonb map of ids")
+	parser.add_argument('--seed', type=int, default=BENCH_SEED)
+	parser.add_argument('--engine', action='append', choices=BENCH_ENGINES, help="engines to run (default all); may be repeated")
+	parser.add_argument('--start', action='append', help="starting objects as \"type id\" (default " + ", ".join(BENCH_STARTS) + "); may be repeated")
+	parser.add_argument('--depth-limits', default=",".join(str(n) for n in BENCH_DEPTH_LIMITS), help="comma-separated depthLimit values")
+	parser.add_argument('--object-limits', default=",".join(str(n) for n in BENCH_OBJECT_LIMITS), help="comma-separated objectLimit values")
+	parser.add_argument('--runs', type=int, default=BENCH_RUNS, help="timed runs per case")
+	parser.add_argument('--warm', action='store_true', help="keep the node cache between runs instead of flushing it")
+	parser.add_argument('--concurrency', type=int, default=4, help="connections each bfs layer's lookups are spread over")
+	parser.add_argument('--output', default='benchmark.json', help="where to write the JSON report")
+	parser.add_argument('--compare', help="an earlier JSON report; exits with status 1 if any case's p50 got slower than --tolerance allows")
+	parser.add_argument('--tolerance', type=float, default=0.2, help="allowed p50 slowdown as a fraction, for --compare")
+	args = parser.parse_args()
+
+	schema = load_schema(SCHEMA_PATH)
+	report = {'started': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(), 'platform': platform.platform()}
+	if args.generate:
+		report['dataset'] = generate_dataset(args.uri, schema, args.roots, parse_fan_out(args.fan_out), args.max_rows, args.hubs, args.hub_children, args.ids_rate, seed=args.seed)
+		import api
+		with api.ObjectTree(args.uri, SCHEMA_PATH) as tree:
+			tree.ensure_indexes(create=True)
+	con = pcg2.connect(args.uri)
+	cur = con.cursor()
+	cur.execute("SHOW server_version")
+	report['postgres'] = cur.fetchone()[0]
+	con.close()
+
+	report['cases'] = run_matrix(args.uri, args.engine or BENCH_ENGINES, args.start or BENCH_STARTS, [int(n) for n in args.depth_limits.split(",")], [int(n) for n in args.object_limits.split(",")], args.runs, args.warm, args.concurrency)
+	with open(args.output, 'w') as file:
+		json.dump(report, file, indent=2)
+	print("REPORT WRITTEN TO " + args.output)
+
+	if args.compare:
+		with open(args.compare) as file:
+			regressions = compare(report['cases'], json.load(file)['cases'], args.tolerance)
+		for regression in regressions:
+			print("REGRESSION " + json.dumps(regression))
+		if regressions:
+			sys.exit(1)
@@ -0,0 +1,416 @@
+import collections
+import hashlib
+import json
+import logging
+import math
+import os
+import sys
+import threading
+import time
+try:
+	import redis
+except ImportError: # the shared backend is optional; without it each worker only has its own cache
+	redis = None
+
+
+NODE_CACHE_MAX_BYTES = 64 * 1024 * 1024 # approximate size limit of each database's in-process node cache
+NODE_CACHE_TTL = 300 # seconds a cached node or edge list is trusted before it is fetched again
+REDIS_URL = os.environ.get('OBJVIZ_REDIS_URL') # e.g. redis://localhost:6379/0 to share cached nodes between workers
+RESPONSE_CACHE_MAX_BYTES = 64 * 1024 * 1024 # size limit of the compressed getNetwork responses each worker keeps
+RESPONSE_CACHE_TTL = int(os.environ.get('OBJVIZ_RESPONSE_TTL', 60)) # seconds a cached getNetwork response is served as is
+RESPONSE_CACHE_STALE = int(os.environ.get('OBJVIZ_RESPONSE_STALE', 300)) # seconds after that it is still served while it is refreshed in the background
+
+
+def approx_size(value):
+	"""
+	Estimates how many bytes a cached value takes up
+	:param value: a cached value made of tuples, lists, dicts, strings and numbers
+	:type value: any
+	:returns: the approximate size of the value in bytes
+	:rtype: int
+	"""
+	size = sys.getsizeof(value)
+	if isinstance(value, (tuple, list)):
+		for v in value:
+			size += approx_size(v)
+	elif isinstance(value, dict):
+		for (k, v) in value.items():
+			size += approx_size(k) + approx_size(v)
+	return size
+
+def dsn_fingerprint(dsn):
+	"""
+	Gets a short, stable name for a database that does not reveal its credentials
+	:param dsn: the url of the database
+	:type dsn: str
+	:returns: a hash of the url
+	:rtype: str
+	"""
+	return hashlib.sha1(str(dsn).encode('utf-8')).hexdigest()[:12]
+
+
+class LRUCache:
+	"""
+	A thread-safe least-recently-used cache bounded by the approximate size of its values, whose entries expire after a TTL
+	"""
+	def __init__(self, max_bytes, ttl, clock = time.monotonic):
+		"""
+		Initializes an LRUCache object
+		:param max_bytes: the approximate number of bytes the cached values may take up
+		:type max_bytes: int
+		:param ttl: the number of seconds an entry stays valid
+		:type ttl: int or float
+		:param clock: the function entries are timed with
+		:type clock: function
+		"""
+		self.max_bytes = max_bytes
+		self.ttl = ttl
+		self.clock = clock
+		self.entries = collections.OrderedDict() # key -> (expiry time, size, value), least recently used first
+		self.bytes = 0
+		self.hits = 0
+		self.misses = 0
+		self.lock = threading.Lock()
+
+	def get_many(self, keys):
+		"""
+		Looks up several keys at once
+		:param keys: the keys to look up
+		:type keys: list
+		:returns: the values of the keys that were cached and had not expired
+		:rtype: dict
+		"""
+		found = {}
+		now = self.clock()
+		with self.lock:
+			for key in keys:
+				entry = self.entries.get(key)
+				if entry is None:
+					continue
+				if entry[0] < now:
+					self.remove(key)
+					continue
+				self.entries.move_to_end(key)
+				found[key] = entry[2]
+			self.hits += len(found)
+			self.misses += len(keys) - len(found)
+		return found
+
+	def put_many(self, items):
+		"""
+		Caches several values at once, evicting the least recently used entries to stay under the size limit
+		:param items: the values to cache, keyed by their cache keys
+		:type items: dict
+		"""
+		expires = self.clock() + self.ttl
+		with self.lock:
+			for (key, value) in items.items():
+				size = approx_size(value)
+				if size > self.max_bytes:
+					continue
+				if key in self.entries:
+					self.remove(key)
+				self.entries[key] = (expires, size, value)
+				self.bytes += size
+			while self.bytes > self.max_bytes:
+				self.remove(next(iter(self.entries)))
+
+	def remove(self, key):
+		"""
+		Removes an entry (the cache's lock must be held)
+		:param key: the key of the entry
+		:type key: any
+		"""
+		self.bytes -= self.entries.pop(key)[1]
+
+	def flush(self):
+		"""
+		Removes every entry
+		:returns: the number of entries removed
+		:rtype: int
+		"""
+		with self.lock:
+			count = len(self.entries)
+			self.entries.clear()
+			self.bytes = 0
+		return count
+
+
+class RedisBackend:
+	"""
+	A cache shared by every worker process, stored in Redis under one namespace with a TTL on every entry. Values are
+	stored as JSON, never pickled, so whoever can write to the Redis server cannot run code in the workers; tuples
+	come back as lists
+	"""
+	def __init__(self, url, namespace, ttl):
+		"""
+		Initializes a RedisBackend object
+		:param url: the url of the Redis server
+		:type url: str
+		:param namespace: the prefix of every key this backend stores
+		:type namespace: str
+		:param ttl: the number of seconds an entry stays valid
+		:type ttl: int
+		"""
+		self.client = redis.Redis.from_url(url)
+		self.namespace = namespace
+		self.ttl = ttl
+
+	def get_many(self, keys):
+		"""
+		Looks up several keys at once; errors talking to Redis are logged and treated as misses
+		:param keys: the keys to look up
+		:type keys: list
+		:returns: the values of the keys that were cached and could be decoded
+		:rtype: dict
+		"""
+		if len(keys) == 0:
+			return {}
+		try:
+			values = self.client.mget([self.namespace + repr(key) for key in keys])
+		except Exception as e:
+			logging.getLogger().info("SHARED CACHE UNAVAILABLE: " + str(e))
+			return {}
+		found = {}
+		for (key, value) in zip(keys, values):
+			if value is None:
+				continue
+			try:
+				found[key] = json.loads(value)
+			except ValueError: # not written by this backend, e.g. by an older version that pickled values
+				continue
+		return found
+
+	def put_many(self, items):
+		"""
+		Caches several values at once; errors talking to Redis are logged and ignored
+		:param items: the values to cache, keyed by their cache keys
+		:type items: dict
+		"""
+		try:
+			pipe = self.client.pipeline(transaction=False)
+			for (key, value) in items.items():
+				pipe.setex(self.namespace + repr(key), self.ttl, json.dumps(value))
+			pipe.execute()
+		except Exception as e:
+			logging.getLogger().info("SHARED CACHE UNAVAILABLE: " + str(e))
+
+	def flush(self):
+		"""
+		Removes every entry in the namespace
+		:returns: the number of entries removed
+		:rtype: int
+		"""
+		count = 0
+		try:
+			for key in self.client.scan_iter(match=self.namespace + "*", count=1000):
+				count += self.client.delete(key)
+		except Exception as e:
+			logging.getLogger().info("SHARED CACHE UNAVAILABLE: " + str(e))
+		return count
+
+
+class NodeCache:
+	"""
+	The cache of node metadata and per-node edge lists for one database: an in-process LRU cache,
+	backed by a cache shared between workers when OBJVIZ_REDIS_URL is set and the redis package is installed
+	"""
+	def __init__(self, dsn, max_bytes = NODE_CACHE_MAX_BYTES, ttl = NODE_CACHE_TTL):
+		"""
+		Initializes a NodeCache object
+		:param dsn: the url of the database whose nodes are cached
+		:type dsn: str
+		:param max_bytes: the approximate size limit of the in-process cache
+		:type max_bytes: int
+		:param ttl: the number of seconds an entry stays valid
+		:type ttl: int
+		"""
+		self.local = LRUCache(max_bytes, ttl)
+		self.shared = None
+		if redis is not None and REDIS_URL:
+			self.shared = RedisBackend(REDIS_URL, "objviz:nodes:" + dsn_fingerprint(dsn) + ":", ttl)
+
+	def get_many(self, keys):
+		"""
+		Looks up several keys at once, in the in-process cache first and then in the shared cache
+		:param keys: the keys to look up
+		:type keys: list
+		:returns: the values of the keys that were cached
+		:rtype: dict
+		"""
+		found = self.local.get_many(keys)
+		if self.shared is not None and len(found) < len(keys):
+			shared = self.shared.get_many([key for key in keys if key not in found])
+			self.local.put_many(shared)
+			found.update(shared)
+		return found
+
+	def put_many(self, items):
+		"""
+		Caches several values at once in both caches
+		:param items: the values to cache, keyed by their cache keys
+		:type items: dict
+		"""
+		if len(items) == 0:
+			return
+		self.local.put_many(items)
+		if self.shared is not None:
+			self.shared.put_many(items)
+
+	def flush(self):
+		"""
+		Removes every entry from both caches
+		:returns: the number of entries removed
+		:rtype: int
+		"""
+		count = self.local.flush()
+		if self.shared is not None:
+			count += self.shared.flush()
+		return count
+
+
+class ResponseCache:
+	"""
+	A thread-safe least-recently-used cache of whole, already serialized and compressed responses, bounded by their
+	total size. An entry is fresh for ttl seconds, then stale for another stale seconds, during which it is still served
+	while one request refreshes it (stale-while-revalidate)
+	"""
+	def __init__(self, max_bytes, ttl, stale, clock = time.monotonic):
+		"""
+		Initializes a ResponseCache object
+		:param max_bytes: the number of bytes the cached responses may take up
+		:type max_bytes: int
+		:param ttl: the number of seconds a response is fresh
+		:type ttl: int or float
+		:param stale: the number of seconds after that a response may still be served while it is refreshed
+		:type stale: int or float
+		:param clock: the function responses are timed with
+		:type clock: function
+		"""
+		self.max_bytes = max_bytes
+		self.ttl = ttl
+		self.stale = stale
+		self.clock = clock
+		self.entries = collections.OrderedDict() # key -> (time stored, body), least recently used first
+		self.bytes = 0
+		self.refreshing = set() # keys of the stale entries being refreshed
+		self.lock = threading.Lock()
+
+	def get(self, key):
+		"""
+		Looks up a response
+		:param key: the response's cache key, starting with its database's dsn_fingerprint
+		:type key: tuple
+		:returns: the body, its age in seconds, and the seconds left until it goes stale (negative once stale), or None if it is not cached or too stale to serve
+		:rtype: tuple (bytes, int, int)
+		"""
+		now = self.clock()
+		with self.lock:
+			entry = self.entries.get(key)
+			if entry is None:
+				return None
+			age = now - entry[0]
+			if age >= self.ttl + self.stale:
+				self.remove(key)
+				return None
+			self.entries.move_to_end(key)
+		return (entry[1], int(age), math.floor(self.ttl - age))
+
+	def put(self, key, body):
+		"""
+		Caches a response, evicting the least recently used ones to stay under the size limit
+		:param key: the response's cache key
+		:type key: tuple
+		:param body: the serialized, compressed response
+		:type body: bytes
+		"""
+		if len(body) > self.max_bytes:
+			return
+		with self.lock:
+			if key in self.entries:
+				self.remove(key)
+			self.entries[key] = (self.clock(), body)
+			self.bytes += len(body)
+			while self.bytes > self.max_bytes:
+				self.remove(next(iter(self.entries)))
+
+	def start_refresh(self, key):
+		"""
+		Claims the refresh of a stale response, so only one request refreshes it at a time
+		:param key: the response's cache key
+		:type key: tuple
+		:returns: whether the caller should refresh it (and then call finish_refresh)
+		:rtype: bool
+		"""
+		with self.lock:
+			if key in self.refreshing:
+				return False
+			self.refreshing.add(key)
+			return True
+
+	def finish_refresh(self, key):
+		"""
+		Releases the refresh of a response claimed with start_refresh
+		:param key: the response's cache key
+		:type key: tuple
+		"""
+		with self.lock:
+			self.refreshing.discard(key)
+
+	def remove(self, key):
+		"""
+		Removes an entry (the cache's lock must be held)
+		:param key: the key of the entry
+		:type key: tuple
+		"""
+		self.bytes -= len(self.entries.pop(key)[1])
+
+	def flush(self, dsn = None):
+		"""
+		Removes the responses of one database, or every response
+		:param dsn: the url of the database, or None for all of them
+		:type dsn: str
+		:returns: the number of entries removed
+		:rtype: int
+		"""
+		with self.lock:
+			keys = [key for key in self.entries if dsn is None or key[0] == dsn_fingerprint(dsn)]
+			for key in keys:
+				self.remove(key)
+		return len(keys)
+
+
+response_cache = ResponseCache(RESPONSE_CACHE_MAX_BYTES, RESPONSE_CACHE_TTL, RESPONSE_CACHE_STALE) # keyed by DSN fingerprint first, so one process serves many databases from it
+
+node_caches = {} # one per database, as node ids only mean something within one
+node_caches_lock = threading.Lock()
+
+def get_node_cache(dsn):
+	"""
+	Gets the process-wide node cache for a database, creating it on first use
+	:param dsn: the url of the database
+	:type dsn: str
+	:returns: the database's node cache
+	:rtype: NodeCache
+	"""
+	with node_caches_lock:
+		if dsn not in node_caches:
+			node_caches[dsn] = NodeCache(dsn)
+		return node_caches[dsn]
+
+def flush_node_caches(dsn = None):
+	"""
+	Empties the node cache of one database, or of every database
+	:param dsn: the url of the database, or None for all of them
+	:type dsn: str
+	:returns: the number of entries removed
+	:rtype: int
+	"""
+	if dsn is not None:
+		return get_node_cache(dsn).flush()
+	with node_caches_lock:
+		caches = list(node_caches.values())
+	count = 0
+	for node_cache in caches:
+		count += node_cache.flush()
+	return count
@@ -0,0 +1,137 @@
+import json
+import logging
+import os
+import time
+from schema import key_obj_type, pointer_keys
+
+
+DISCOVERY_SAMPLE_PERCENT = 10 # share of each large table's pages sampled for its keys
+DISCOVERY_FULL_SCAN_ROWS = 10000 # tables estimated to hold fewer rows than this are read whole
+
+
+def pointer_target(key, tables):
+	"""
+	Gets the object type a field points to, by the naming convention the object type graph follows and its exceptions
+	(see schema.key_obj_type): account_id and account_ids point to account, partner_id points to account, and
+	invoice_id points to invoice_ when there is no invoice table
+	:param key: the field name
+	:type key: str
+	:param tables: all table names in the database
+	:type tables: set
+	:returns: the object type, whether the field is a map or array of ids, or None if the field is not a pointer to a table
+	:rtype: tuple (str, bool)
+	"""
+	if key.endswith("_ids"):
+		plural = True
+	elif key.endswith("_id"):
+		plural = False
+	else:
+		return None
+	stem = key_obj_type(key)
+	for obj_type in [stem, stem + "_"]:
+		if stem != "" and obj_type in tables:
+			return (obj_type, plural)
+	return None
+
+def sample_keys(cur, table, full_scan):
+	"""
+	Counts the top-level keys of a table's objects, reading every row or a TABLESAMPLE of its pages
+	:param cur: the cursor to query on
+	:type cur: psycopg2.extensions.cursor
+	:param table: the table
+	:type table: str
+	:param full_scan: whether to read every row instead of a sample
+	:type full_scan: bool
+	:returns: the number of objects read, and (objects with the key set, ids they hold) for each key
+	:rtype: tuple (int, dict)
+	"""
+	source = table if full_scan else table + " TABLESAMPLE SYSTEM (" + str(DISCOVERY_SAMPLE_PERCENT) + ")"
+	cur.execute("WITH s AS (SELECT obj FROM " + source + " WHERE jsonb_typeof(obj) = 'object')"
+		+ " SELECT NULL, count(*), NULL FROM s"
+		+ " UNION ALL SELECT k, count(*) FILTER (WHERE jsonb_typeof(obj->k) <> 'null'),"
+		+ " sum(CASE jsonb_typeof(obj->k) WHEN 'object' THEN (SELECT count(*) FROM jsonb_object_keys(obj->k)) WHEN 'array' THEN jsonb_array_length(obj->k) WHEN 'null' THEN 0 ELSE 1 END)"
+		+ " FROM s CROSS JOIN LATERAL jsonb_object_keys(obj) k GROUP BY k")
+	rows = cur.fetchall()
+	return (rows[0][1], dict((r[0], (r[1], int(r[2]))) for r in rows[1:]))
+
+def discover_catalog(con, tables):
+	"""
+	Infers the object type graph from the database itself: samples the jsonb keys of every table, takes every *_id and
+	*_ids field that names another table as an edge, and estimates each edge's cardinality from the sample
+	:param con: the connection to query on
+	:type con: psycopg2.extensions.connection
+	:param tables: all table names in the database
+	:type tables: list
+	:returns: the edge catalog: per-table row estimates, the edges with their pointer fields and cardinality, and the *_id fields that name no table or that are not their pair of types' edge
+	:rtype: dict
+	"""
+	root_logger = logging.getLogger()
+	started = time.time()
+	tables = set(tables)
+	cur = con.cursor()
+	cur.execute("SELECT c.relname, c.reltuples FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace WHERE c.relkind = 'r' AND n.nspname NOT IN ('pg_catalog', 'information_schema')")
+	reltuples = dict(cur.fetchall())
+
+	table_stats = {}
+	pointers = {} # (child type, parent type, the single field's name) -> {'single': (objects with it set, ids), 'plural': ...}
+	unresolved = []
+	for table in sorted(tables):
+		full_scan = reltuples.get(table, 0) < DISCOVERY_FULL_SCAN_ROWS
+		try:
+			(sampled, keys) = sample_keys(cur, table, full_scan)
+			con.commit()
+		except Exception as e: # e.g. a table without a jsonb obj column
+			con.rollback()
+			root_logger.info("SKIPPING " + table + ": " + type(e).__name__ + ": " + str(e).strip())
+			continue
+		if sampled == 0:
+			continue
+		rows = sampled if full_scan else max(sampled, int(round(sampled * 100 / DISCOVERY_SAMPLE_PERCENT)))
+		table_stats[table] = {'rows': rows, 'sampled': sampled}
+		for (key, (count, ids)) in sorted(keys.items()):
+			target = pointer_target(key, tables)
+			if target is None:
+				if key.endswith("_id") or key.endswith("_ids"):
+					unresolved.append({'table': table, 'key': key, 'objects': count})
+				continue
+			if count == 0:
+				continue
+			(parent_type, plural) = target
+			found = pointers.setdefault((table, parent_type, key[:-1] if plural else key), {})
+			found['plural' if plural else 'single'] = (count, ids)
+
+	edges = []
+	chosen = {} # (child type, parent type) -> the single field's name of its edge
+	for (child_type, parent_type, key) in sorted(pointers):
+		# the object type graph holds one edge per pair of types: when a type points to another through several fields (e.g. account_id and partner_id), the conventional one is the edge
+		if (child_type, parent_type) not in chosen or key == pointer_keys(parent_type)[0]:
+			chosen[(child_type, parent_type)] = key
+	for ((child_type, parent_type, key), found) in sorted(pointers.items()):
+		if parent_type not in table_stats:
+			continue
+		if chosen[(child_type, parent_type)] != key:
+			for (field, (count, ids)) in [(key, found.get('single', (0, 0))), (key + "s", found.get('plural', (0, 0)))]:
+				if count > 0:
+					unresolved.append({'table': child_type, 'key': field, 'objects': count, 'points_to': parent_type})
+			continue
+		sampled = table_stats[child_type]['sampled']
+		(single, plural) = (found.get('single', (0, 0)), found.get('plural', (0, 0)))
+		pointing = min(sampled, single[0] + plural[0]) # objects normally set one field or the other
+		parents_per_child = (single[1] + plural[1]) / sampled
+		edges.append({'child': child_type, 'parent': parent_type, 'key': key, 'keys': key + "s", 'coverage': round(pointing / sampled, 4),
+			'parents_per_child': round(parents_per_child, 4),
+			'children_per_parent': round(table_stats[child_type]['rows'] * parents_per_child / table_stats[parent_type]['rows'], 4)})
+	return {'version': 1, 'generated': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()), 'discovery_seconds': round(time.time() - started, 3),
+		'sample_percent': DISCOVERY_SAMPLE_PERCENT, 'tables': table_stats, 'edges': edges, 'unresolved': unresolved}
+
+def write_catalog(catalog, path):
+	"""
+	Writes an edge catalog to a file, replacing it only once the new catalog is complete
+	:param catalog: the edge catalog, as discover_catalog returns it
+	:type catalog: dict
+	:param path: the file to write
+	:type path: str
+	"""
+	with open(path + ".tmp", 'w') as file:
+		json.dump(catalog, file, indent=1, sort_keys=True)
+	os.replace(path + ".tmp", path)
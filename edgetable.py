@@ -0,0 +1,188 @@
+import logging
+import threading
+import time
+import psycopg2 as pcg2
+from cache import dsn_fingerprint
+from queries import pointer_refs, EDGE_TABLE
+
+
+EDGE_CHECK_TTL = 60 # seconds a database's answer to whether it has the edge table is trusted before it is checked again
+
+
+def source_tables(schema, tables):
+	"""
+	Lists the tables whose objects point to other objects, i.e. whose rows the edge table holds edges of
+	:param schema: the object type graph
+	:type schema: SchemaGraph
+	:param tables: all table names in the database
+	:type tables: list
+	:returns: (table, the parent types with tables it points to) for each such table
+	:rtype: list
+	"""
+	tables = set(tables)
+	found = []
+	for obj_type in sorted(schema.pointers_to):
+		parent_types = [parent_type for parent_type in schema.pointers_to[obj_type] if parent_type in tables]
+		if obj_type in tables and len(parent_types) > 0:
+			found.append((obj_type, parent_types))
+	return found
+
+def edge_select(schema, obj_type, parent_types, alias, from_table = False):
+	"""
+	Builds the select of the edge table rows of one object, or of every object in its table
+	:param schema: the object type graph
+	:type schema: SchemaGraph
+	:param obj_type: the objects' type
+	:type obj_type: str
+	:param parent_types: the parent types with tables they point to
+	:type parent_types: list
+	:param alias: the name the object's row goes by, e.g. NEW in a trigger
+	:type alias: str
+	:param from_table: whether to read every object from the table, as alias, instead of the one row alias names
+	:type from_table: bool
+	:returns: a select of (src_type, src_id, dst_type, dst_id, plural, pos) rows
+	:rtype: str
+	"""
+	refs = " UNION ALL ".join("SELECT '" + parent_type + "'::text AS type, x.* FROM (" + pointer_refs(schema, alias, parent_type, obj_type) + ") x" for parent_type in parent_types)
+	source = obj_type + " " + alias + " CROSS JOIN LATERAL (" if from_table else "("
+	return "SELECT '" + obj_type + "', " + alias + ".obj->>'id', r.type, r.id, NOT r.single, r.sub FROM " + source + refs + ") r WHERE " + alias + ".obj->>'id' IS NOT NULL AND r.id IS NOT NULL"
+
+def trigger_function(schema, obj_type, parent_types):
+	"""
+	Builds the trigger function that keeps one table's edges in the edge table current: it replaces an object's edges
+	when the object is inserted, deleted, or updated in its id or pointer fields, and drops them all when the table is
+	truncated
+	:param schema: the object type graph
+	:type schema: SchemaGraph
+	:param obj_type: the table
+	:type obj_type: str
+	:param parent_types: the parent types with tables it points to
+	:type parent_types: list
+	:returns: the CREATE FUNCTION statement
+	:rtype: str
+	"""
+	name = ("objviz_edges_" + obj_type)[:63]
+	def fields(alias):
+		return "jsonb_build_array(" + alias + ".obj->'id', " + ", ".join(alias + ".obj->'" + schema.id_key(parent_type, child_type=obj_type) + "', " + alias + ".obj->'" + schema.id_key(parent_type, plural=True, child_type=obj_type) + "'" for parent_type in parent_types) + ")"
+	return ("CREATE OR REPLACE FUNCTION " + name + "() RETURNS trigger LANGUAGE plpgsql AS $objviz$\nBEGIN\n"
+		+ "	IF TG_OP = 'TRUNCATE' THEN\n		DELETE FROM " + EDGE_TABLE + " WHERE src_type = '" + obj_type + "';\n		RETURN NULL;\n	END IF;\n"
+		+ "	IF TG_OP = 'UPDATE' AND " + fields('OLD') + " IS NOT DISTINCT FROM " + fields('NEW') + " THEN\n		RETURN NULL;\n	END IF;\n"
+		+ "	IF TG_OP IN ('UPDATE', 'DELETE') THEN\n		DELETE FROM " + EDGE_TABLE + " WHERE src_type = '" + obj_type + "' AND src_id = OLD.obj->>'id';\n	END IF;\n"
+		+ "	IF TG_OP IN ('INSERT', 'UPDATE') THEN\n		INSERT INTO " + EDGE_TABLE + " " + edge_select(schema, obj_type, parent_types, 'NEW') + " ON CONFLICT DO NOTHING;\n	END IF;\n"
+		+ "	RETURN NULL;\nEND\n$objviz$")
+
+def install_edge_table(dsn, schema, tables):
+	"""
+	Creates the edge table, which holds one row per pointer in the object graph as (src_type, src_id, dst_type, dst_id),
+	plus whether the pointer is in a map of ids and its position there, with covering indexes for looking up parents
+	by source and children by destination. Then, one table at a time, it installs insert, update, delete and truncate
+	triggers that keep the table's edges current, and backfills them. The trigger is created in the same transaction as
+	the backfill, so writes to the table wait for the backfill and none are missed. Running it again rebuilds every
+	table's edges, e.g. after the object type graph changes
+	:param dsn: the url of the database
+	:type dsn: str
+	:param schema: the object type graph
+	:type schema: SchemaGraph
+	:param tables: all table names in the database
+	:type tables: list
+	:returns: one entry per table with its name, number of edges and backfill time
+	:rtype: list
+	"""
+	root_logger = logging.getLogger()
+	con = pcg2.connect(dsn) # one transaction per table, so this does not come from the autocommit pool
+	report = []
+	try:
+		cur = con.cursor()
+		cur.execute("CREATE TABLE IF NOT EXISTS " + EDGE_TABLE + " (src_type text NOT NULL, src_id text NOT NULL, dst_type text NOT NULL, dst_id text NOT NULL, plural boolean NOT NULL, pos bigint NOT NULL,"
+			+ " PRIMARY KEY (src_type, src_id, dst_type, dst_id) INCLUDE (pos))")
+		cur.execute("CREATE INDEX IF NOT EXISTS " + EDGE_TABLE + "_dst ON " + EDGE_TABLE + " (dst_type, src_type, dst_id, src_id) INCLUDE (plural)")
+		con.commit()
+		for (obj_type, parent_types) in source_tables(schema, tables):
+			started = time.time()
+			name = ("objviz_edges_" + obj_type)[:63]
+			cur.execute(trigger_function(schema, obj_type, parent_types))
+			cur.execute("DROP TRIGGER IF EXISTS objviz_edges ON " + obj_type)
+			cur.execute("CREATE TRIGGER objviz_edges AFTER INSERT OR UPDATE OR DELETE ON " + obj_type + " FOR EACH ROW EXECUTE FUNCTION " + name + "()")
+			cur.execute("DROP TRIGGER IF EXISTS objviz_edges_truncate ON " + obj_type)
+			cur.execute("CREATE TRIGGER objviz_edges_truncate AFTER TRUNCATE ON " + obj_type + " FOR EACH STATEMENT EXECUTE FUNCTION " + name + "()")
+			cur.execute("DELETE FROM " + EDGE_TABLE + " WHERE src_type = %s", (obj_type,))
+			cur.execute("INSERT INTO " + EDGE_TABLE + " " + edge_select(schema, obj_type, parent_types, 't', from_table=True) + " ON CONFLICT DO NOTHING")
+			report.append({'table': obj_type, 'edges': cur.rowcount, 'seconds': round(time.time() - started, 3)})
+			con.commit()
+			root_logger.info("EDGE TABLE: " + str(cur.rowcount) + " " + obj_type + " EDGES BACKFILLED")
+		con.autocommit = True
+		cur.execute("ANALYZE " + EDGE_TABLE)
+	finally:
+		con.close()
+		forget_edge_table(dsn)
+	return report
+
+def drop_edge_table(dsn, schema, tables):
+	"""
+	Removes the edge table and the triggers and functions that keep it current
+	:param dsn: the url of the database
+	:type dsn: str
+	:param schema: the object type graph
+	:type schema: SchemaGraph
+	:param tables: all table names in the database
+	:type tables: list
+	"""
+	con = pcg2.connect(dsn)
+	try:
+		cur = con.cursor()
+		for (obj_type, parent_types) in source_tables(schema, tables):
+			cur.execute("DROP TRIGGER IF EXISTS objviz_edges ON " + obj_type)
+			cur.execute("DROP TRIGGER IF EXISTS objviz_edges_truncate ON " + obj_type)
+			cur.execute("DROP FUNCTION IF EXISTS " + ("objviz_edges_" + obj_type)[:63] + "()")
+		cur.execute("DROP TABLE IF EXISTS " + EDGE_TABLE)
+		con.commit()
+	finally:
+		con.close()
+		forget_edge_table(dsn)
+
+def edge_table_installed(cur):
+	"""
+	Checks whether the edge table exists in a database
+	:param cur: a cursor on the database
+	:type cur: psycopg2.extensions.cursor
+	:returns: whether it exists
+	:rtype: bool
+	"""
+	cur.execute("SELECT to_regclass(%s) IS NOT NULL", (EDGE_TABLE,))
+	return cur.fetchone()[0]
+
+
+edge_checks = {} # dsn fingerprint -> (time checked, whether the database has the edge table), for the databases this process has searched
+edge_checks_lock = threading.Lock()
+
+def edge_table_ready(dsn, check):
+	"""
+	Gets whether a database has the edge table, asking the database at most once every EDGE_CHECK_TTL seconds, so an
+	engine=edges search does not cost an extra connection and query. Another process installing or dropping the table
+	is noticed once the answer expires
+	:param dsn: the url of the database
+	:type dsn: str
+	:param check: a function that asks the database (see edge_table_installed), called only when there is no fresh answer
+	:type check: function
+	:returns: whether the edge table exists
+	:rtype: bool
+	"""
+	key = dsn_fingerprint(dsn)
+	now = time.monotonic()
+	with edge_checks_lock:
+		entry = edge_checks.get(key)
+	if entry is not None and now - entry[0] < EDGE_CHECK_TTL:
+		return entry[1]
+	installed = check()
+	with edge_checks_lock:
+		edge_checks[key] = (now, installed)
+	return installed
+
+def forget_edge_table(dsn):
+	"""
+	Drops this process's answer to whether a database has the edge table, after installing or dropping it
+	:param dsn: the url of the database
+	:type dsn: str
+	"""
+	with edge_checks_lock:
+		edge_checks.pop(dsn_fingerprint(dsn), None)
@@ -0,0 +1,225 @@
+import array
+import numpy as np
+
+
+class GraphStore:
+	"""
+	A compact store for the network a traversal builds. Nodes are numbered in the order they are added, object types
+	and the low-cardinality status, deleted and type_full fields are interned into integer codes, and edges are kept in
+	two flat integer arrays with a set of packed (node, pointer) pairs for deduplication. The network dict that the
+	visualizer consumes is only built, CSR-style, when it is sent
+	"""
+	def __init__(self):
+		"""
+		Initializes an empty GraphStore object
+		"""
+		self.types = [] # type code -> object type
+		self.type_codes = {}
+		self.values = [] # value code -> interned status, deleted or type_full value
+		self.value_codes = {}
+		self.node_type = array.array('H') # node index -> type code
+		self.node_id = [] # node index -> object id
+		self.node_name = []
+		self.node_status = array.array('i') # node index -> value code
+		self.node_deleted = array.array('i')
+		self.node_type_full = array.array('i')
+		self.index = {} # (type code, object id) -> node index
+		self.edge_node = array.array('i') # edge -> index of the node whose pointers_from the edge is in
+		self.edge_pointer = array.array('i') # edge -> index of the node pointing to it
+		self.edge_set = set() # node index << 32 | pointer index, for every edge
+		self.live_total = 0 # number of nodes whose deleted field is "0"
+		self.live_counts = {} # type code -> number of such nodes
+		self.live_full_counts = {} # (type code, type_full value code) -> number of such nodes
+
+	def __len__(self):
+		return len(self.node_id)
+
+	def edge_count(self):
+		"""
+		Gets the number of edges in the store
+		:returns: the number of edges
+		:rtype: int
+		"""
+		return len(self.edge_node)
+
+	def intern_type(self, obj_type):
+		"""
+		Gets the code of an object type, assigning the next one if the type is new
+		:param obj_type: the type of object
+		:type obj_type: str
+		:returns: the type's code
+		:rtype: int
+		"""
+		code = self.type_codes.get(obj_type)
+		if code is None:
+			code = len(self.types)
+			self.type_codes[obj_type] = code
+			self.types.append(obj_type)
+		return code
+
+	def intern(self, value):
+		"""
+		Gets the code of a status, deleted or type_full value, assigning the next one if the value is new
+		:param value: the value
+		:type value: str or None
+		:returns: the value's code
+		:rtype: int
+		"""
+		code = self.value_codes.get(value)
+		if code is None:
+			code = len(self.values)
+			self.value_codes[value] = code
+			self.values.append(value)
+		return code
+
+	def find(self, obj_type, obj_id):
+		"""
+		Finds the node of an object
+		:param obj_type: the type of the object
+		:type obj_type: str
+		:param obj_id: the id of the object
+		:type obj_id: str
+		:returns: the node's index, or None if the object is not in the store
+		:rtype: int
+		"""
+		code = self.type_codes.get(obj_type)
+		if code is None:
+			return None
+		return self.index.get((code, obj_id))
+
+	def add_node(self, obj_type, obj_id, info):
+		"""
+		Adds an object to the store as the next node
+		:param obj_type: the type of the object
+		:type obj_type: str
+		:param obj_id: the id of the object
+		:type obj_id: str
+		:param info: the name, status, deleted, and type_full fields of the object
+		:type info: tuple
+		:returns: the new node's index
+		:rtype: int
+		"""
+		index = len(self.node_id)
+		code = self.intern_type(obj_type)
+		self.index[(code, obj_id)] = index
+		self.node_type.append(code)
+		self.node_id.append(obj_id)
+		self.node_name.append(info[0])
+		self.node_status.append(self.intern(info[1]))
+		self.node_deleted.append(self.intern(info[2]))
+		type_full = self.intern(info[3])
+		self.node_type_full.append(type_full)
+		if info[2] == "0":
+			self.live_total += 1
+			self.live_counts[code] = self.live_counts.get(code, 0) + 1
+			self.live_full_counts[(code, type_full)] = self.live_full_counts.get((code, type_full), 0) + 1
+		return index
+
+	def add_edge(self, node, pointer):
+		"""
+		Records that one node points to another (i.e. adds pointer to node's pointers_from), unless it already does
+		:param node: the index of the node being pointed to
+		:type node: int
+		:param pointer: the index of the node doing the pointing
+		:type pointer: int
+		:returns: whether the edge is new
+		:rtype: bool
+		"""
+		key = node << 32 | pointer
+		if key in self.edge_set:
+			return False
+		self.edge_set.add(key)
+		self.edge_node.append(node)
+		self.edge_pointer.append(pointer)
+		return True
+
+	def live_type_counts(self):
+		"""
+		Gets how many non-deleted nodes of each type and type_full the store holds, from counters kept up to date as
+		nodes are added
+		:returns: object type -> count, in the order the types were first found, and (object type, type_full) -> count
+		:rtype: tuple
+		"""
+		type_counts = dict((self.types[code], n) for (code, n) in self.live_counts.items())
+		type_full_counts = dict(((self.types[code], self.values[value]), n) for ((code, value), n) in self.live_full_counts.items())
+		return (type_counts, type_full_counts)
+
+	def type_of(self, node):
+		"""
+		Gets the object type of a node
+		:param node: the node's index
+		:type node: int
+		:returns: the type of the node's object
+		:rtype: str
+		"""
+		return self.types[self.node_type[node]]
+
+	def node_dict(self, node, pointers_from):
+		"""
+		Builds the dict a node is sent as
+		:param node: the node's index
+		:type node: int
+		:param pointers_from: the indices of the nodes that point to it
+		:type pointers_from: list
+		:returns: the node's pointers_from, type, id, name, status, deleted, and type_full
+		:rtype: dict
+		"""
+		return {'pointers_from': pointers_from, 'type': self.types[self.node_type[node]], 'id': self.node_id[node], 'name': self.node_name[node], 'status': self.values[self.node_status[node]], 'deleted': self.values[self.node_deleted[node]], 'type_full': self.values[self.node_type_full[node]]}
+
+	def to_network(self, first_node = 0, first_edge = 0):
+		"""
+		Builds the network dict that the visualizer consumes, optionally only for what was added after a point, so a
+		network can be sent in pieces. A node's edges are always added after the node, so every pointer of a node at or
+		after first_node is at or after first_edge
+		:param first_node: the index of the first node to include
+		:type first_node: int
+		:param first_edge: the index of the first edge to include
+		:type first_edge: int
+		:returns: the indexed network of nodes from first_node on, and the edges from first_edge on that point to earlier nodes, as [node, pointer] pairs
+		:rtype: tuple (dict, list)
+		"""
+		count = len(self.node_id) - first_node
+		(offsets, sorted_pointers, old_edges) = self.pointer_csr(first_node, first_edge)
+		offsets = offsets.tolist()
+		sorted_pointers = sorted_pointers.tolist()
+
+		network = {}
+		for i in range(count):
+			network[first_node + i] = self.node_dict(first_node + i, sorted_pointers[offsets[i]:offsets[i + 1]])
+		return (network, old_edges.tolist())
+
+	def to_columns(self):
+		"""
+		Builds the network as parallel columns instead of one dict per node, for the compact response formats: each
+		node's type and its status, deleted and type_full fields are codes into the types and values dictionaries, and
+		its pointers_from are pointers[pointer_offsets[node]:pointer_offsets[node + 1]]
+		:returns: the types and values dictionaries, the type, id, name, status, deleted and type_full columns, and the pointer_offsets and pointers arrays
+		:rtype: dict
+		"""
+		(offsets, pointers, old_edges) = self.pointer_csr(0, 0)
+		return {'types': list(self.types), 'values': list(self.values), 'type': self.node_type.tolist(), 'id': list(self.node_id), 'name': list(self.node_name),
+			'status': self.node_status.tolist(), 'deleted': self.node_deleted.tolist(), 'type_full': self.node_type_full.tolist(),
+			'pointer_offsets': offsets.tolist(), 'pointers': pointers.tolist()}
+
+	def pointer_csr(self, first_node = 0, first_edge = 0):
+		"""
+		Groups the edges from first_edge on by the node they point to, CSR-style. A stable sort by node keeps each node's
+		pointers in the order they were added
+		:param first_node: the index of the first node to group edges for
+		:type first_node: int
+		:param first_edge: the index of the first edge to include
+		:type first_edge: int
+		:returns: the offsets, so node first_node + n's pointers are pointers[offsets[n]:offsets[n + 1]], the pointers, and the [node, pointer] pairs of edges to nodes before first_node
+		:rtype: tuple (numpy.ndarray, numpy.ndarray, numpy.ndarray)
+		"""
+		count = len(self.node_id) - first_node
+		nodes = np.frombuffer(self.edge_node, dtype=np.int32)[first_edge:] if len(self.edge_node) > 0 else np.zeros(0, dtype=np.int32)
+		pointers = np.frombuffer(self.edge_pointer, dtype=np.int32)[first_edge:] if len(self.edge_pointer) > 0 else np.zeros(0, dtype=np.int32)
+		new = nodes >= first_node
+		old_edges = np.stack([nodes[~new], pointers[~new]], axis=1)
+
+		new_nodes = nodes[new] - first_node
+		order = np.argsort(new_nodes, kind='stable')
+		offsets = np.zeros(count + 1, dtype=np.int64)
+		np.cumsum(np.bincount(new_nodes, minlength=count), out=offsets[1:])
+		return (offsets, pointers[new][order], old_edges)
@@ -0,0 +1,116 @@
+import threading
+
+
+DURATION_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30] # upper bounds, in seconds, of request duration histogram buckets
+
+HELP = {
+	'objviz_requests_total': ('counter', "Requests handled, by endpoint and status"),
+	'objviz_request_duration_seconds': ('histogram', "Time to produce each response, by endpoint (streamed responses stop at the first byte)"),
+	'objviz_traversals_total': ('counter', "Network searches run, by engine"),
+	'objviz_traversals_truncated_total': ('counter', "Searches cut short by a limit or budget, by engine and reason (depth, objects, deadline or queries)"),
+	'objviz_traversal_seconds_total': ('counter', "Wall time spent searching for networks, by engine"),
+	'objviz_traversal_db_seconds_total': ('counter', "Time spent waiting on queries during searches, summed over connections, by engine"),
+	'objviz_traversal_objects_total': ('counter', "Objects returned by searches, by engine"),
+	'objviz_queries_total': ('counter', "Statements executed, by kind and edge"),
+	'objviz_query_seconds_total': ('counter', "Time spent executing statements and fetching their rows, by kind and edge"),
+	'objviz_query_rows_total': ('counter', "Rows returned by statements, by kind and edge"),
+	'objviz_cache_hits_total': ('counter', "Node cache lookups answered without a query"),
+	'objviz_cache_misses_total': ('counter', "Node cache lookups that needed a query"),
+	'objviz_admission_total': ('counter', "getNetwork searches let through or turned away by the per-database admission limit, by outcome (admitted or rejected)"),
+	'objviz_coalesced_total': ('counter', "getNetwork requests answered by an identical request's search that was already running"),
+	'objviz_paths_total': ('counter', "getPath searches run, by whether a path was found"),
+	'objviz_response_cache_total': ('counter', "getNetwork responses looked up in the response cache, by status (hit, stale or miss)"),
+}
+
+
+class Metrics:
+	"""
+	Process-wide counters and histograms, rendered in the Prometheus text exposition format for the /metrics endpoint.
+	Every worker process keeps its own, so scrape each worker (or sum them) when running several
+	"""
+	def __init__(self):
+		"""
+		Initializes an empty Metrics object
+		"""
+		self.lock = threading.Lock()
+		self.counters = {} # (name, labels) -> value, where labels is a sorted tuple of (label, value) pairs
+		self.histograms = {} # (name, labels) -> [count per bucket..., count above the last bucket, sum]
+
+	def inc(self, name, value = 1, **labels):
+		"""
+		Adds to a counter
+		:param name: the counter's name, one of HELP's keys
+		:type name: str
+		:param value: how much to add
+		:type value: float
+		:param labels: the counter's labels
+		:type labels: str
+		"""
+		key = (name, tuple(sorted(labels.items())))
+		with self.lock:
+			self.counters[key] = self.counters.get(key, 0) + value
+
+	def observe(self, name, value, **labels):
+		"""
+		Records one observation in a histogram with DURATION_BUCKETS buckets
+		:param name: the histogram's name, one of HELP's keys
+		:type name: str
+		:param value: the observation
+		:type value: float
+		:param labels: the histogram's labels
+		:type labels: str
+		"""
+		key = (name, tuple(sorted(labels.items())))
+		with self.lock:
+			if key not in self.histograms:
+				self.histograms[key] = [0] * (len(DURATION_BUCKETS) + 2)
+			buckets = self.histograms[key]
+			for (i, bound) in enumerate(DURATION_BUCKETS):
+				if value <= bound:
+					buckets[i] += 1
+					break
+			else:
+				buckets[len(DURATION_BUCKETS)] += 1
+			buckets[-1] += value
+
+	def render(self):
+		"""
+		Renders every counter and histogram
+		:returns: the metrics in the Prometheus text exposition format
+		:rtype: str
+		"""
+		with self.lock:
+			counters = dict(self.counters)
+			histograms = dict((key, list(buckets)) for (key, buckets) in self.histograms.items())
+		lines = []
+		for name in sorted(set([key[0] for key in counters] + [key[0] for key in histograms])):
+			(kind, description) = HELP.get(name, ('untyped', name))
+			lines.append("# HELP " + name + " " + description)
+			lines.append("# TYPE " + name + " " + kind)
+			for (key, value) in sorted(counters.items()):
+				if key[0] == name:
+					lines.append(name + format_labels(key[1]) + " " + format_value(value))
+			for (key, buckets) in sorted(histograms.items()):
+				if key[0] != name:
+					continue
+				total = 0
+				for (i, bound) in enumerate(DURATION_BUCKETS + ['+Inf']):
+					total += buckets[i]
+					lines.append(name + "_bucket" + format_labels(key[1] + (('le', str(bound)),)) + " " + str(total))
+				lines.append(name + "_sum" + format_labels(key[1]) + " " + format_value(buckets[-1]))
+				lines.append(name + "_count" + format_labels(key[1]) + " " + str(total))
+		return "\n".join(lines) + "\n"
+
+
+def format_labels(labels):
+	if len(labels) == 0:
+		return ""
+	return "{" + ",".join(label + '="' + str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"' for (label, value) in labels) + "}"
+
+def format_value(value):
+	if isinstance(value, float):
+		return repr(round(value, 6))
+	return str(value)
+
+
+metrics = Metrics() # the counters /metrics reports, totalled since the process started
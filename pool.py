@@ -0,0 +1,192 @@
+import psycopg2 as pcg2
+import psycopg2.extensions
+import threading
+import time
+
+
+POOL_MAX_SIZE = 8 # most connections (idle + checked out) held open per DSN
+POOL_MAX_IDLE = 300 # seconds a connection may sit idle in the pool before it is closed
+POOL_PING_AFTER = 30 # seconds idle after which a connection is pinged before being handed out
+POOL_TIMEOUT = 30 # seconds to wait for a free connection when the pool is full
+
+
+class PoolTimeout(Exception):
+	"""
+	Raised when no connection frees up in a full pool before the checkout timeout
+	"""
+	pass
+
+
+class PooledConnection(psycopg2.extensions.connection):
+	"""
+	A connection that remembers which statements have been prepared on it, since they last as long as its session, and
+	whether a request has changed its statement_timeout, so the pool can reset it before anyone else uses it
+	"""
+	def __init__(self, *args, **kwargs):
+		super().__init__(*args, **kwargs)
+		self.prepared = set()
+		self.statement_timeout = None # milliseconds, or None for the server's default
+
+	def set_statement_timeout(self, ms):
+		"""
+		Sets the session's statement_timeout
+		:param ms: the timeout in milliseconds
+		:type ms: int
+		"""
+		with self.cursor() as cur:
+			cur.execute("SET statement_timeout = %s", (int(ms),))
+		self.statement_timeout = int(ms)
+
+
+class ConnectionPool:
+	"""
+	A bounded, thread-safe pool of autocommit connections to a single database
+	"""
+	def __init__(self, dsn, max_size = POOL_MAX_SIZE, max_idle = POOL_MAX_IDLE):
+		"""
+		Initializes a ConnectionPool object; no connections are opened until they are first checked out
+		:param dsn: the url of the database that's being connected to
+		:type dsn: str
+		:param max_size: the maximum number of connections open at once
+		:type max_size: int
+		:param max_idle: the number of seconds an unused connection is kept before being closed
+		:type max_idle: int or float
+		"""
+		self.dsn = dsn
+		self.max_size = max_size
+		self.max_idle = max_idle
+		self.idle = [] # (connection, time it was returned), most recently returned last
+		self.in_use = 0
+		self.cond = threading.Condition()
+
+	def getconn(self, timeout = POOL_TIMEOUT):
+		"""
+		Checks a healthy connection out of the pool, opening a new one if none are idle and the pool is not full
+		:param timeout: the number of seconds to wait for a connection when the pool is full
+		:type timeout: int or float
+		:returns: an open connection with autocommit on
+		:rtype: psycopg2.extensions.connection
+		"""
+		deadline = time.monotonic() + timeout
+		while True:
+			with self.cond:
+				self.evict_idle()
+				while not self.idle and self.in_use >= self.max_size:
+					remaining = deadline - time.monotonic()
+					if remaining <= 0:
+						raise PoolTimeout("No connection to the database became free within " + str(timeout) + " seconds")
+					self.cond.wait(remaining)
+				self.in_use += 1
+				if self.idle:
+					(con, returned_at) = self.idle.pop()
+				else:
+					con = None
+			if con is None:
+				try:
+					con = pcg2.connect(self.dsn, connection_factory=PooledConnection)
+					con.autocommit = True
+				except:
+					self.release()
+					raise
+				return con
+			if self.is_healthy(con, returned_at):
+				return con
+			self.discard(con)
+			self.release()
+
+	def putconn(self, con, close = False):
+		"""
+		Returns a checked out connection to the pool
+		:param con: the connection being returned
+		:type con: psycopg2.extensions.connection
+		:param close: whether to close the connection instead of keeping it for reuse
+		:type close: bool
+		"""
+		if not close and not con.closed and getattr(con, 'statement_timeout', None) is not None:
+			try:
+				with con.cursor() as cur:
+					cur.execute("RESET statement_timeout")
+				con.statement_timeout = None
+			except Exception as e:
+				close = True
+		if close or con.closed or con.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+			self.discard(con)
+			self.release()
+			return
+		with self.cond:
+			self.idle.append((con, time.monotonic()))
+			self.in_use -= 1
+			self.cond.notify()
+
+	def release(self):
+		"""
+		Frees up the slot of a connection that was checked out but will not be returned to the pool
+		"""
+		with self.cond:
+			self.in_use -= 1
+			self.cond.notify()
+
+	def evict_idle(self):
+		"""
+		Closes connections that have been idle for longer than max_idle (the pool's lock must be held)
+		"""
+		cutoff = time.monotonic() - self.max_idle
+		while self.idle and self.idle[0][1] < cutoff:
+			self.discard(self.idle.pop(0)[0])
+
+	def is_healthy(self, con, returned_at):
+		"""
+		Checks that an idle connection is still usable, pinging the server if it has been idle for a while
+		:param con: the connection being checked
+		:type con: psycopg2.extensions.connection
+		:param returned_at: the time the connection was returned to the pool
+		:type returned_at: float
+		:returns: whether the connection can be handed out
+		:rtype: bool
+		"""
+		if con.closed:
+			return False
+		if time.monotonic() - returned_at < POOL_PING_AFTER:
+			return True
+		try:
+			with con.cursor() as cur:
+				cur.execute("SELECT 1")
+			return True
+		except Exception as e:
+			return False
+
+	def discard(self, con):
+		"""
+		Closes a connection without returning it to the pool
+		:param con: the connection being closed
+		:type con: psycopg2.extensions.connection
+		"""
+		try:
+			con.close()
+		except Exception as e:
+			pass
+
+	def closeall(self):
+		"""
+		Closes every idle connection in the pool
+		"""
+		with self.cond:
+			while self.idle:
+				self.discard(self.idle.pop()[0])
+
+
+pools = {} # one pool per DSN; module-level state like this lives as long as the process, so every request and thread it serves shares it
+pools_lock = threading.Lock()
+
+def get_pool(dsn):
+	"""
+	Gets the process-wide connection pool for a database, creating it on first use
+	:param dsn: the url of the database
+	:type dsn: str
+	:returns: the pool of connections to the database
+	:rtype: ConnectionPool
+	"""
+	with pools_lock:
+		if dsn not in pools:
+			pools[dsn] = ConnectionPool(dsn)
+		return pools[dsn]
@@ -0,0 +1,279 @@
+import hashlib
+import psycopg2
+import threading
+
+
+EDGE_TABLE = 'objviz_edges' # the optional table of every edge in the object graph (see edgetable.py)
+
+
+class UnknownTable(Exception):
+	"""
+	Raised when a query is asked for on an object type that has no table in the database
+	"""
+	pass
+
+
+class ObjectNotFound(Exception):
+	"""
+	Raised when an object a request names, e.g. the object a search starts from, does not exist
+	"""
+	pass
+
+
+class Statement:
+	"""
+	A fixed query template that is prepared once per connection and then executed with bound parameters
+	"""
+	def __init__(self, sql, param_types, edge = None):
+		"""
+		Initializes a Statement object
+		:param sql: the query, with $1, $2... placeholders for its parameters
+		:type sql: str
+		:param param_types: the Postgres types of the parameters, e.g. ['text[]']
+		:type param_types: list
+		:param edge: the edge in the object type graph that the query follows, as "child -> parent" (None for lookups by id)
+		:type edge: str
+		"""
+		self.sql = sql
+		self.param_types = param_types
+		self.edge = edge
+		self.kind = None # object, objects, node_infos, parent_ids, children, traversal...; set by the QueryBuilder
+		self.name = "objviz_" + hashlib.md5(sql.encode('utf-8')).hexdigest()[:16]
+
+	def execute(self, cur, params):
+		"""
+		Executes the statement on a cursor, preparing it on the cursor's connection first if needed
+		:param cur: the cursor to execute the statement on
+		:type cur: psycopg2.extensions.cursor
+		:param params: the values bound to the statement's parameters
+		:type params: tuple
+		"""
+		prepared = getattr(cur.connection, 'prepared', None)
+		if prepared is None or self.name not in prepared:
+			self.prepare(cur)
+		placeholders = ", ".join(["%s"] * len(self.param_types))
+		try:
+			cur.execute("EXECUTE " + self.name + " (" + placeholders + ")", params)
+		except psycopg2.errors.InvalidSqlStatementName: # the session was reset underneath us, e.g. by DISCARD ALL
+			self.prepare(cur)
+			cur.execute("EXECUTE " + self.name + " (" + placeholders + ")", params)
+
+	def explain(self, cur, params):
+		"""
+		Runs the statement again under EXPLAIN (ANALYZE, BUFFERS), which executes it for real
+		:param cur: the cursor to explain the statement on
+		:type cur: psycopg2.extensions.cursor
+		:param params: the values bound to the statement's parameters
+		:type params: tuple
+		:returns: the plan, one line per item, with actual times, row counts and buffer usage
+		:rtype: list
+		"""
+		prepared = getattr(cur.connection, 'prepared', None)
+		if prepared is None or self.name not in prepared:
+			self.prepare(cur)
+		cur.execute("EXPLAIN (ANALYZE, BUFFERS) EXECUTE " + self.name + " (" + ", ".join(["%s"] * len(self.param_types)) + ")", params)
+		return [r[0] for r in cur.fetchall()]
+
+	def prepare(self, cur):
+		"""
+		Prepares the statement on a cursor's connection
+		:param cur: the cursor to prepare the statement on
+		:type cur: psycopg2.extensions.cursor
+		"""
+		try:
+			cur.execute("PREPARE " + self.name + " (" + ", ".join(self.param_types) + ") AS " + self.sql)
+		except psycopg2.errors.DuplicatePreparedStatement:
+			pass
+		prepared = getattr(cur.connection, 'prepared', None)
+		if prepared is not None:
+			prepared.add(self.name)
+
+
+class QueryBuilder:
+	"""
+	The fixed set of statements that traversals run against one database, built from the edges in the object type graph.
+	Only object types that have a table in the database get statements, so every table name is validated before it
+	reaches SQL and every value is a bound parameter
+	"""
+	def __init__(self, schema, tables):
+		"""
+		Initializes a QueryBuilder object
+		:param schema: the object type graph
+		:type schema: SchemaGraph
+		:param tables: all table names in the database
+		:type tables: list
+		"""
+		self.schema = schema
+		self.tables = set(tables)
+		self.statements = {}
+		for obj_type in self.tables:
+			self.statements[('object', obj_type)] = Statement("SELECT obj FROM " + obj_type + " WHERE obj->>'id' = $1", ['text'])
+			self.statements[('node_infos', obj_type)] = Statement("SELECT obj->>'id', obj->>'name', obj->>'status', obj->>'deleted', obj->>'type_full' FROM " + obj_type + " WHERE obj->>'id' = ANY($1)", ['text[]'])
+			self.statements[('objects', obj_type)] = Statement("SELECT obj->>'id', md5(obj::text), obj FROM " + obj_type + " WHERE obj->>'id' = ANY($1)", ['text[]'])
+			self.statements[('object_fields', obj_type)] = Statement("SELECT obj->>'id', md5(obj::text), (SELECT COALESCE(jsonb_object_agg(k, obj->k), '{}') FROM unnest($2) k WHERE obj ? k) FROM " + obj_type + " WHERE obj->>'id' = ANY($1)", ['text[]', 'text[]'])
+		for obj_type in set(schema.pointers_to) | set(schema.pointed_to_by):
+			if not self.has_table(obj_type):
+				continue
+			parent_types = [parent_type for parent_type in schema.pointers_to.get(obj_type, []) if self.has_table(parent_type)]
+			if len(parent_types) > 0: # every pointer field of the object in one read of its jsonb document, in parent_types order
+				fields = ", ".join("obj->>'" + schema.id_key(parent_type, child_type=obj_type) + "', obj->>'" + schema.id_key(parent_type, plural=True, child_type=obj_type) + "'" for parent_type in parent_types)
+				self.statements[('parent_ids', obj_type)] = Statement("SELECT obj->>'id', " + fields + " FROM " + obj_type + " WHERE obj->>'id' = ANY($1)", ['text[]'], edge=obj_type + " -> " + ",".join(parent_types))
+				self.statements[('edge_parents', obj_type)] = Statement("SELECT src_id, dst_type, dst_id FROM " + EDGE_TABLE + " WHERE src_type = '" + obj_type + "' AND src_id = ANY($1) ORDER BY pos", ['text[]'], edge=obj_type + " -> " + ",".join(parent_types))
+			for parent_type in schema.pointers_to.get(obj_type, []):
+				key = schema.id_key(parent_type, child_type=obj_type)
+				if self.has_table(parent_type):
+					self.statements[('children', parent_type, obj_type)] = Statement("SELECT obj->>'" + key + "', obj->>'id', obj->>'name', obj->>'status', obj->>'deleted', obj->>'type_full' FROM " + obj_type + " WHERE obj->>'" + key + "' = ANY($1)", ['text[]'], edge=obj_type + " -> " + parent_type)
+					plural_key = schema.id_key(parent_type, plural=True, child_type=obj_type)
+					self.statements[('plural_children', parent_type, obj_type)] = Statement("SELECT p.id, obj->>'id', obj->>'name', obj->>'status', obj->>'deleted', obj->>'type_full' FROM " + obj_type + " CROSS JOIN LATERAL unnest($1) AS p(id) WHERE obj->'" + plural_key + "' ?| $1 AND obj->'" + plural_key + "' ? p.id", ['text[]'], edge=obj_type + " -> " + parent_type)
+					self.statements[('child_counts', parent_type, obj_type)] = Statement("SELECT obj->>'" + key + "', count(obj->>'id') FROM " + obj_type + " WHERE obj->>'" + key + "' = ANY($1) GROUP BY 1", ['text[]'], edge=obj_type + " -> " + parent_type)
+					self.statements[('children_sample', parent_type, obj_type)] = Statement("SELECT p.id, c.obj->>'id', c.obj->>'name', c.obj->>'status', c.obj->>'deleted', c.obj->>'type_full' FROM unnest($1, $2) AS p(id, n) CROSS JOIN LATERAL (SELECT obj FROM " + obj_type + " WHERE obj->>'" + key + "' = p.id AND obj->>'id' IS NOT NULL LIMIT p.n) c", ['text[]', 'int[]'], edge=obj_type + " -> " + parent_type)
+					# the same three lookups from the edge table (see edgetable.py), which only yield ids; like them, they leave out children that point through a map of ids
+					edges = EDGE_TABLE + " WHERE dst_type = '" + parent_type + "' AND src_type = '" + obj_type + "' AND NOT plural"
+					self.statements[('edge_children', parent_type, obj_type)] = Statement("SELECT dst_id, src_id FROM " + edges + " AND dst_id = ANY($1)", ['text[]'], edge=obj_type + " -> " + parent_type)
+					self.statements[('edge_child_counts', parent_type, obj_type)] = Statement("SELECT dst_id, count(*) FROM " + edges + " AND dst_id = ANY($1) GROUP BY 1", ['text[]'], edge=obj_type + " -> " + parent_type)
+					self.statements[('edge_children_sample', parent_type, obj_type)] = Statement("SELECT p.id, e.src_id FROM unnest($1, $2) AS p(id, n) CROSS JOIN LATERAL (SELECT src_id FROM " + edges + " AND dst_id = p.id LIMIT p.n) e", ['text[]', 'int[]'], edge=obj_type + " -> " + parent_type)
+		self.statements[('traversal',)] = Statement(compile_traversal(schema, self.has_table), ['text', 'text', 'int', 'int'])
+		self.statements[('traversal_stats',)] = Statement(compile_traversal(schema, self.has_table, aggregate=True), ['text', 'text', 'int', 'int'])
+		for (key, statement) in self.statements.items():
+			statement.kind = key[0]
+
+	def has_table(self, obj_type):
+		"""
+		Checks whether an object type has a table in the database
+		:param obj_type: the type of object
+		:type obj_type: str
+		:returns: whether the table exists
+		:rtype: bool
+		"""
+		return obj_type in self.tables
+
+	def get(self, *key):
+		"""
+		Gets one of the statements, e.g. get('object', 'adunit') or get('parent_ids', 'adunit')
+		:param key: the kind of statement (object, node_infos, parent_ids, children, plural_children, child_counts, children_sample, their edge_ variants, or traversal) followed by the object types it is for
+		:type key: str
+		:returns: the statement
+		:rtype: Statement
+		"""
+		try:
+			return self.statements[key]
+		except KeyError:
+			raise UnknownTable("No " + key[0] + " query for " + " -> ".join(key[1:]) + "; the object type is not a table in the database or the edge is not in the object type graph")
+
+
+builders = {} # one per (database, connections file), so the statements are built once rather than per request
+builders_lock = threading.Lock()
+
+def get_query_builder(dsn, schema, get_tables):
+	"""
+	Gets the process-wide query builder for a database, building it on first use
+	:param dsn: the url of the database
+	:type dsn: str
+	:param schema: the object type graph
+	:type schema: SchemaGraph
+	:param get_tables: a function returning all table names in the database, called only when the builder is first built
+	:type get_tables: function
+	:returns: the statements for the database
+	:rtype: QueryBuilder
+	"""
+	with builders_lock:
+		if (dsn, schema.file_path) not in builders:
+			builders[(dsn, schema.file_path)] = QueryBuilder(schema, get_tables())
+		return builders[(dsn, schema.file_path)]
+
+
+def pointer_refs(schema, alias, parent_type, obj_type):
+	"""
+	Builds the select of the ids an object points to of one parent type: its single id field if set, else the keys
+	(or elements) of its map of ids, in stored order
+	:param schema: the object type graph
+	:type schema: SchemaGraph
+	:param alias: the name the object's row goes by in the enclosing query, e.g. a table alias or NEW in a trigger
+	:type alias: str
+	:param parent_type: the parent type
+	:type parent_type: str
+	:param obj_type: the object's type
+	:type obj_type: str
+	:returns: a select of (id, sub, single) rows, where sub is the id's position in the map (0 for the single id field)
+	:rtype: str
+	"""
+	key = schema.id_key(parent_type, child_type=obj_type)
+	keys = schema.id_key(parent_type, plural=True, child_type=obj_type)
+	return ("SELECT " + alias + ".obj->>'" + key + "' AS id, 0::bigint AS sub, true AS single WHERE " + alias + ".obj->>'" + key + "' IS NOT NULL"
+		+ " UNION ALL SELECT k.id, k.sub, false FROM jsonb_object_keys(CASE WHEN " + alias + ".obj->>'" + key + "' IS NULL AND jsonb_typeof(" + alias + ".obj->'" + keys + "') = 'object' THEN " + alias + ".obj->'" + keys + "' END) WITH ORDINALITY AS k(id, sub)"
+		+ " UNION ALL SELECT k.id, k.sub, false FROM jsonb_array_elements_text(CASE WHEN " + alias + ".obj->>'" + key + "' IS NULL AND jsonb_typeof(" + alias + ".obj->'" + keys + "') = 'array' THEN " + alias + ".obj->'" + keys + "' END) WITH ORDINALITY AS k(id, sub)")
+
+def compile_traversal(schema, has_table, aggregate = False):
+	"""
+	Compiles the object type graph into one recursive query that walks a whole depth-limited neighborhood breadth-first
+	inside Postgres. Each step of the recursion is one whole layer: a single row holding the layer's frontier and every
+	object seen so far, so an object reached along several paths is only added once, and the walk stops once the
+	depth limit or the object limit is reached. Parameters are the starting object's type and id, the depth limit, and
+	the object limit. Returns one row per object, numbered in the order found, with its depth, whether it was expanded,
+	its name, status, deleted, and type_full fields, and the numbers of the objects that point to it; or, if aggregate,
+	one row per type, type_full and whether deleted is "0", with its number of objects
+	:param schema: the object type graph
+	:type schema: SchemaGraph
+	:param has_table: a function that checks whether an object type has a table in the database
+	:type has_table: function
+	:param aggregate: whether to count the objects found instead of returning them
+	:type aggregate: bool
+	:returns: the query, with $1 to $4 placeholders
+	:rtype: str
+	"""
+	edges = [] # (child type, parent type) for every edge whose tables both exist
+	for obj_type in sorted(schema.pointers_to):
+		for parent_type in schema.pointers_to[obj_type]:
+			if has_table(obj_type) and has_table(parent_type):
+				edges.append((obj_type, parent_type))
+	obj_types = sorted(set([e[0] for e in edges] + [e[1] for e in edges]))
+
+	steps = [] # one select per (frontier type, edge), ranked in the order the Python traversal looks edges up
+	for obj_type in obj_types:
+		rank = 0
+		for parent_type in schema.pointers_to.get(obj_type, []):
+			if (obj_type, parent_type) in edges:
+				steps.append("SELECT '" + parent_type + "'::text AS type, r.id, f.ord, " + str(rank) + " AS rank, r.sub FROM " + obj_type + " t CROSS JOIN LATERAL (" + pointer_refs(schema, 't', parent_type, obj_type) + ") r"
+					+ " WHERE f.type = '" + obj_type + "' AND t.obj->>'id' = f.id AND EXISTS (SELECT 1 FROM " + parent_type + " p WHERE p.obj->>'id' = r.id)")
+			rank += 1
+		for child_type in schema.pointed_to_by.get(obj_type, []):
+			if (child_type, obj_type) in edges:
+				steps.append("SELECT '" + child_type + "'::text AS type, c.obj->>'id' AS id, f.ord, " + str(rank) + " AS rank, 0::bigint AS sub FROM " + child_type + " c" # named too, since a UNION takes its column names from whichever step comes first
+					+ " WHERE f.type = '" + obj_type + "' AND c.obj->>'" + schema.id_key(obj_type, child_type=child_type) + "' = f.id AND c.obj->>'id' IS NOT NULL")
+			rank += 1
+
+	infos = []
+	pointers = []
+	for obj_type in obj_types:
+		infos.append("SELECT n.ord, t.obj->>'name' AS name, t.obj->>'status' AS status, t.obj->>'deleted' AS deleted, t.obj->>'type_full' AS type_full FROM nodes n JOIN " + obj_type + " t ON n.type = '" + obj_type + "' AND t.obj->>'id' = n.id")
+	for (obj_type, parent_type) in edges:
+		# the Python traversal records an edge when it expands the child, or when it expands the parent and the pointer is a single id field
+		pointers.append("SELECT c.ord AS child, p.ord AS parent FROM nodes c JOIN " + obj_type + " t ON c.type = '" + obj_type + "' AND t.obj->>'id' = c.id CROSS JOIN LATERAL (" + pointer_refs(schema, 't', parent_type, obj_type) + ") r"
+			+ " JOIN nodes p ON p.type = '" + parent_type + "' AND p.id = r.id WHERE c.expanded OR (r.single AND p.expanded)")
+
+	if aggregate:
+		select = ") SELECT n.type, i.type_full, i.deleted = '0', count(*) FROM nodes n JOIN infos i ON i.ord = n.ord GROUP BY 1, 2, 3"
+	else:
+		select = ("), pointers AS (SELECT p.parent, array_agg(DISTINCT p.child - 1) AS children FROM (" + " UNION ALL ".join(pointers) + ") p GROUP BY p.parent"
+			+ ") SELECT n.ord - 1, n.type, n.id, n.depth, i.name, i.status, i.deleted, i.type_full, COALESCE(p.children, '{}')"
+			+ " FROM nodes n JOIN infos i ON i.ord = n.ord LEFT JOIN pointers p ON p.parent = n.ord ORDER BY n.ord")
+	return ("WITH RECURSIVE layers(depth, frontier_types, frontier_ids, seen_types, seen_ids, seen_depths) AS ("
+		+ " SELECT 0, ARRAY[$1::text], ARRAY[$2::text], ARRAY[$1::text], ARRAY[$2::text], ARRAY[0]"
+		+ " UNION ALL"
+		+ " SELECT l.depth + 1, n.types, n.ids, l.seen_types || n.types, l.seen_ids || n.ids, l.seen_depths || array_fill(l.depth + 1, ARRAY[cardinality(n.ids)])"
+		+ " FROM layers l CROSS JOIN LATERAL ("
+		+ " SELECT array_agg(x.type ORDER BY x.ord, x.rank, x.sub) AS types, array_agg(x.id ORDER BY x.ord, x.rank, x.sub) AS ids FROM ("
+		+ " SELECT DISTINCT ON (e.type, e.id) e.type, e.id, e.ord, e.rank, e.sub"
+		+ " FROM unnest(l.frontier_types, l.frontier_ids) WITH ORDINALITY AS f(type, id, ord)"
+		+ " CROSS JOIN LATERAL (" + " UNION ALL ".join(steps) + ") e"
+		+ " LEFT JOIN unnest(l.seen_types, l.seen_ids) AS s(type, id) ON s.type = e.type AND s.id = e.id"
+		+ " WHERE s.id IS NULL"
+		+ " ORDER BY e.type, e.id, e.ord, e.rank, e.sub) x) n"
+		+ " WHERE l.depth < $3 AND cardinality(l.seen_ids) < $4 AND n.ids IS NOT NULL"
+		+ "), last AS (SELECT * FROM layers ORDER BY depth DESC LIMIT 1"
+		+ "), nodes AS ("
+		+ " SELECT k.ord, k.type, k.id, k.depth, k.depth < $3 AND (k.depth < last.depth OR cardinality(last.seen_ids) < $4) AS expanded"
+		+ " FROM last CROSS JOIN LATERAL unnest(last.seen_types, last.seen_ids, last.seen_depths) WITH ORDINALITY AS k(type, id, depth, ord)"
+		+ " WHERE k.ord <= $4"
+		+ "), infos AS (SELECT DISTINCT ON (ord) * FROM (" + " UNION ALL ".join(infos) + ") i ORDER BY ord"
+		+ select)
@@ -0,0 +1,143 @@
+import bisect
+import json
+import os
+import threading
+
+
+class SchemaGraph:
+	"""
+	The graph of object types and the pointer fields that connect them, parsed from a connections file or loaded from
+	an edge catalog written by discovery.py
+	"""
+	def __init__(self, file_path):
+		"""
+		Initializes a SchemaGraph object
+		:param file_path: The path to the file that contains the object type graph, one "child -> parent" edge per line, or to a .json edge catalog
+		:type file_path: str
+		"""
+		self.file_path = file_path
+		self.pointers_to = {} # object type -> types of the parent objects it points to
+		self.pointed_to_by = {} # object type -> types of the child objects that point to it
+		self.edge_stats = {} # (child type, parent type) -> the edge's cardinality estimates, if loaded from a catalog
+		self.id_keys = {} # object type -> the single and plural field names that point to it
+		self.edge_keys = {} # (child type, parent type) -> the single and plural field names of that edge, if loaded from a catalog
+		if file_path.endswith(".json"):
+			with open(file_path) as file:
+				catalog = json.load(file)
+			for edge in catalog['edges']:
+				self.add_edge(edge['child'], edge['parent'])
+				self.edge_stats[(edge['child'], edge['parent'])] = edge
+				self.edge_keys[(edge['child'], edge['parent'])] = (edge['key'], edge['keys'])
+		else:
+			with open(file_path) as file:
+				for line in file:
+					(key, value) = line.split(" -> ")
+					if value.endswith("\n"):
+						value = value[:-1]
+					self.add_edge(key, value)
+		for obj_type in set(self.pointers_to) | set(self.pointed_to_by):
+			if obj_type not in self.id_keys:
+				self.id_keys[obj_type] = pointer_keys(obj_type)
+		self.key_types = {} # field name -> the object type it points to
+		for (obj_type, keys) in list(self.id_keys.items()) + [(parent_type, keys) for ((child_type, parent_type), keys) in self.edge_keys.items()]:
+			for key in keys:
+				self.key_types[key] = obj_type
+
+	def add_edge(self, key, value):
+		"""
+		Adds an edge to the graph
+		:param key: the type of the child object, which holds the pointer
+		:type key: str
+		:param value: the type of the parent object it points to
+		:type value: str
+		"""
+		try:
+			bisect.insort(self.pointers_to[key], value) # alphabetizing generates more connections with "relevant" object types (accounts, adunits, etc.) that happen to come first alphabetically
+			#self.pointers_to[key].append(value) # to add types in "natural" order
+		except:
+			self.pointers_to[key] = [value]
+		try:
+			bisect.insort(self.pointed_to_by[value], key)
+			#self.pointed_to_by[value].append(key)
+		except:
+			self.pointed_to_by[value] = [key]
+
+	def edge_cost(self, child_type, parent_type, parents = True):
+		"""
+		Estimates how many objects one lookup along an edge finds per object looked up, from the catalog's cardinality
+		statistics
+		:param child_type: the type of the child object
+		:type child_type: str
+		:param parent_type: the type of the parent object
+		:type parent_type: str
+		:param parents: whether the lookup finds the parents of child objects, rather than the children of parent objects
+		:type parents: bool
+		:returns: the estimated objects found per object looked up, or None without statistics for the edge
+		:rtype: float
+		"""
+		stats = self.edge_stats.get((child_type, parent_type))
+		if stats is None:
+			return None
+		return stats['parents_per_child'] if parents else stats['children_per_parent']
+
+	def id_key(self, obj_type, plural = False, child_type = None):
+		"""
+		Gets the field name that other objects use to point to an object type
+		:param obj_type: the type of the object being pointed to
+		:type obj_type: str
+		:param plural: whether to return the name of the jsonb map of ids (e.g. adunit_ids) instead of the single id field
+		:type plural: bool
+		:param child_type: the type of the objects holding the pointer, for edges whose field an edge catalog names (e.g. partner_id for lineitem -> account)
+		:type child_type: str
+		:returns: the field name that holds the pointer
+		:rtype: str
+		"""
+		keys = self.edge_keys.get((child_type, obj_type)) or self.id_keys.get(obj_type) or pointer_keys(obj_type)
+		return keys[1] if plural else keys[0]
+
+
+KEY_TYPES = {'order_id': 'order_', 'user_id': 'user_', 'partner_id': 'account', 'demand_partner_id': 'account', 'openx_buyer_id': 'buyer'} # pointer fields that are not named after the type they point to
+
+def key_obj_type(key):
+	"""
+	Gets the object type a pointer field points to, by the naming convention and its exceptions in KEY_TYPES
+	:param key: the field name, e.g. adunit_id or adunit_ids
+	:type key: str
+	:returns: the object type that the field name points to
+	:rtype: str
+	"""
+	if key.endswith('ids'):
+		key = key[0:-1]
+	return KEY_TYPES.get(key, key[0:-3])
+
+def pointer_keys(obj_type):
+	"""
+	Gets the field names that other objects use to point to an object type, by the naming convention
+	:param obj_type: the type of the object being pointed to
+	:type obj_type: str
+	:returns: the single id field and the jsonb map of ids (e.g. adunit_id and adunit_ids)
+	:rtype: tuple (str, str)
+	"""
+	if obj_type == 'order_' or obj_type == 'user_': # since ids stored under user_id and order_id fields
+		key = obj_type + "id"
+	else:
+		key = obj_type + "_id"
+	return (key, key + "s")
+
+SCHEMA_PATH = os.environ.get('OBJVIZ_SCHEMA', 'connections.txt') # the object type graph requests use: a connections file, or an edge catalog from api.py --discover
+
+schemas = {} # file path -> SchemaGraph, so each file is parsed once
+schemas_lock = threading.Lock()
+
+def load_schema(file_path):
+	"""
+	Gets the process-wide schema graph for a connections file, parsing it on first use
+	:param file_path: The path to the file that contains the object type graph
+	:type file_path: str
+	:returns: the parsed object type graph
+	:rtype: SchemaGraph
+	"""
+	with schemas_lock:
+		if file_path not in schemas:
+			schemas[file_path] = SchemaGraph(file_path)
+		return schemas[file_path]
@@ -0,0 +1,371 @@
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import numpy as np
+import psycopg2 as pcg2
+from cache import dsn_fingerprint
+from queries import UnknownTable
+
+
+SNAPSHOT_DIR = os.environ.get('OBJVIZ_SNAPSHOT_DIR', 'snapshots') # holds one snapshot directory per database
+SNAPSHOT_ITERSIZE = 10000 # rows fetched per round trip while scanning a table
+
+ARRAYS = ['node_type', 'id_offsets', 'id_bytes', 'name_offsets', 'name_bytes', 'name_null', 'status', 'deleted', 'type_full', 'lookup', 'parent_offsets', 'parent_targets', 'child_offsets', 'child_targets']
+
+
+def string_pool(strings):
+	"""
+	Packs strings into one byte array and an array of offsets, so the nth string is bytes[offsets[n]:offsets[n + 1]]
+	:param strings: the strings (None is stored as an empty string; see null_mask)
+	:type strings: list
+	:returns: the offsets and the utf-8 bytes
+	:rtype: tuple (numpy.ndarray, numpy.ndarray)
+	"""
+	encoded = [(s or "").encode('utf-8') for s in strings]
+	offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+	np.cumsum([len(b) for b in encoded], out=offsets[1:])
+	return (offsets, np.frombuffer(b"".join(encoded), dtype=np.uint8))
+
+def null_mask(strings):
+	"""
+	Marks which strings are None, which string_pool cannot tell apart from empty strings
+	:param strings: the strings
+	:type strings: list
+	:returns: whether each string is None
+	:rtype: numpy.ndarray
+	"""
+	return np.array([s is None for s in strings], dtype=bool)
+
+def csr(count, pairs):
+	"""
+	Builds a compressed sparse row adjacency list
+	:param count: the number of nodes
+	:type count: int
+	:param pairs: (node, target) pairs, already in the order each node's targets should be listed
+	:type pairs: list
+	:returns: the offsets, so node n's targets are targets[offsets[n]:offsets[n + 1]], and the targets
+	:rtype: tuple (numpy.ndarray, numpy.ndarray)
+	"""
+	nodes = np.array([p[0] for p in pairs], dtype=np.int64)
+	targets = np.array([p[1] for p in pairs], dtype=np.int32)
+	order = np.argsort(nodes, kind='stable')
+	offsets = np.zeros(count + 1, dtype=np.int64)
+	np.cumsum(np.bincount(nodes, minlength=count), out=offsets[1:])
+	return (offsets, targets[order])
+
+def build_snapshot(dsn, schema, tables, path):
+	"""
+	Scans every table in the object type graph once and writes a snapshot of the whole object graph to a directory:
+	a node table (types, ids, names and interned status/deleted/type_full), a sorted lookup from (type, id) to node,
+	and CSR adjacency arrays of each node's parents and children, all as .npy files that are memory-mapped when loaded
+	:param dsn: the url of the database
+	:type dsn: str
+	:param schema: the object type graph
+	:type schema: SchemaGraph
+	:param tables: all table names in the database
+	:type tables: list
+	:param path: the directory to write the snapshot to; it is replaced only once the new snapshot is complete
+	:type path: str
+	:returns: the snapshot's metadata
+	:rtype: dict
+	"""
+	root_logger = logging.getLogger()
+	started = time.time()
+	obj_types = sorted(t for t in set(schema.pointers_to) | set(schema.pointed_to_by) if t in tables)
+	type_codes = {t: code for (code, t) in enumerate(obj_types)}
+	values = []
+	value_codes = {}
+	def intern(value):
+		if value not in value_codes:
+			value_codes[value] = len(values)
+			values.append(value)
+		return value_codes[value]
+
+	node_type = []
+	ids = []
+	names = []
+	(status, deleted, type_full) = ([], [], [])
+	index = {} # (type code, id) -> node
+	pointers = [] # (node, parent type, parent id, whether it came from the single id field)
+
+	con = pcg2.connect(dsn) # named cursors need a transaction, so this does not come from the autocommit pool
+	try:
+		for obj_type in obj_types:
+			parent_types = [p for p in schema.pointers_to.get(obj_type, []) if p in tables]
+			columns = ["obj->>'id'", "obj->>'name'", "obj->>'status'", "obj->>'deleted'", "obj->>'type_full'"]
+			for parent_type in parent_types:
+				columns.append("obj->>'" + schema.id_key(parent_type, child_type=obj_type) + "'")
+				columns.append("obj->>'" + schema.id_key(parent_type, plural=True, child_type=obj_type) + "'")
+			cur = con.cursor(name="objviz_snapshot_" + obj_type)
+			cur.itersize = SNAPSHOT_ITERSIZE
+			cur.execute("SELECT " + ", ".join(columns) + " FROM " + obj_type)
+			count = 0
+			for row in cur:
+				if row[0] is None or (type_codes[obj_type], row[0]) in index:
+					continue
+				node = len(ids)
+				index[(type_codes[obj_type], row[0])] = node
+				node_type.append(type_codes[obj_type])
+				ids.append(row[0])
+				names.append(row[1])
+				status.append(intern(row[2]))
+				deleted.append(intern(row[3]))
+				type_full.append(intern(row[4]))
+				for (i, parent_type) in enumerate(parent_types):
+					(parent_id, parent_ids) = (row[5 + 2 * i], row[6 + 2 * i])
+					if parent_id is not None:
+						pointers.append((node, parent_type, parent_id, True))
+					elif parent_ids is not None:
+						try:
+							for r in json.loads(parent_ids):
+								pointers.append((node, parent_type, str(r), False))
+						except Exception as e:
+							pass
+				count += 1
+			cur.close()
+			con.commit()
+			root_logger.info("SNAPSHOT: " + str(count) + " " + obj_type + " OBJECTS SCANNED")
+	finally:
+		con.close()
+
+	parents = [] # (node, parent node), in the order the traversal lists a node's parents: by type, then as stored
+	children = [] # (node, child node), for pointers held in a single id field, which is the only kind children are found by
+	for (node, parent_type, parent_id, single) in pointers:
+		parent = index.get((type_codes[parent_type], parent_id))
+		if parent is None:
+			continue
+		parents.append((node, parent))
+		if single:
+			children.append((parent, node))
+
+	arrays = {}
+	arrays['node_type'] = np.array(node_type, dtype=np.int16)
+	(arrays['id_offsets'], arrays['id_bytes']) = string_pool(ids)
+	(arrays['name_offsets'], arrays['name_bytes']) = string_pool(names)
+	arrays['name_null'] = null_mask(names)
+	arrays['status'] = np.array(status, dtype=np.int32)
+	arrays['deleted'] = np.array(deleted, dtype=np.int32)
+	arrays['type_full'] = np.array(type_full, dtype=np.int32)
+	arrays['lookup'] = np.array(sorted(range(len(ids)), key=lambda n: (node_type[n], ids[n])), dtype=np.int32)
+	(arrays['parent_offsets'], arrays['parent_targets']) = csr(len(ids), parents)
+	(arrays['child_offsets'], arrays['child_targets']) = csr(len(ids), sorted(children))
+	meta = {'types': obj_types, 'values': values, 'nodes': len(ids), 'parent_edges': len(parents), 'child_edges': len(children), 'schema': schema.file_path, 'built_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()), 'build_seconds': round(time.time() - started, 3)}
+
+	tmp_path = path.rstrip('/') + '.tmp'
+	if os.path.exists(tmp_path):
+		shutil.rmtree(tmp_path)
+	os.makedirs(tmp_path)
+	for name in ARRAYS:
+		np.save(os.path.join(tmp_path, name + '.npy'), arrays[name])
+	with open(os.path.join(tmp_path, 'meta.json'), 'w') as file:
+		json.dump(meta, file)
+	if os.path.exists(path):
+		old_path = path.rstrip('/') + '.old'
+		if os.path.exists(old_path):
+			shutil.rmtree(old_path)
+		os.rename(path, old_path)
+		os.rename(tmp_path, path)
+		shutil.rmtree(old_path)
+	else:
+		os.rename(tmp_path, path)
+	return meta
+
+
+class Snapshot:
+	"""
+	A snapshot of the object graph written by build_snapshot, with its arrays memory-mapped from disk
+	"""
+	def __init__(self, path):
+		"""
+		Initializes a Snapshot object
+		:param path: the directory the snapshot was written to
+		:type path: str
+		"""
+		self.path = path
+		with open(os.path.join(path, 'meta.json')) as file:
+			self.meta = json.load(file)
+		self.types = self.meta['types']
+		self.type_codes = {t: code for (code, t) in enumerate(self.types)}
+		self.values = self.meta['values']
+		for name in ARRAYS:
+			if name == 'name_null' and not os.path.exists(os.path.join(path, name + '.npy')): # written before null names were kept apart from empty ones
+				self.name_null = np.zeros(self.meta['nodes'], dtype=bool)
+				continue
+			setattr(self, name, np.load(os.path.join(path, name + '.npy'), mmap_mode='r'))
+
+	def obj_id(self, node):
+		"""
+		Gets the object id of a node
+		:param node: the node's index in the snapshot
+		:type node: int
+		:returns: the object's id
+		:rtype: str
+		"""
+		return bytes(self.id_bytes[self.id_offsets[node]:self.id_offsets[node + 1]]).decode('utf-8')
+
+	def info(self, node):
+		"""
+		Gets the name, status, deleted, and type_full fields of a node
+		:param node: the node's index in the snapshot
+		:type node: int
+		:returns: the four fields, as get_node_info returns them, with None for a field the object does not have
+		:rtype: tuple
+		"""
+		name = None if self.name_null[node] else bytes(self.name_bytes[self.name_offsets[node]:self.name_offsets[node + 1]]).decode('utf-8')
+		return (name, self.values[self.status[node]], self.values[self.deleted[node]], self.values[self.type_full[node]])
+
+	def find(self, obj_type, obj_id):
+		"""
+		Finds an object's node by binary search over the sorted lookup
+		:param obj_type: the type of the object
+		:type obj_type: str
+		:param obj_id: the id of the object
+		:type obj_id: str
+		:returns: the node's index in the snapshot, or None if the object is not in it
+		:rtype: int
+		"""
+		if obj_type not in self.type_codes:
+			return None
+		key = (self.type_codes[obj_type], obj_id)
+		(low, high) = (0, len(self.lookup))
+		while low < high:
+			mid = (low + high) // 2
+			node = int(self.lookup[mid])
+			if (int(self.node_type[node]), self.obj_id(node)) < key:
+				low = mid + 1
+			else:
+				high = mid
+		if low < len(self.lookup):
+			node = int(self.lookup[low])
+			if (int(self.node_type[node]), self.obj_id(node)) == key:
+				return node
+		return None
+
+	def neighbors(self, node, obj_type, offsets, targets):
+		"""
+		Gets a node's parents or children of one type
+		:param node: the node's index in the snapshot
+		:type node: int
+		:param obj_type: the type of the neighbors
+		:type obj_type: str
+		:param offsets: parent_offsets or child_offsets
+		:type offsets: numpy.ndarray
+		:param targets: parent_targets or child_targets
+		:type targets: numpy.ndarray
+		:returns: the neighbors' indices in the snapshot, in stored order
+		:rtype: list
+		"""
+		found = np.asarray(targets[offsets[node]:offsets[node + 1]])
+		return found[np.asarray(self.node_type)[found] == self.type_codes[obj_type]].tolist()
+
+
+class SnapshotSource:
+	"""
+	Answers a traversal's lookups (see ObjectTree.fetch_parent_ids, fetch_children and fetch_node_infos) from a snapshot
+	instead of the database. One is made per request, since it remembers the snapshot node of every object it returns
+	"""
+	def __init__(self, snapshot):
+		"""
+		Initializes a SnapshotSource object
+		:param snapshot: the snapshot to read from
+		:type snapshot: Snapshot
+		"""
+		self.snapshot = snapshot
+		self.nodes = {} # (type, id) -> snapshot node, for every object returned so far
+
+	def has_table(self, obj_type):
+		"""
+		Checks whether an object type was in the database when the snapshot was built (see QueryBuilder.has_table)
+		"""
+		return obj_type in self.snapshot.type_codes
+
+	def node(self, obj_type, obj_id):
+		"""
+		Finds an object's snapshot node
+		:param obj_type: the type of the object
+		:type obj_type: str
+		:param obj_id: the id of the object
+		:type obj_id: str
+		:returns: the node's index in the snapshot, or None if the object is not in it
+		:rtype: int
+		"""
+		if not self.has_table(obj_type): # as the database's query builder does, so both sources answer an unknown type alike
+			raise UnknownTable("No " + obj_type + " objects in the snapshot; the object type was not a table in the database when the snapshot was built")
+		if (obj_type, obj_id) not in self.nodes:
+			self.nodes[(obj_type, obj_id)] = self.snapshot.find(obj_type, obj_id)
+		return self.nodes[(obj_type, obj_id)]
+
+	def fetch_parent_ids(self, obj_type, obj_ids, parent_type):
+		"""
+		Finds the parents of a given type for a set of objects (see ObjectTree.fetch_parent_ids)
+		"""
+		parents = {}
+		for obj_id in obj_ids:
+			node = self.node(obj_type, obj_id)
+			if node is None:
+				continue
+			found = []
+			for parent in self.snapshot.neighbors(node, parent_type, self.snapshot.parent_offsets, self.snapshot.parent_targets):
+				parent_id = self.snapshot.obj_id(parent)
+				self.nodes[(parent_type, parent_id)] = parent
+				found.append(parent_id)
+			if len(found) > 0:
+				parents[obj_id] = found
+		return parents
+
+	def fetch_children(self, obj_type, obj_ids, child_type):
+		"""
+		Finds the children of a given type of a set of objects (see ObjectTree.fetch_children)
+		"""
+		children = {}
+		for obj_id in obj_ids:
+			node = self.node(obj_type, obj_id)
+			if node is None:
+				continue
+			for child in self.snapshot.neighbors(node, child_type, self.snapshot.child_offsets, self.snapshot.child_targets):
+				child_id = self.snapshot.obj_id(child)
+				self.nodes[(child_type, child_id)] = child
+				children.setdefault(obj_id, []).append((child_id,) + self.snapshot.info(child))
+		return children
+
+	def fetch_node_infos(self, obj_type, obj_ids):
+		"""
+		Gets the name, status, deleted, and type_full fields of a set of objects (see ObjectTree.fetch_node_infos)
+		"""
+		infos = {}
+		for obj_id in obj_ids:
+			node = self.node(obj_type, obj_id)
+			if node is not None:
+				infos[obj_id] = self.snapshot.info(node)
+		return infos
+
+
+snapshots = {} # path -> (meta.json modification time, Snapshot), so a rebuilt snapshot is noticed and loaded again
+snapshots_lock = threading.Lock()
+
+def load_snapshot(path):
+	"""
+	Gets the process-wide snapshot stored in a directory, loading it again if it has been rebuilt since
+	:param path: the directory the snapshot was written to
+	:type path: str
+	:returns: the snapshot
+	:rtype: Snapshot
+	"""
+	mtime = os.path.getmtime(os.path.join(path, 'meta.json'))
+	with snapshots_lock:
+		if path not in snapshots or snapshots[path][0] != mtime:
+			snapshots[path] = (mtime, Snapshot(path))
+		return snapshots[path][1]
+
+def snapshot_path(dsn):
+	"""
+	Gets the directory that holds a database's snapshot
+	:param dsn: the url of the database
+	:type dsn: str
+	:returns: the snapshot's directory
+	:rtype: str
+	"""
+	return os.path.join(SNAPSHOT_DIR, dsn_fingerprint(dsn))
@@ -0,0 +1,48 @@
+import pytest
+import snapshot
+from schema import SchemaGraph
+
+
+class FakeCursor:
+	def __init__(self, tables):
+		self.tables = tables
+		self.rows = []
+
+	def execute(self, sql):
+		self.rows = self.tables[sql.split(" FROM ")[-1]]
+
+	def __iter__(self):
+		return iter(self.rows)
+
+	def close(self):
+		pass
+
+
+class FakeConnection: # stands in for the database a snapshot is built from
+	def __init__(self, tables):
+		self.tables = tables
+
+	def cursor(self, name = None):
+		return FakeCursor(self.tables)
+
+	def commit(self):
+		pass
+
+	def close(self):
+		pass
+
+
+@pytest.fixture
+def fake_snapshot(tmp_path, monkeypatch):
+	"""
+	Builds snapshots from rows instead of a database: call it with the connections file's text and table -> rows of
+	id, name, status, deleted, type_full, then each parent's single and plural id fields; it returns the connections
+	file's path, the snapshot's metadata and its directory
+	"""
+	def build(connections, tables):
+		path = tmp_path / "connections.txt"
+		path.write_text(connections)
+		monkeypatch.setattr(snapshot.pcg2, 'connect', lambda dsn: FakeConnection(tables))
+		meta = snapshot.build_snapshot("postgresql:///objviz", SchemaGraph(str(path)), list(tables), str(tmp_path / "snapshot"))
+		return (str(path), meta, str(tmp_path / "snapshot"))
+	return build
@@ -0,0 +1,91 @@
+import threading
+import time
+import pytest
+from admission import AdmissionLimiter, Overloaded, SingleFlight
+
+
+def wait_for(condition, timeout = 5):
+	deadline = time.monotonic() + timeout
+	while not condition():
+		assert time.monotonic() < deadline
+		time.sleep(0.001)
+
+def test_limiter_admits_in_arrival_order():
+	limiter = AdmissionLimiter(max_running=1, max_queued=4)
+	first = limiter.acquire(1)
+	admitted = []
+	waiter = threading.Thread(target=lambda: admitted.append(limiter.acquire(1, timeout=5)))
+	waiter.start()
+	wait_for(lambda: len(limiter.queue) == 1)
+	limiter.release(first)
+	with pytest.raises(Overloaded): # the freed slot belongs to the search already waiting, so a newcomer has to queue behind it
+		limiter.acquire(1, timeout=0)
+	waiter.join()
+	assert len(admitted) == 1
+	assert limiter.running == 1
+	limiter.release(admitted[0])
+	assert limiter.running == 0 and limiter.costs == 0
+
+def test_limiter_turns_away_when_queue_is_full():
+	limiter = AdmissionLimiter(max_running=1, max_queued=0)
+	token = limiter.acquire(3)
+	with pytest.raises(Overloaded) as raised:
+		limiter.acquire(2)
+	assert raised.value.cost == 2
+	assert raised.value.retry_after >= 1
+	limiter.release(token)
+	limiter.release(limiter.acquire(2))
+
+def test_single_flight_shares_one_call():
+	flight = SingleFlight()
+	started = threading.Event()
+	release = threading.Event()
+	calls = []
+	def slow():
+		calls.append(1)
+		started.set()
+		release.wait(5)
+		return 'network'
+	results = []
+	leader = threading.Thread(target=lambda: results.append(flight.do(('key',), slow)))
+	leader.start()
+	started.wait(5)
+	follower = threading.Thread(target=lambda: results.append(flight.do(('key',), slow)))
+	follower.start()
+	time.sleep(0.01) # let the follower reach the running call before the leader finishes
+	release.set()
+	leader.join()
+	follower.join()
+	assert len(calls) == 1
+	assert sorted(results) == [('network', False), ('network', True)]
+	assert flight.calls == {}
+
+def test_single_flight_leader_error_reaches_waiters():
+	flight = SingleFlight()
+	started = threading.Event()
+	release = threading.Event()
+	def failing():
+		started.set()
+		release.wait(5)
+		raise ValueError("the search failed")
+	errors = []
+	def call():
+		try:
+			flight.do(('key',), failing)
+		except ValueError as e:
+			errors.append(e)
+	leader = threading.Thread(target=call)
+	leader.start()
+	started.wait(5)
+	waiters = [threading.Thread(target=call) for i in range(3)]
+	for waiter in waiters:
+		waiter.start()
+	time.sleep(0.01) # let the waiters reach the event before the leader fails
+	release.set()
+	leader.join()
+	for waiter in waiters:
+		waiter.join()
+	assert len(errors) == 4
+	assert all(str(e) == "the search failed" for e in errors)
+	assert flight.calls == {} # the failed call does not stick: the next caller runs its own
+	assert flight.do(('key',), lambda: 'network') == ('network', False)
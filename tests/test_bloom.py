@@ -0,0 +1,31 @@
+import hashlib
+from api import in_bloom_filter
+
+
+def bloom_filter(keys, size, hashes):
+	bits = bytearray(size // 8)
+	for key in keys:
+		digest = hashlib.sha256(key.encode('utf-8')).digest()
+		(h1, h2) = (int.from_bytes(digest[:8], 'big'), int.from_bytes(digest[8:16], 'big'))
+		for j in range(hashes):
+			bit = (h1 + j * h2) % size
+			bits[bit // 8] |= 1 << (bit % 8)
+	return bytes(bits)
+
+def test_bloom_filter_holds_every_key_added():
+	keys = ["account " + str(i) for i in range(500)]
+	for hashes in [1, 4, 7]:
+		bits = bloom_filter(keys, 8 * 1024, hashes)
+		assert all(in_bloom_filter(bits, hashes, key) for key in keys)
+
+def test_bloom_filter_false_positives_stay_rare():
+	# 1000 keys in 9600 bits with 7 hashes should give about 1% false positives
+	bits = bloom_filter(["account " + str(i) for i in range(1000)], 9600, 7)
+	false_positives = sum(in_bloom_filter(bits, 7, "order_ " + str(i)) for i in range(10000))
+	assert 0 < false_positives < 300
+	assert not in_bloom_filter(bloom_filter([], 9600, 7), 7, "account 1")
+
+def test_bloom_filter_full_of_ones_holds_everything():
+	# the worst case of false positives: every key looks held, so the client gets every object by key instead of index
+	bits = b'\xff' * 16
+	assert all(in_bloom_filter(bits, 4, "ad " + str(i)) for i in range(100))
@@ -0,0 +1,33 @@
+import random
+from api import allocate_budget
+
+
+def test_budget_follows_size_times_weight():
+	assert allocate_budget({'account': (100, 1), 'order_': (100, 3)}, 40) == {'account': 10, 'order_': 30}
+
+def test_budget_remainder_goes_to_largest_fractions():
+	# shares are 4.5, 2.7 and 1.8: the two objects left after rounding down go to order_ and ad, not account
+	assert allocate_budget({'account': (50, 1), 'order_': (30, 1), 'ad': (20, 1)}, 9) == {'account': 4, 'order_': 3, 'ad': 2}
+
+def test_budget_remainder_ties_split_one_each():
+	allocation = allocate_budget({'account': (10, 1), 'order_': (10, 1), 'ad': (10, 1)}, 10)
+	assert sorted(allocation.values()) == [3, 3, 4]
+
+def test_budget_a_capped_group_gives_up_what_it_cannot_use():
+	assert allocate_budget({'account': (2, 10), 'order_': (100, 1)}, 20) == {'account': 2, 'order_': 18}
+	assert allocate_budget({'account': (3, 1), 'order_': (4, 2)}, 100) == {'account': 3, 'order_': 4}
+
+def test_budget_skips_empty_and_unweighted_groups():
+	assert allocate_budget({'account': (0, 1), 'order_': (5, 0), 'ad': (5, 1)}, 3) == {'account': 0, 'order_': 0, 'ad': 3}
+	assert allocate_budget({'account': (5, 1)}, 0) == {'account': 0}
+	assert allocate_budget({}, 10) == {}
+
+def test_budget_is_spent_exactly_and_never_over_a_group():
+	rng = random.Random(3)
+	for i in range(500):
+		demands = dict((key, (rng.randint(0, 50), rng.choice([0, 0.5, 1, 2, 3]))) for key in range(rng.randint(1, 8)))
+		budget = rng.randint(0, 200)
+		allocation = allocate_budget(demands, budget)
+		usable = sum(size for (size, weight) in demands.values() if weight > 0)
+		assert sum(allocation.values()) == min(budget, usable)
+		assert all(0 <= allocation[key] <= demands[key][0] for key in demands)
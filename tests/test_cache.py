@@ -0,0 +1,125 @@
+import pickle
+import types
+import cache
+from cache import LRUCache, RedisBackend, ResponseCache, approx_size, dsn_fingerprint
+
+
+class Clock:
+	def __init__(self):
+		self.now = 1000.0
+
+	def __call__(self):
+		return self.now
+
+
+class FakeRedis:
+	def __init__(self):
+		self.values = {}
+
+	def mget(self, keys):
+		return [self.values.get(key) for key in keys]
+
+	def pipeline(self, transaction = True):
+		return self
+
+	def setex(self, key, ttl, value):
+		self.values[key] = value.encode('utf-8') if isinstance(value, str) else value
+
+	def execute(self):
+		pass
+
+
+def test_lru_evicts_least_recently_used():
+	value = "x" * 100
+	lru = LRUCache(3 * approx_size(value), 60)
+	lru.put_many({'a': value, 'b': value, 'c': value})
+	assert lru.get_many(['a']) == {'a': value} # a is now used more recently than b
+	lru.put_many({'d': value})
+	assert sorted(lru.get_many(['a', 'b', 'c', 'd'])) == ['a', 'c', 'd']
+	assert lru.bytes == 3 * approx_size(value)
+	lru.put_many({'huge': "x" * 1000}) # bigger than the whole cache, so not cached at all
+	assert lru.get_many(['huge']) == {}
+	assert len(lru.entries) == 3
+
+def test_lru_replacing_a_key_keeps_its_size_right():
+	lru = LRUCache(10000, 60)
+	lru.put_many({'a': "x" * 100})
+	lru.put_many({'a': "y"})
+	assert lru.bytes == approx_size("y")
+	assert lru.get_many(['a']) == {'a': "y"}
+
+def test_lru_entries_expire_after_ttl():
+	clock = Clock()
+	lru = LRUCache(10000, 60, clock=clock)
+	lru.put_many({'a': 1, 'b': None}) # None is a value too: an object known not to exist
+	clock.now += 59
+	assert lru.get_many(['a', 'b', 'c']) == {'a': 1, 'b': None}
+	assert (lru.hits, lru.misses) == (2, 1)
+	clock.now += 2
+	assert lru.get_many(['a', 'b']) == {}
+	assert lru.entries == {} and lru.bytes == 0
+	assert lru.flush() == 0
+
+def test_redis_backend_stores_json(monkeypatch):
+	client = FakeRedis()
+	monkeypatch.setattr(cache, 'redis', types.SimpleNamespace(Redis=types.SimpleNamespace(from_url=lambda url: client)))
+	backend = RedisBackend("redis://localhost:6379/0", "objviz:nodes:test:", 60)
+	backend.put_many({('info', 'account', '1'): ("Acme", "Active", "0", None), ('parents', 'site', 'account', '10'): ['1'], ('child_count', 'account', 'site', '1'): 2})
+	assert all(not value.startswith(b"\x80") for value in client.values.values()) # no pickles
+	assert backend.get_many([('info', 'account', '1'), ('parents', 'site', 'account', '10'), ('child_count', 'account', 'site', '1'), ('info', 'account', '2')]) == {
+		('info', 'account', '1'): ["Acme", "Active", "0", None], ('parents', 'site', 'account', '10'): ['1'], ('child_count', 'account', 'site', '1'): 2}
+
+def test_redis_backend_never_unpickles(monkeypatch):
+	client = FakeRedis()
+	monkeypatch.setattr(cache, 'redis', types.SimpleNamespace(Redis=types.SimpleNamespace(from_url=lambda url: client)))
+	backend = RedisBackend("redis://localhost:6379/0", "objviz:nodes:test:", 60)
+	client.values["objviz:nodes:test:" + repr(('info', 'account', '1'))] = pickle.dumps(("Acme", "Active", "0", None))
+	assert backend.get_many([('info', 'account', '1')]) == {} # a value it cannot decode is a miss
+
+def test_response_fresh_within_ttl():
+	clock = Clock()
+	responses = ResponseCache(10000, 60, 300, clock=clock)
+	key = (dsn_fingerprint("postgresql:///a"), 'account', '1')
+	responses.put(key, b"body")
+	assert responses.get(key) == (b"body", 0, 60)
+	clock.now += 59.5
+	assert responses.get(key) == (b"body", 59, 0)
+	assert responses.get(key[:2] + ('2',)) is None
+
+def test_response_stale_is_served_while_one_request_refreshes_it():
+	clock = Clock()
+	responses = ResponseCache(10000, 60, 300, clock=clock)
+	key = (dsn_fingerprint("postgresql:///a"), 'account', '1')
+	responses.put(key, b"old")
+	clock.now += 100
+	assert responses.get(key) == (b"old", 100, -40) # still served, but stale
+	assert responses.start_refresh(key)
+	assert not responses.start_refresh(key) # only the first request to see it stale refreshes it
+	assert responses.get(key) == (b"old", 100, -40)
+	responses.put(key, b"new")
+	responses.finish_refresh(key)
+	assert responses.get(key) == (b"new", 0, 60)
+	clock.now += 100
+	assert responses.start_refresh(key) # stale again, so it can be refreshed again
+
+def test_response_expired_after_stale_window():
+	clock = Clock()
+	responses = ResponseCache(10000, 60, 300, clock=clock)
+	key = (dsn_fingerprint("postgresql:///a"), 'account', '1')
+	responses.put(key, b"old")
+	clock.now += 360
+	assert responses.get(key) is None
+	assert responses.entries == {} and responses.bytes == 0
+
+def test_response_cache_size_limit_and_flush():
+	responses = ResponseCache(10, 60, 300, clock=Clock())
+	(a, b) = (dsn_fingerprint("postgresql:///a"), dsn_fingerprint("postgresql:///b"))
+	responses.put((a, '1'), b"12345")
+	responses.put((b, '1'), b"12345")
+	responses.get((a, '1'))
+	responses.put((a, '2'), b"123")
+	assert sorted(responses.entries) == [(a, '1'), (a, '2')]
+	responses.put((a, '3'), b"x" * 11) # bigger than the whole cache
+	assert (a, '3') not in responses.entries
+	assert responses.flush("postgresql:///a") == 2
+	assert responses.bytes == 0
@@ -0,0 +1,41 @@
+import json
+from discovery import pointer_target
+from schema import SchemaGraph, key_obj_type
+
+
+TABLES = {'account', 'buyer', 'adunit', 'order_', 'user_', 'lineitem', 'deal'}
+
+def test_key_obj_type_follows_convention_and_exceptions():
+	assert key_obj_type('adunit_id') == 'adunit'
+	assert key_obj_type('adunit_ids') == 'adunit'
+	assert key_obj_type('order_id') == 'order_'
+	assert key_obj_type('partner_id') == 'account'
+	assert key_obj_type('demand_partner_ids') == 'account'
+	assert key_obj_type('openx_buyer_id') == 'buyer'
+
+def test_pointer_target_agrees_with_key_obj_type():
+	assert pointer_target('adunit_id', TABLES) == ('adunit', False)
+	assert pointer_target('adunit_ids', TABLES) == ('adunit', True)
+	assert pointer_target('user_id', TABLES) == ('user_', False)
+	assert pointer_target('partner_id', TABLES) == ('account', False)
+	assert pointer_target('demand_partner_id', TABLES) == ('account', False)
+	assert pointer_target('openx_buyer_ids', TABLES) == ('buyer', True)
+	assert pointer_target('site_id', TABLES) is None
+	assert pointer_target('name', TABLES) is None
+	assert pointer_target('_id', TABLES) is None
+
+def test_catalog_edge_keys_are_per_edge(tmp_path):
+	edges = [
+		{'child': 'lineitem', 'parent': 'account', 'key': 'account_id', 'keys': 'account_ids'},
+		{'child': 'deal', 'parent': 'account', 'key': 'demand_partner_id', 'keys': 'demand_partner_ids'},
+		{'child': 'deal', 'parent': 'buyer', 'key': 'openx_buyer_id', 'keys': 'openx_buyer_ids'},
+	]
+	path = tmp_path / "edges.json"
+	path.write_text(json.dumps({'edges': edges}))
+	schema = SchemaGraph(str(path))
+	assert schema.id_key('account', child_type='lineitem') == 'account_id'
+	assert schema.id_key('account', child_type='deal') == 'demand_partner_id'
+	assert schema.id_key('account', plural=True, child_type='deal') == 'demand_partner_ids'
+	assert schema.id_key('buyer', child_type='deal') == 'openx_buyer_id'
+	assert schema.id_key('account') == 'account_id' # a field one edge names does not change the others'
+	assert schema.key_types['demand_partner_id'] == 'account'
@@ -0,0 +1,22 @@
+import edgetable
+from edgetable import edge_table_ready, forget_edge_table
+
+
+def test_edge_table_check_is_cached_per_database(monkeypatch):
+	monkeypatch.setattr(edgetable, 'edge_checks', {})
+	checks = []
+	def check(answer):
+		return lambda: checks.append(answer) or answer
+	assert not edge_table_ready("postgresql:///a", check(False))
+	assert not edge_table_ready("postgresql:///a", check(True)) # the first answer holds until it expires
+	assert edge_table_ready("postgresql:///b", check(True))
+	assert checks == [False, True]
+	forget_edge_table("postgresql:///a") # as installing the table does
+	assert edge_table_ready("postgresql:///a", check(True))
+	assert checks == [False, True, True]
+
+def test_edge_table_check_expires(monkeypatch):
+	monkeypatch.setattr(edgetable, 'edge_checks', {})
+	monkeypatch.setattr(edgetable, 'EDGE_CHECK_TTL', 0)
+	assert not edge_table_ready("postgresql:///a", lambda: False)
+	assert edge_table_ready("postgresql:///a", lambda: True) # another process installed it
@@ -0,0 +1,96 @@
+import base64
+import json
+import os
+import pytest
+import psycopg2 as pcg2
+
+
+URI = os.environ.get('OBJVIZ_TEST_URI') # a database holding the tables in connections.txt; the tests that need one are skipped without it
+
+pytestmark = pytest.mark.skipif(URI is None, reason="set OBJVIZ_TEST_URI to a database to run the expand tests")
+
+
+@pytest.fixture(scope='module')
+def client():
+	import api
+	return api.app.test_client()
+
+def start_objects():
+	if URI is None:
+		return []
+	con = pcg2.connect(URI)
+	try:
+		cur = con.cursor()
+		found = []
+		for obj_type in ['account', 'adunit', 'order_']:
+			cur.execute("SELECT obj->>'id' FROM " + obj_type + " WHERE obj->>'id' IS NOT NULL ORDER BY obj->>'id' LIMIT 1")
+			found += [(obj_type, r[0]) for r in cur.fetchall()]
+		return found
+	finally:
+		con.close()
+
+def stream_layers(client, obj_type, obj_id, depth_limit):
+	response = client.get('/api/getNetwork', query_string={'uri': URI, 'type': obj_type, 'id': obj_id, 'depthLimit': depth_limit, 'objectLimit': 100000, 'stream': 'true', 'sqlQueries': 'false'}, headers={'Cache-Control': 'no-cache'})
+	messages = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+	return [message for message in messages if message['type'] == 'layer']
+
+def merge_layer(network, nodes, edges):
+	for (index, node) in nodes.items():
+		network[int(index)] = dict(node, pointers_from=list(node['pointers_from']))
+	for (node, pointer) in edges:
+		network[node]['pointers_from'].append(pointer)
+
+def canonical(network):
+	return dict((int(index), (node['type'], node['id'], sorted(node['pointers_from']))) for (index, node) in network.items())
+
+@pytest.mark.parametrize('chunk', [1000, 40])
+@pytest.mark.parametrize('depth', [1, 2])
+@pytest.mark.parametrize('start', start_objects())
+def test_expand_merges_into_next_depth(client, start, depth, chunk):
+	(obj_type, obj_id) = start
+	layers = stream_layers(client, obj_type, obj_id, depth)
+	network = {}
+	for layer in layers:
+		merge_layer(network, layer['nodes'], layer['edges'])
+	frontier = [node['type'] + " " + node['id'] for node in layers[-1]['nodes'].values()] if len(layers) > depth else []
+	if len(frontier) == 0:
+		pytest.skip("the whole neighborhood is already in the network")
+	added = [] # objects earlier chunks found, which are one step further out and so not expanded either
+	for i in range(0, len(frontier), chunk):
+		known = [network[index]['type'] + " " + network[index]['id'] for index in range(len(network))]
+		indices = dict((key, index) for (index, key) in enumerate(known))
+		body = {'uri': URI, 'nodes': dict((key, indices[key]) for key in frontier[i:i + chunk]), 'known': known, 'unexpanded': frontier[i + chunk:] + added, 'objectLimit': 100000}
+		response = client.post('/api/expand', json=body)
+		found = response.get_json()
+		assert response.status_code == 200, found
+		merge_layer(network, found['nodes'], found['edges']) # no deduplication: the response must only hold what the client lacks
+		assert found['next'] == len(network)
+		added += [node['type'] + " " + node['id'] for node in found['nodes'].values()]
+
+	deeper = client.get('/api/getNetwork', query_string={'uri': URI, 'type': obj_type, 'id': obj_id, 'depthLimit': depth + 1, 'objectLimit': 100000, 'sqlQueries': 'false'}, headers={'Cache-Control': 'no-cache'})
+	assert canonical(network) == canonical(deeper.get_json()['network'])
+
+@pytest.mark.parametrize('start', start_objects())
+def test_expand_names_bloom_false_positives_by_key(client, start):
+	from api import MAX_EXPAND_NODES
+	(obj_type, obj_id) = start
+	layers = stream_layers(client, obj_type, obj_id, 1)
+	network = {}
+	for layer in layers:
+		merge_layer(network, layer['nodes'], layer['edges'])
+	held = set(node['type'] + " " + node['id'] for node in network.values())
+	deeper = client.get('/api/getNetwork', query_string={'uri': URI, 'type': obj_type, 'id': obj_id, 'depthLimit': 2, 'objectLimit': 100000, 'sqlQueries': 'false'}, headers={'Cache-Control': 'no-cache'})
+	missing = set(node['type'] + " " + node['id'] for node in deeper.get_json()['network'].values()) - held
+	if len(missing) == 0:
+		pytest.skip("the whole neighborhood is already in the network")
+	frontier = dict((node['type'] + " " + node['id'], int(index)) for (index, node) in layers[-1]['nodes'].items())
+	if len(frontier) > MAX_EXPAND_NODES:
+		pytest.skip("the frontier is too large to expand in one request")
+	body = {'uri': URI, 'nodes': frontier, 'bloom': {'bits': base64.b64encode(b'\xff' * 64).decode(), 'hashes': 4}, 'unexpanded': sorted(missing), 'next': len(network), 'objectLimit': 100000}
+	response = client.post('/api/expand', json=body)
+	found = response.get_json()
+	assert response.status_code == 200, found
+	# a filter of all ones claims to hold every object, so nothing is new and each object the client does not have is named by its key
+	assert found['nodes'] == {}
+	assert found['next'] == len(network)
+	assert set(end for edge in found['edges'] for end in edge if isinstance(end, str)) == missing
@@ -0,0 +1,61 @@
+import psycopg2 as pcg2
+import pytest
+from api import ObjectTree
+from queries import ObjectNotFound
+from snapshot import Snapshot, SnapshotSource
+from test_bloom import bloom_filter
+
+
+TABLES = {
+	'account': [('1', 'Acme', 'Active', '0', None)],
+	'site': [('10', 'Home', 'Active', '0', None, '1', None), ('11', 'Blog', 'Active', '0', None, '1', None)],
+	'adunit': [('100', 'Top', 'Active', '0', None, '10', None), ('101', 'Side', 'Active', '0', None, '11', None), ('102', 'Foot', 'Active', '0', None, '10', None)],
+}
+
+
+@pytest.fixture
+def tree(fake_snapshot):
+	(schema_path, meta, path) = fake_snapshot("site -> account\nadunit -> site\n", TABLES)
+	return ObjectTree("postgresql:///objviz", schema_path, snapshot=SnapshotSource(Snapshot(path)))
+
+def by_key(nodes):
+	return dict((node['type'] + " " + node['id'], int(index)) for (index, node) in nodes.items())
+
+def test_expand_sends_only_what_the_client_lacks(tree):
+	# the client holds account 1 expanded one layer deep: account 1 (0), site 10 (1) and site 11 (2)
+	lookups = []
+	fetch_node_infos = tree.fetch_node_infos
+	tree.fetch_node_infos = lambda obj_type, obj_ids, cur = None: lookups.append(obj_type) or fetch_node_infos(obj_type, obj_ids)
+	(nodes, edges, found_known) = tree.expand_known(['site 10', 'site 11'], {'account 1': 0, 'site 10': 1, 'site 11': 2}, 3, 100)
+	assert lookups.count('site') == 1 # the objects to expand are looked up in one query per type, not one each
+	index = by_key(nodes)
+	assert sorted(index.values()) == [3, 4, 5]
+	assert sorted(index) == ['adunit 100', 'adunit 101', 'adunit 102']
+	assert sorted(edges) == sorted([[1, index['adunit 100']], [1, index['adunit 102']], [2, index['adunit 101']]]) # not account 1's edges to the sites, which its expansion found
+	assert found_known == 1
+
+def test_expand_resends_edges_of_unexpanded_objects(tree):
+	(nodes, edges, found_known) = tree.expand_known(['site 10', 'site 11'], {'account 1': 0, 'site 10': 1, 'site 11': 2}, 3, 100, unexpanded={'account 1'})
+	assert [0, 1] in edges and [0, 2] in edges
+	assert len(edges) == 5
+
+def test_expand_names_bloom_hits_by_key(tree):
+	# the client numbered only the sites it expands; the Bloom filter says it also holds account 1, expanded, and adunit 101, not yet expanded
+	bloom = (bloom_filter(['account 1', 'adunit 101'], 8 * 64, 4), 4)
+	(nodes, edges, found_known) = tree.expand_known(['site 10', 'site 11'], {'site 10': 1, 'site 11': 2}, 3, 100, bloom=bloom, unexpanded={'adunit 101'})
+	index = by_key(nodes)
+	assert sorted(index) == ['adunit 100', 'adunit 102']
+	assert sorted(index.values()) == [3, 4]
+	assert sorted(edges, key=str) == sorted([[1, index['adunit 100']], [1, index['adunit 102']], [2, 'adunit 101']], key=str)
+	assert found_known == 2
+
+def test_expand_of_a_missing_object(tree):
+	with pytest.raises(ObjectNotFound):
+		tree.expand_known(['site 10', 'site 12'], {'site 10': 0, 'site 12': 1}, 2, 100)
+
+def test_expand_stops_at_the_deadline(tree):
+	def cancelled(obj_type, obj_ids, cur = None):
+		raise pcg2.extensions.QueryCanceledError("canceling statement due to user request")
+	tree.fetch_node_infos = cancelled
+	assert tree.expand_known(['site 10'], {'site 10': 0}, 1, 100) == ({}, [], 0)
+	assert tree.truncated == 'deadline'
@@ -0,0 +1,63 @@
+import random
+from graphstore import GraphStore
+
+
+def info(deleted = "0", type_full = None):
+	return ("name", "Active", deleted, type_full)
+
+def test_duplicate_edges_are_kept_once():
+	store = GraphStore()
+	a = store.add_node('account', '1', info())
+	b = store.add_node('order_', '2', info())
+	assert store.add_edge(a, b)
+	assert not store.add_edge(a, b)
+	assert store.add_edge(b, a)
+	assert store.edge_count() == 2
+	assert store.find('order_', '2') == b
+	assert store.find('order_', '3') is None
+	assert store.find('ad', '2') is None
+
+def test_csr_matches_edges_as_the_store_grows():
+	rng = random.Random(7)
+	store = GraphStore()
+	expected = {}
+	sent = {} # what the network sent in pieces holds so far
+	(first_node, first_edge) = (0, 0)
+	for step in range(20):
+		for i in range(rng.randint(0, 60)): # sometimes a piece adds no nodes, only edges
+			node = store.add_node(rng.choice(['account', 'order_', 'lineitem']), str(len(store)), info())
+			expected[node] = []
+		for i in range(rng.randint(0, 200)):
+			(node, pointer) = (rng.randrange(len(store)), rng.randrange(len(store))) if len(store) > 0 else (None, None)
+			if node is not None and store.add_edge(node, pointer):
+				expected[node].append(pointer)
+		(network, old_edges) = store.to_network(first_node, first_edge)
+		assert sorted(network) == list(range(first_node, len(store)))
+		for (node, pointer) in old_edges:
+			assert node < first_node
+			sent[node]['pointers_from'].append(pointer)
+		sent.update(network)
+		(first_node, first_edge) = (len(store), store.edge_count())
+	assert dict((node, n['pointers_from']) for (node, n) in sent.items()) == expected # each node's pointers stay in the order they were added
+	assert dict((node, n['pointers_from']) for (node, n) in store.to_network()[0].items()) == expected
+
+	columns = store.to_columns()
+	offsets = columns['pointer_offsets']
+	assert len(offsets) == len(store) + 1
+	assert [columns['pointers'][offsets[node]:offsets[node + 1]] for node in range(len(store))] == [expected[node] for node in range(len(store))]
+	assert [columns['types'][code] for code in columns['type']] == [store.type_of(node) for node in range(len(store))]
+
+def test_empty_store():
+	store = GraphStore()
+	assert store.to_network() == ({}, [])
+	assert store.to_columns()['pointer_offsets'] == [0]
+
+def test_live_counts_skip_deleted_nodes():
+	store = GraphStore()
+	store.add_node('account', '1', info(type_full='account.publisher'))
+	store.add_node('account', '2', info(type_full='account.publisher'))
+	store.add_node('account', '3', info(deleted="1", type_full='account.publisher'))
+	store.add_node('order_', '4', info())
+	assert store.live_type_counts() == ({'account': 2, 'order_': 1}, {('account', 'account.publisher'): 2, ('order_', None): 1})
+	network = store.to_network()[0]
+	assert network[2]['deleted'] == "1" and network[2]['type_full'] == 'account.publisher'
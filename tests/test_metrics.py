@@ -0,0 +1,46 @@
+from metrics import Metrics, DURATION_BUCKETS
+
+
+def test_render_counters():
+	metrics = Metrics()
+	metrics.inc('objviz_requests_total', endpoint='getNetwork', status='200')
+	metrics.inc('objviz_requests_total', endpoint='getNetwork', status='200')
+	metrics.inc('objviz_requests_total', endpoint='expand', status='404')
+	metrics.inc('objviz_query_seconds_total', 0.25, kind='children', edge='site -> account')
+	metrics.inc('objviz_custom_total')
+	assert metrics.render() == "\n".join([
+		'# HELP objviz_custom_total objviz_custom_total',
+		'# TYPE objviz_custom_total untyped',
+		'objviz_custom_total 1',
+		'# HELP objviz_query_seconds_total Time spent executing statements and fetching their rows, by kind and edge',
+		'# TYPE objviz_query_seconds_total counter',
+		'objviz_query_seconds_total{edge="site -> account",kind="children"} 0.25',
+		'# HELP objviz_requests_total Requests handled, by endpoint and status',
+		'# TYPE objviz_requests_total counter',
+		'objviz_requests_total{endpoint="expand",status="404"} 1',
+		'objviz_requests_total{endpoint="getNetwork",status="200"} 2',
+	]) + "\n"
+
+def test_render_escapes_label_values():
+	metrics = Metrics()
+	metrics.inc('objviz_queries_total', kind='children', edge='a "quoted" \\ edge\nnext')
+	assert 'objviz_queries_total{edge="a \\"quoted\\" \\\\ edge\\nnext",kind="children"} 1\n' in metrics.render()
+
+def test_render_histogram():
+	metrics = Metrics()
+	for value in [0.001, 0.005, 0.3, 100]:
+		metrics.observe('objviz_request_duration_seconds', value, endpoint='getNetwork')
+	lines = metrics.render().splitlines()
+	assert lines[:2] == ['# HELP objviz_request_duration_seconds Time to produce each response, by endpoint (streamed responses stop at the first byte)', '# TYPE objviz_request_duration_seconds histogram']
+	buckets = [line for line in lines if line.startswith('objviz_request_duration_seconds_bucket')]
+	assert len(buckets) == len(DURATION_BUCKETS) + 1
+	assert buckets[0] == 'objviz_request_duration_seconds_bucket{endpoint="getNetwork",le="0.005"} 2' # an observation on a bound counts in its bucket
+	assert buckets[DURATION_BUCKETS.index(0.25)].endswith('le="0.25"} 2')
+	assert buckets[DURATION_BUCKETS.index(0.5)].endswith('le="0.5"} 3') # buckets are cumulative
+	assert buckets[-2].endswith('le="30"} 3')
+	assert buckets[-1] == 'objviz_request_duration_seconds_bucket{endpoint="getNetwork",le="+Inf"} 4'
+	assert 'objviz_request_duration_seconds_sum{endpoint="getNetwork"} 100.306' in lines
+	assert 'objviz_request_duration_seconds_count{endpoint="getNetwork"} 4' in lines
+
+def test_render_nothing():
+	assert Metrics().render() == "\n"
@@ -0,0 +1,103 @@
+import hashlib
+import json
+import os
+import pytest
+import api
+from api import objects_etag
+
+
+OBJECTS = {
+	('account', '1'): {'id': '1', 'name': 'Acme', 'status': 'Active', 'deleted': '0'},
+	('site', '10'): {'id': '10', 'name': 'Home', 'status': 'Active', 'account_id': '1'},
+}
+
+
+class StubTree: # answers query_objects_info from OBJECTS the way the objects and object_fields statements do
+	fields = []
+
+	def __init__(self, database_url, file_path):
+		pass
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		pass
+
+	def query_objects_info(self, objs, fields = None):
+		StubTree.fields.append(fields)
+		(infos, hashes) = ({}, {})
+		for (obj_type, obj_id) in objs:
+			obj = OBJECTS.get((obj_type, obj_id))
+			key = obj_type + " " + obj_id
+			hashes[key] = hashlib.md5(json.dumps(obj, sort_keys=True).encode('utf-8')).hexdigest() if obj is not None else None
+			infos[key] = obj if obj is None or fields is None else dict((field, obj[field]) for field in fields if field in obj)
+		return (infos, hashes)
+
+
+@pytest.fixture
+def client(monkeypatch):
+	monkeypatch.setattr(api, 'ObjectTree', StubTree)
+	StubTree.fields = []
+	return api.app.test_client()
+
+def post(client, objects, fields = None, etag = None):
+	query = {'uri': 'postgresql:///objviz'}
+	if fields is not None:
+		query['fields'] = fields
+	headers = {'If-None-Match': '"' + etag + '"'} if etag is not None else {}
+	return client.post('/api/getObjectsInfo', query_string=query, json={'objects': objects}, headers=headers)
+
+def test_etag_follows_objects_and_fields():
+	hashes = {'account 1': 'a', 'site 10': 'b', 'site 11': None}
+	assert objects_etag(None, hashes) == objects_etag(None, dict(reversed(list(hashes.items())))) # the order objects were asked for in does not matter
+	assert objects_etag(None, hashes) != objects_etag(None, dict(hashes, **{'site 10': 'c'}))
+	assert objects_etag(None, hashes) != objects_etag(None, dict(hashes, **{'site 12': None}))
+	assert objects_etag(None, hashes) != objects_etag(['name'], hashes)
+	assert objects_etag(['name'], hashes) != objects_etag(['name', 'status'], hashes)
+
+def test_objects_info_and_revalidation(client):
+	response = post(client, [{'type': 'account', 'id': 1}, "site 10", "site 11"])
+	assert response.status_code == 200
+	assert response.get_json() == {'account 1': OBJECTS[('account', '1')], 'site 10': OBJECTS[('site', '10')], 'site 11': None}
+	etag = response.get_etag()[0]
+	assert response.headers['Cache-Control'] == 'no-cache'
+
+	unchanged = post(client, ["site 11", "site 10", "account 1"], etag=etag)
+	assert unchanged.status_code == 304
+	assert unchanged.get_data() == b""
+	assert unchanged.get_etag()[0] == etag
+
+	OBJECTS[('site', '10')]['status'] = 'Paused'
+	try:
+		changed = post(client, ["account 1", "site 10", "site 11"], etag=etag)
+	finally:
+		OBJECTS[('site', '10')]['status'] = 'Active'
+	assert changed.status_code == 200
+	assert changed.get_etag()[0] != etag
+	assert changed.get_json()['site 10']['status'] == 'Paused'
+
+def test_objects_info_fields(client):
+	response = post(client, ["account 1", "site 10"], fields="name,account_id,")
+	assert StubTree.fields == [['name', 'account_id']]
+	assert response.get_json() == {'account 1': {'name': 'Acme'}, 'site 10': {'name': 'Home', 'account_id': '1'}}
+	whole = post(client, ["account 1", "site 10"], etag=response.get_etag()[0])
+	assert whole.status_code == 200 # the same objects, but whole, are a different response
+
+def test_objects_info_rejects_bad_bodies(client):
+	assert client.post('/api/getObjectsInfo', query_string={'uri': 'postgresql:///objviz'}, json={}).status_code == 400
+	assert post(client, ["account"]).status_code == 400
+	assert post(client, [{'type': 'account'}]).status_code == 400
+	assert post(client, ["account " + str(i) for i in range(api.MAX_INFO_OBJECTS + 1)]).status_code == 400
+	assert StubTree.fields == []
+
+@pytest.mark.skipif(os.environ.get('OBJVIZ_TEST_URI') is None, reason="set OBJVIZ_TEST_URI to a database to run the projection test")
+def test_objects_info_fields_in_the_database():
+	with api.ObjectTree(os.environ['OBJVIZ_TEST_URI'], api.SCHEMA_PATH) as tree:
+		tree.cur.execute("SELECT obj->>'id' FROM account WHERE obj->>'id' IS NOT NULL ORDER BY obj->>'id' LIMIT 1")
+		key = "account " + tree.cur.fetchone()[0]
+		objs = [tuple(key.split()), ('account', 'nosuchid')]
+		(whole, hashes) = tree.query_objects_info(objs)
+		(projected, projected_hashes) = tree.query_objects_info(objs, ['name', 'nosuchfield'])
+	assert projected == {key: {'name': whole[key]['name']} if 'name' in whole[key] else {}, 'account nosuchid': None}
+	assert projected_hashes == hashes # the hash is of the whole stored object, so the ETag changes even when an unprojected field does
@@ -0,0 +1,107 @@
+import hashlib
+import psycopg2
+import pytest
+from schema import SchemaGraph
+from queries import QueryBuilder, Statement, UnknownTable
+
+
+class FakeConnection:
+	def __init__(self):
+		self.prepared = set()
+
+
+class FakeCursor: # records what a statement runs, and fails once the way a reset session or a second PREPARE would
+	def __init__(self, connection = None):
+		self.connection = connection or FakeConnection()
+		self.executed = []
+		self.lose_prepared = False
+		self.already_prepared = False
+
+	def execute(self, sql, params = None):
+		self.executed.append((sql, params))
+		if sql.startswith("PREPARE") and self.already_prepared:
+			self.already_prepared = False
+			raise psycopg2.errors.DuplicatePreparedStatement("prepared statement already exists")
+		if sql.startswith("EXECUTE") and self.lose_prepared:
+			self.lose_prepared = False
+			raise psycopg2.errors.InvalidSqlStatementName("prepared statement does not exist")
+
+
+@pytest.fixture
+def schema(tmp_path):
+	path = tmp_path / "connections.txt"
+	path.write_text("site -> account\nadunit -> site\nadunit -> account\norder_ -> account\nlineitem -> order_\nad -> lineitem\n")
+	return SchemaGraph(str(path))
+
+def test_statement_is_named_after_its_sql():
+	statement = Statement("SELECT obj FROM account WHERE obj->>'id' = $1", ['text'])
+	assert statement.name == "objviz_" + hashlib.md5(statement.sql.encode('utf-8')).hexdigest()[:16]
+	assert Statement(statement.sql, ['text']).name == statement.name
+	assert Statement("SELECT obj FROM site WHERE obj->>'id' = $1", ['text']).name != statement.name
+
+def test_statement_is_prepared_once_per_connection():
+	statement = Statement("SELECT obj FROM account WHERE obj->>'id' = ANY($1) AND obj->>'status' = $2", ['text[]', 'text'])
+	cur = FakeCursor()
+	statement.execute(cur, (['1', '2'], 'Active'))
+	statement.execute(cur, (['3'], 'Active'))
+	assert cur.executed == [("PREPARE " + statement.name + " (text[], text) AS " + statement.sql, None),
+		("EXECUTE " + statement.name + " (%s, %s)", (['1', '2'], 'Active')),
+		("EXECUTE " + statement.name + " (%s, %s)", (['3'], 'Active'))]
+	assert cur.connection.prepared == {statement.name}
+
+	other = FakeCursor()
+	statement.execute(other, (['1'], 'Active'))
+	assert other.executed[0][0].startswith("PREPARE " + statement.name)
+
+def test_statement_is_prepared_again_after_a_session_reset():
+	statement = Statement("SELECT obj FROM account WHERE obj->>'id' = $1", ['text'])
+	cur = FakeCursor()
+	statement.execute(cur, ('1',))
+	cur.lose_prepared = True
+	statement.execute(cur, ('2',))
+	assert [sql.split()[0] for (sql, params) in cur.executed] == ["PREPARE", "EXECUTE", "EXECUTE", "PREPARE", "EXECUTE"]
+	assert cur.executed[-1] == ("EXECUTE " + statement.name + " (%s)", ('2',))
+
+def test_statement_already_prepared_on_the_connection_is_reused():
+	statement = Statement("SELECT obj FROM account WHERE obj->>'id' = $1", ['text'])
+	cur = FakeCursor()
+	cur.already_prepared = True
+	statement.execute(cur, ('1',))
+	assert cur.connection.prepared == {statement.name}
+	assert cur.executed[-1] == ("EXECUTE " + statement.name + " (%s)", ('1',))
+
+def test_builder_only_has_statements_for_tables(schema):
+	builder = QueryBuilder(schema, ['account', 'site', 'adunit', 'order_', 'ad'])
+	for obj_type in ['account', 'site', 'adunit', 'order_', 'ad']:
+		for kind in ['object', 'node_infos', 'objects', 'object_fields']:
+			assert builder.get(kind, obj_type).kind == kind
+	assert builder.get('parent_ids', 'adunit').edge == "adunit -> account,site"
+	assert builder.get('children', 'account', 'site').edge == "site -> account"
+	assert builder.get('plural_children', 'site', 'adunit').kind == 'plural_children'
+	with pytest.raises(UnknownTable):
+		builder.get('node_infos', 'lineitem')
+	with pytest.raises(UnknownTable):
+		builder.get('children', 'lineitem', 'ad') # the parent has no table
+	with pytest.raises(UnknownTable):
+		builder.get('parent_ids', 'ad') # its only parent has no table
+	with pytest.raises(UnknownTable):
+		builder.get('children', 'site', 'account') # not an edge of the graph
+	assert not any('lineitem' in key for key in builder.statements)
+
+def test_builder_statements_bind_every_value(schema):
+	builder = QueryBuilder(schema, ['account', 'site', 'adunit', 'order_', 'lineitem', 'ad'])
+	names = {}
+	for (key, statement) in builder.statements.items():
+		assert statement.kind == key[0]
+		assert "%s" not in statement.sql
+		for i in range(1, len(statement.param_types) + 1):
+			assert "$" + str(i) in statement.sql
+		assert "$" + str(len(statement.param_types) + 1) not in statement.sql
+		names.setdefault(statement.name, set()).add(statement.sql)
+	assert all(len(sqls) == 1 for sqls in names.values()) # no two different statements share a name
+	assert builder.get('traversal').param_types == ['text', 'text', 'int', 'int']
+
+def test_builders_for_the_same_graph_name_statements_alike(schema):
+	first = QueryBuilder(schema, ['account', 'site', 'adunit'])
+	second = QueryBuilder(schema, ['adunit', 'site', 'account'])
+	assert dict((key, s.name) for (key, s) in first.statements.items()) == dict((key, s.name) for (key, s) in second.statements.items())
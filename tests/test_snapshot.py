@@ -0,0 +1,39 @@
+import pytest
+from queries import UnknownTable
+from snapshot import Snapshot, SnapshotSource
+
+
+TABLES = { # table -> rows of id, name, status, deleted, type_full, then each parent's single and plural id fields
+	'account': [('1', 'Acme', 'Active', '0', 'account.publisher'), ('2', None, 'Active', '1', None), ('3', '', 'Inactive', '0', None)],
+	'site': [('10', 'Home', 'Active', '0', None, '1', None), ('11', 'Blog', 'Active', '0', None, None, '["1", "2"]'), ('11', 'Copy', 'Active', '0', None, '3', None), (None, 'No id', 'Active', '0', None, '1', None)],
+	'adunit': [('100', 'Banner', 'Active', '0', None, '10', None)],
+}
+
+
+@pytest.fixture
+def built(fake_snapshot):
+	(schema_path, meta, path) = fake_snapshot("site -> account\nadunit -> site\n", TABLES)
+	return (meta, Snapshot(path))
+
+def test_snapshot_round_trip(built):
+	(meta, snap) = built
+	assert meta['nodes'] == 6 # the copy of site 11 and the object without an id are skipped
+	assert snap.find('nosuchtype', '1') is None
+	assert snap.find('account', '4') is None
+	account = snap.find('account', '1')
+	assert snap.obj_id(account) == '1'
+	assert snap.info(account) == ('Acme', 'Active', '0', 'account.publisher')
+	assert snap.info(snap.find('account', '2')) == (None, 'Active', '1', None) # a missing name stays null, as node_infos gives it
+	assert snap.info(snap.find('account', '3')) == ('', 'Inactive', '0', None)
+	assert snap.info(snap.find('site', '11'))[0] == 'Blog'
+
+def test_snapshot_source_answers_lookups(built):
+	source = SnapshotSource(built[1])
+	assert source.fetch_node_infos('account', ['1', '2', '4']) == {'1': ('Acme', 'Active', '0', 'account.publisher'), '2': (None, 'Active', '1', None)}
+	assert source.fetch_parent_ids('site', ['10', '11'], 'account') == {'10': ['1'], '11': ['1', '2']}
+	children = source.fetch_children('account', ['1', '2'], 'site')
+	assert dict((obj_id, [r[0] for r in rows]) for (obj_id, rows) in children.items()) == {'1': ['10']} # site 11 points through its map of ids, which only the child's side sees
+	assert source.fetch_children('site', ['10'], 'adunit') == {'10': [('100', 'Banner', 'Active', '0', None)]}
+	assert source.has_table('adunit') and not source.has_table('ad')
+	with pytest.raises(UnknownTable):
+		source.fetch_node_infos('ad', ['1'])
@@ -0,0 +1,41 @@
+import os
+import pytest
+
+
+URI = os.environ.get('OBJVIZ_TEST_URI') # a database holding the tables in connections.txt; the tests that need one are skipped without it
+
+pytestmark = pytest.mark.skipif(URI is None, reason="set OBJVIZ_TEST_URI to a database to run the source tests")
+
+
+@pytest.fixture(scope='module')
+def client():
+	import api
+	from schema import load_schema, SCHEMA_PATH
+	from snapshot import build_snapshot, snapshot_path
+	if not os.path.exists(snapshot_path(URI)):
+		with api.ObjectTree(URI, SCHEMA_PATH) as tree:
+			tables = tree.get_tables()
+		build_snapshot(URI, load_schema(SCHEMA_PATH), tables, snapshot_path(URI))
+	return api.app.test_client()
+
+def get_network(client, source, obj_type, obj_id):
+	return client.get('/api/getNetwork', query_string={'uri': URI, 'type': obj_type, 'id': obj_id, 'depthLimit': 2, 'objectLimit': 100, 'source': source}, headers={'Cache-Control': 'no-cache'})
+
+
+@pytest.mark.parametrize('source', ['db', 'snapshot'])
+def test_unknown_type_is_a_bad_request(client, source):
+	response = get_network(client, source, 'nosuchtype', '1')
+	assert response.status_code == 400
+	assert response.get_json()['error']['type'] == 'UnknownObjectType'
+
+@pytest.mark.parametrize('source', ['db', 'snapshot'])
+def test_missing_object_is_not_found(client, source):
+	response = get_network(client, source, 'account', 'nosuchid')
+	assert response.status_code == 404
+	assert response.get_json()['error']['type'] == 'ObjectNotFound'
+
+def test_expand_answers_alike_from_both_sources(client):
+	for (nodes, status) in [({'nosuchtype 1': 0}, 400), ({'account nosuchid': 0}, 404)]:
+		errors = [client.post('/api/expand', json={'uri': URI, 'nodes': nodes, 'source': source}) for source in ['db', 'snapshot']]
+		assert [response.status_code for response in errors] == [status, status]
+		assert errors[0].get_json()['error']['type'] == errors[1].get_json()['error']['type']
@@ -0,0 +1,110 @@
+import gzip
+import json
+import pytest
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header
+import wire
+from graphstore import GraphStore
+
+
+def accept(header):
+	return parse_accept_header(header, MIMEAccept)
+
+def network_body():
+	store = GraphStore()
+	account = store.add_node('account', '1', ("Acme", "Active", "0", "account.publisher"))
+	site = store.add_node('site', '10', (None, "Active", "0", None))
+	store.add_edge(account, site)
+	return {'network': store.to_columns(), 'max_depth': 1, 'statistics': {'objects': 2}}
+
+def test_negotiate_format_prefers_json():
+	assert wire.negotiate_format(accept('*/*')) == 'json'
+	assert wire.negotiate_format(accept('text/html')) == 'json'
+	assert wire.negotiate_format(accept('')) == 'json'
+
+def test_negotiate_format_picks_binary_formats_when_installed(monkeypatch):
+	pytest.importorskip('msgpack')
+	pytest.importorskip('pyarrow')
+	assert wire.negotiate_format(accept('application/msgpack')) == 'msgpack'
+	assert wire.negotiate_format(accept('application/x-msgpack')) == 'msgpack'
+	assert wire.negotiate_format(accept('application/vnd.apache.arrow.stream, application/json;q=0.5')) == 'arrow'
+	assert wire.negotiate_format(accept('application/msgpack;q=0.5, application/json')) == 'json'
+	monkeypatch.setattr(wire, 'msgpack', None)
+	assert 'msgpack' not in wire.available_formats()
+	assert wire.negotiate_format(accept('application/msgpack')) == 'json'
+
+def test_encode_json_and_columns():
+	body = network_body()
+	decoded = json.loads(wire.encode_body(body, 'columns'))
+	assert decoded == json.loads(json.dumps(body))
+	columns = decoded['network']
+	assert [columns['types'][code] for code in columns['type']] == ['account', 'site']
+	assert columns['pointers'][columns['pointer_offsets'][0]:columns['pointer_offsets'][1]] == [1]
+	assert [columns['values'][code] for code in columns['type_full']] == ['account.publisher', None]
+
+def test_encode_msgpack_round_trip():
+	msgpack = pytest.importorskip('msgpack')
+	body = network_body()
+	assert msgpack.unpackb(wire.encode_body(body, 'msgpack'), raw=False) == body
+
+def test_encode_arrow_round_trip():
+	pyarrow = pytest.importorskip('pyarrow')
+	pytest.importorskip('pyarrow.ipc')
+	body = network_body()
+	table = pyarrow.ipc.open_stream(wire.encode_body(body, 'arrow')).read_all()
+	assert table.column_names == ['type', 'id', 'name', 'status', 'deleted', 'type_full', 'pointers_from']
+	rows = table.to_pylist()
+	assert [(row['type'], row['id'], row['name'], row['type_full'], row['pointers_from']) for row in rows] == [('account', '1', 'Acme', 'account.publisher', [1]), ('site', '10', None, None, [])]
+	metadata = dict((key.decode('utf-8'), json.loads(value)) for (key, value) in table.schema.metadata.items())
+	assert metadata == {'max_depth': 1, 'statistics': {'objects': 2}}
+
+def test_compress_round_trips():
+	data = json.dumps(network_body()).encode('utf-8') * 20
+	assert gzip.decompress(wire.compress(data, 'gzip')) == data
+	brotli = pytest.importorskip('brotli')
+	assert brotli.decompress(wire.compress(data, 'br')) == data
+	zstandard = pytest.importorskip('zstandard')
+	assert zstandard.ZstdDecompressor().decompress(wire.compress(data, 'zstd')) == data
+
+def test_encodings_best_first(monkeypatch):
+	monkeypatch.setattr(wire, 'zstandard', object())
+	monkeypatch.setattr(wire, 'brotli', object())
+	assert wire.available_encodings() == ['zstd', 'br', 'gzip']
+	monkeypatch.setattr(wire, 'zstandard', None)
+	monkeypatch.setattr(wire, 'brotli', None)
+	assert wire.available_encodings() == ['gzip']
+
+
+def send(accept_encoding, payload = None, gzipped = None):
+	import api
+	headers = {'Accept-Encoding': accept_encoding} if accept_encoding is not None else {}
+	with api.app.test_request_context('/api/getNetwork', headers=headers):
+		return api.send_payload('application/json', 'objviz; fwd=miss', None, payload, gzipped)
+
+def test_send_payload_picks_the_best_accepted_encoding():
+	pytest.importorskip('brotli')
+	pytest.importorskip('zstandard')
+	payload = b'{"network": {}}' * 20
+	assert send('gzip, br, zstd', payload).headers['Content-Encoding'] == 'zstd'
+	assert send('gzip, br', payload).headers['Content-Encoding'] == 'br'
+	assert send('gzip', payload).headers['Content-Encoding'] == 'gzip'
+	assert send('zstd;q=0.1, gzip', payload).headers['Content-Encoding'] == 'gzip'
+	response = send(None, payload)
+	assert 'Content-Encoding' not in response.headers
+	assert response.get_data() == payload
+	assert response.headers['Vary'] == 'Accept, Accept-Encoding'
+
+def test_send_payload_reuses_cached_gzip():
+	brotli = pytest.importorskip('brotli')
+	pytest.importorskip('zstandard')
+	payload = b'{"network": {}}' * 20
+	gzipped = gzip.compress(payload)
+	response = send('zstd, gzip', gzipped=gzipped) # without the payload at hand, the cached copy is sent rather than recompressed
+	assert response.headers['Content-Encoding'] == 'gzip'
+	assert response.get_data() == gzipped
+	assert send('zstd, gzip', payload, gzipped).headers['Content-Encoding'] == 'zstd'
+	assert send('gzip', payload, gzipped).get_data() == gzipped
+	response = send('br', gzipped=gzipped) # a client that does not take gzip gets the payload unpacked and compressed again
+	assert response.headers['Content-Encoding'] == 'br'
+	assert brotli.decompress(response.get_data()) == payload
+	assert send(None, gzipped=gzipped).get_data() == payload
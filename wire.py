@@ -0,0 +1,129 @@
+import gzip
+import json
+try:
+	import msgpack
+except ImportError: # the binary formats and extra encodings are optional; without them only JSON and gzip are offered
+	msgpack = None
+try:
+	import pyarrow
+	import pyarrow.ipc
+except ImportError:
+	pyarrow = None
+try:
+	import brotli
+except ImportError:
+	brotli = None
+try:
+	import zstandard
+except ImportError:
+	zstandard = None
+
+
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+ZSTD_LEVEL = 3
+
+MEDIA_TYPES = {'json': 'application/json', 'columns': 'application/json', 'msgpack': 'application/msgpack', 'arrow': 'application/vnd.apache.arrow.stream'}
+ACCEPTED_TYPES = {'application/json': 'json', 'application/msgpack': 'msgpack', 'application/x-msgpack': 'msgpack', 'application/vnd.apache.arrow.stream': 'arrow'} # JSON first, so */* gets JSON
+
+
+def available_formats():
+	"""
+	Lists the getNetwork response formats this process can produce: "json" (the network as a dict of node dicts),
+	"columns" (the network as parallel columns, see GraphStore.to_columns), and, if their packages are installed,
+	"msgpack" (the columnar response as MessagePack) and "arrow" (one Arrow IPC stream record batch per network)
+	:returns: the format names
+	:rtype: list
+	"""
+	formats = ['json', 'columns']
+	if msgpack is not None:
+		formats.append('msgpack')
+	if pyarrow is not None:
+		formats.append('arrow')
+	return formats
+
+def negotiate_format(accept):
+	"""
+	Picks the response format a client prefers from its Accept header
+	:param accept: the request's parsed Accept header
+	:type accept: werkzeug.datastructures.MIMEAccept
+	:returns: one of available_formats(), "json" if the client prefers none of them
+	:rtype: str
+	"""
+	offered = [media_type for (media_type, fmt) in ACCEPTED_TYPES.items() if fmt in available_formats()]
+	return ACCEPTED_TYPES[accept.best_match(offered, 'application/json')]
+
+def available_encodings():
+	"""
+	Lists the content encodings this process can compress responses with, best first
+	:returns: the encoding names, as used in Accept-Encoding
+	:rtype: list
+	"""
+	encodings = []
+	if zstandard is not None:
+		encodings.append('zstd')
+	if brotli is not None:
+		encodings.append('br')
+	encodings.append('gzip')
+	return encodings
+
+def encode_body(body, fmt):
+	"""
+	Serializes a getNetwork response
+	:param body: the response, whose network is columnar (see GraphStore.to_columns) unless fmt is "json"
+	:type body: dict
+	:param fmt: one of available_formats()
+	:type fmt: str
+	:returns: the serialized response
+	:rtype: bytes
+	"""
+	if fmt == 'msgpack':
+		return msgpack.packb(body, use_bin_type=True)
+	if fmt == 'arrow':
+		return arrow_stream(body)
+	return json.dumps(body, sort_keys=True).encode('utf-8')
+
+def arrow_stream(body):
+	"""
+	Serializes a columnar getNetwork response as an Arrow IPC stream: one record batch with a row per node, where
+	type, status, deleted and type_full are dictionary-encoded and pointers_from is a list column, and the rest of the
+	response JSON-encoded in the schema's metadata
+	:param body: the response, with a columnar network
+	:type body: dict
+	:returns: the stream
+	:rtype: bytes
+	"""
+	columns = body['network']
+	values = pyarrow.array(columns['values'], pyarrow.string())
+	def coded(codes, dictionary):
+		return pyarrow.DictionaryArray.from_arrays(pyarrow.array(codes, pyarrow.int32()), dictionary)
+	batch = pyarrow.RecordBatch.from_arrays([
+		coded(columns['type'], pyarrow.array(columns['types'], pyarrow.string())),
+		pyarrow.array(columns['id'], pyarrow.string()),
+		pyarrow.array(columns['name'], pyarrow.string()),
+		coded(columns['status'], values),
+		coded(columns['deleted'], values),
+		coded(columns['type_full'], values),
+		pyarrow.ListArray.from_arrays(pyarrow.array(columns['pointer_offsets'], pyarrow.int32()), pyarrow.array(columns['pointers'], pyarrow.int32())),
+	], names=['type', 'id', 'name', 'status', 'deleted', 'type_full', 'pointers_from'])
+	batch = batch.replace_schema_metadata(dict((key, json.dumps(value, sort_keys=True)) for (key, value) in body.items() if key != 'network'))
+	sink = pyarrow.BufferOutputStream()
+	with pyarrow.ipc.new_stream(sink, batch.schema) as writer:
+		writer.write_batch(batch)
+	return sink.getvalue().to_pybytes()
+
+def compress(data, encoding):
+	"""
+	Compresses a response body
+	:param data: the body
+	:type data: bytes
+	:param encoding: one of available_encodings()
+	:type encoding: str
+	:returns: the compressed body
+	:rtype: bytes
+	"""
+	if encoding == 'zstd':
+		return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+	if encoding == 'br':
+		return brotli.compress(data, quality=BROTLI_QUALITY)
+	return gzip.compress(data, compresslevel=GZIP_LEVEL)